@@ -0,0 +1,111 @@
+"""
+Microbenchmark: gallery asset path resolution on a synthetic 5k-file archive.
+
+Compares the resolver get_asset used before the resolution index (four path
+variants, each with a linear case-insensitive scan over files_dict) with
+zip_store.resolve, which is a single dict hit per lookup map.
+
+Run from the repository root:
+    python benchmarks/bench_asset_resolver.py
+"""
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Publish into a throwaway store
+os.environ['ZIP_STORE_DIR'] = tempfile.mkdtemp(prefix="bench_zip_store_")
+import zip_store
+
+FILE_COUNT = 5000
+REQUEST_COUNT = 2000
+
+
+def build_archive(file_count):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_ref:
+        zip_ref.writestr("index.html", "<html></html>")
+        for i in range(file_count - 1):
+            folder = ("images", "audio", "scripts", "css")[i % 4]
+            zip_ref.writestr(f"{folder}/level{i % 17}/Asset_{i}.bin", b"")
+    return buffer.getvalue()
+
+
+def old_files_dict(temp_dir, files):
+    # files_dict as extract_zip_and_process_html used to build it
+    files_dict = {}
+    for rel_path in files:
+        abs_path = os.path.join(temp_dir, *rel_path.split('/'))
+        files_dict[rel_path] = abs_path
+        files_dict[rel_path.replace('/', os.path.sep)] = abs_path
+        files_dict[rel_path.rsplit('/', 1)[-1]] = abs_path
+    return files_dict
+
+
+def old_resolve(files_dict, asset_path):
+    # get_asset's lookup before the resolution index, without the prints
+    possible_paths = [
+        asset_path,
+        asset_path.replace('/', os.path.sep),
+        asset_path.replace(os.path.sep, '/'),
+        os.path.basename(asset_path)
+    ]
+    for path in possible_paths:
+        if path in files_dict:
+            return files_dict[path]
+        lower_path = path.lower()
+        for dict_path, file_path in files_dict.items():
+            if dict_path.lower() == lower_path:
+                return file_path
+    return None
+
+
+def make_requests(files, count):
+    rng = random.Random(42)
+    paths = list(files)
+    requests = []
+    for _ in range(count):
+        path = rng.choice(paths)
+        kind = rng.randrange(3)
+        if kind == 1:
+            path = path.upper()
+        elif kind == 2:
+            path = "missing/" + path.rsplit('/', 1)[-1]
+        requests.append(path)
+    return requests
+
+
+def bench(label, resolver, requests):
+    start = time.perf_counter()
+    for path in requests:
+        resolver(path)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {elapsed * 1000:10.1f} ms total  {elapsed / len(requests) * 1e6:10.1f} us/lookup")
+    return elapsed
+
+
+def main():
+    zip_data = build_archive(FILE_COUNT)
+
+    start = time.perf_counter()
+    digest, files_dir, manifest = zip_store.publish(zip_data, mode="archive")
+    print(f"Published {len(manifest['files'])} files and built the index in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    files_dict = old_files_dict(files_dir, manifest["files"])
+    requests = make_requests(manifest["files"], REQUEST_COUNT)
+
+    old = bench("old", lambda path: old_resolve(files_dict, path), requests)
+    new = bench("indexed", lambda path: zip_store.resolve(manifest, path), requests)
+    print(f"Speedup: {old / new:.0f}x")
+
+    shutil.rmtree(zip_store.ZIP_STORE_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark: LEA chat prompt size and context-building time over a long conversation.
+
+Replays a synthetic 200-turn transcript and, at each turn, builds the prompt
+the way /api/lea/send-message used to (system prompt plus the whole history)
+and with chat_context's token-budgeted window. Reports prompt tokens and the
+time spent building the prompt (including token counting) as the
+conversation grows.
+
+Run from the repository root:
+    python benchmarks/bench_chat_context.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat_context
+
+TURNS = 200
+MODEL = "gpt-4o"
+SYSTEM_PROMPT = "You are LEA, an assistant that helps teachers design lessons. " * 20
+REPORT_AT = (10, 25, 50, 100, 150, 200)
+
+WORDS = ("lesson", "students", "fractions", "worksheet", "inquiry", "assessment", "photosynthesis",
+         "group", "activity", "rubric", "feedback", "objective", "scaffold", "example", "question")
+
+
+def make_text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)) + "."
+
+
+def full_replay_tokens(system_prompt, messages):
+    # Everything is sent, and nothing is cached between turns
+    api_messages = [{"role": "system", "content": system_prompt}]
+    api_messages.extend({"role": msg["role"], "content": msg["content"]} for msg in messages)
+    return sum(chat_context.count_text_tokens(msg["content"], MODEL) + chat_context.MESSAGE_OVERHEAD_TOKENS
+               for msg in api_messages) + chat_context.REPLY_PRIMER_TOKENS
+
+
+def main():
+    rng = random.Random(7)
+    encoding = chat_context.encoding_name(MODEL)
+    print(f"Token counts: {encoding} encoding, budget {chat_context.CONTEXT_TOKEN_BUDGET} tokens")
+
+    old_history = []
+    new_history = []
+    old_time = new_time = 0.0
+    print(f"{'turn':>5} {'full replay':>12} {'windowed':>10} {'build (full)':>13} {'build (window)':>15}")
+    for turn in range(1, TURNS + 1):
+        user = {"role": "user", "content": make_text(rng, rng.randint(10, 60))}
+        reply = make_text(rng, rng.randint(80, 250))
+
+        old_history.append(dict(user))
+        # The token counts a plain string cache can't help with: every message is re-encoded
+        chat_context._count.cache_clear()
+        start = time.perf_counter()
+        old_tokens = full_replay_tokens(SYSTEM_PROMPT, old_history)
+        old_elapsed = time.perf_counter() - start
+        old_time += old_elapsed
+
+        chat_context._count.cache_clear()
+        start = time.perf_counter()
+        chat_context.message_tokens(user, MODEL)
+        new_history.append(user)
+        window = new_history[-chat_context.CONTEXT_MAX_MESSAGES:]
+        window_start, new_tokens = chat_context.select_window(SYSTEM_PROMPT, window, MODEL)
+        chat_context.build_context(SYSTEM_PROMPT, window, MODEL)
+        new_elapsed = time.perf_counter() - start
+        new_time += new_elapsed
+
+        assistant = {"role": "assistant", "content": reply}
+        chat_context.message_tokens(assistant, MODEL)
+        old_history.append(dict(assistant))
+        new_history.append(assistant)
+
+        if turn in REPORT_AT:
+            print(f"{turn:>5} {old_tokens:>12} {new_tokens:>10} {old_elapsed * 1000:>11.2f}ms {new_elapsed * 1000:>13.2f}ms")
+
+    print(f"Total prompt-building time over {TURNS} turns: full replay {old_time * 1000:.0f} ms, "
+          f"windowed {new_time * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark: preparing an uploaded photo for the LEA vision call.
+
+Compares the old /api/lea/upload-image path (write the upload to a temporary
+file, read it back and base64-encode it at full resolution) with
+chat_images.prepare_image (decode once in memory, downsize to the vision
+model's resolution, encode once). Uses synthetic phone-sized photos and
+reports the time per upload and the data URL sent upstream.
+
+Needs Pillow. Run from the repository root:
+    python benchmarks/bench_chat_images.py
+"""
+import base64
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter
+
+import chat_images
+
+RUNS = 10
+SIZES = ((4032, 3024), (3024, 4032), (1600, 1200), (800, 600))
+
+
+def make_photo(width, height, seed=3):
+    """A JPEG with shapes and grain, so it compresses like a photo rather than a flat fill"""
+    rng = random.Random(seed)
+    img = Image.effect_noise((width, height), 40).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(60):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(20, max(21, width // 6))
+        draw.ellipse((x - r, y - r, x + r, y + r),
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    img = img.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def old_path(content, filename):
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.' + filename.split('.')[-1]) as temp_file:
+        temp_path = temp_file.name
+        temp_file.write(content)
+    with open(temp_path, "rb") as image_file:
+        base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+    os.unlink(temp_path)
+    return f"data:image/{filename.split('.')[-1]};base64,{base64_image}"
+
+
+def new_path(content, filename):
+    image_data, content_type = chat_images.prepare_image(content, filename)
+    return f"data:{content_type};base64,{base64.b64encode(image_data).decode('ascii')}"
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        result = func(*args)
+    return (time.perf_counter() - start) / RUNS, result
+
+
+def main():
+    print(f"{'upload':>11} {'file':>9} {'old ms':>8} {'old payload':>12} {'new ms':>8} {'new payload':>12}")
+    for width, height in SIZES:
+        content = make_photo(width, height)
+        old_time, old_url = timed(old_path, content, "photo.jpg")
+        new_time, new_url = timed(new_path, content, "photo.jpg")
+        print(f"{width:>5}x{height:<5} {len(content) / 1024:>7.0f}KB {old_time * 1000:>8.1f} "
+              f"{len(old_url) / 1024:>10.0f}KB {new_time * 1000:>8.1f} {len(new_url) / 1024:>10.0f}KB")
+
+
+if __name__ == "__main__":
+    main()
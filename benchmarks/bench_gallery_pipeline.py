@@ -0,0 +1,140 @@
+"""
+Benchmark: the gallery upload and preview pipeline, offline.
+
+Runs against blob_storage's local backend in throwaway directories:
+uploads a set of submissions (each a ZIP plus reference images, with
+resubmitted ZIPs and shared images as in real galleries), runs the link
+health check's existence checks, then builds every preview the way
+build_preview does (blob_cache.fetch, zip_store.publish, inline_assets).
+Reports timings and how much the content-addressed store deduplicated.
+
+Run from the repository root:
+    python benchmarks/bench_gallery_pipeline.py
+"""
+import asyncio
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Point every store at a throwaway directory and force the local backend
+BENCH_DIR = tempfile.mkdtemp(prefix="bench_gallery_")
+os.environ['BLOB_STORAGE'] = "local"
+os.environ['BLOB_LOCAL_DIR'] = os.path.join(BENCH_DIR, "blobs")
+os.environ['BLOB_CACHE_DIR'] = os.path.join(BENCH_DIR, "blob_cache")
+os.environ['ZIP_STORE_DIR'] = os.path.join(BENCH_DIR, "zip_store")
+import blob_cache
+import blob_storage
+import blob_upload
+import gallery_html
+import zip_store
+
+SUBMISSIONS = 60
+DISTINCT_ZIPS = 20  # the rest are resubmissions of the same package
+SHARED_IMAGES = 10
+IMAGES_PER_SUBMISSION = 3
+ASSETS_PER_ZIP = 30
+
+
+def build_package(seed):
+    buffer = io.BytesIO()
+    body = []
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(ASSETS_PER_ZIP):
+            zip_ref.writestr(f"css/style{i}.css", f".rule{seed}-{i} {{ color: #{i:06x}; }}\n" * 40)
+            body.append(f'<link rel="stylesheet" href="css/style{i}.css">')
+            zip_ref.writestr(f"images/pic{i}.png", os.urandom(4096))
+            body.append(f'<img src="images/pic{i}.png">')
+        zip_ref.writestr("index.html", f"<html><body><h1>Package {seed}</h1>\n" + "\n".join(body) + "</body></html>")
+    return buffer.getvalue()
+
+
+async def chunks(data, size=64 * 1024):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def files_dict_for(manifest):
+    files_dict = {}
+    for rel_path in manifest["files"]:
+        files_dict[rel_path] = rel_path
+        files_dict[rel_path.rsplit('/', 1)[-1]] = rel_path
+    return files_dict
+
+
+def build_preview_html(zip_path):
+    digest, _, manifest = zip_store.publish(zip_path)
+    html_content = gallery_html.read_store_text(digest, manifest, "index.html")
+    return gallery_html.inline_assets(html_content, digest, manifest, files_dict_for(manifest))
+
+
+async def upload_all(storage, packages, images):
+    submissions = []
+    logical_bytes = 0
+    for i in range(SUBMISSIONS):
+        package = packages[i % DISTINCT_ZIPS]
+        result = await storage.put_stream(blob_upload.make_pathname("lesson.zip"), chunks(package), "application/zip")
+        references = []
+        for j in range(IMAGES_PER_SUBMISSION):
+            image = images[(i + j) % SHARED_IMAGES]
+            references.append((await storage.put_stream(blob_upload.make_pathname("ref.png"), chunks(image), "image/png"))["url"])
+            logical_bytes += len(image)
+        logical_bytes += len(package)
+        submissions.append({"zipUrl": result["url"], "referenceImages": references})
+    return submissions, logical_bytes
+
+
+async def run():
+    storage = blob_storage.get_storage()
+    packages = [build_package(seed) for seed in range(DISTINCT_ZIPS)]
+    images = [os.urandom(200 * 1024) for _ in range(SHARED_IMAGES)]
+
+    start = time.perf_counter()
+    submissions, logical_bytes = await upload_all(storage, packages, images)
+    upload_time = time.perf_counter() - start
+    stored_bytes = directory_size(os.path.join(blob_storage.BLOB_LOCAL_DIR, "objects"))
+    print(f"Uploaded {SUBMISSIONS} submissions in {upload_time * 1000:.0f} ms: "
+          f"{logical_bytes / 1024 / 1024:.1f} MB uploaded, {stored_bytes / 1024 / 1024:.1f} MB stored "
+          f"({logical_bytes / stored_bytes:.1f}x deduplication)")
+
+    start = time.perf_counter()
+    urls = [url for submission in submissions for url in [submission["zipUrl"]] + submission["referenceImages"]]
+    results = await asyncio.gather(*(storage.head(url) for url in urls))
+    print(f"Checked {len(urls)} blob URLs in {(time.perf_counter() - start) * 1000:.1f} ms, all present: {all(results)}")
+
+    for label in ("cold", "warm"):
+        start = time.perf_counter()
+        for submission in submissions:
+            zip_path = await blob_cache.fetch(submission["zipUrl"])
+            await asyncio.to_thread(build_preview_html, zip_path)
+        print(f"Built {SUBMISSIONS} previews ({label} store) in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    for submission in submissions:
+        await storage.delete(submission["zipUrl"])
+        for url in submission["referenceImages"]:
+            await storage.delete(url)
+    print(f"Objects left after deleting every upload: {len(os.listdir(storage.objects_dir))}")
+
+
+def main():
+    try:
+        asyncio.run(run())
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
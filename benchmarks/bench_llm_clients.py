@@ -0,0 +1,132 @@
+"""
+Benchmark: per-call cost of creating an OpenAI client vs. the shared llm_clients registry.
+
+Starts a local mock of the chat completions endpoint over HTTPS (self-signed
+certificate via the openssl CLI; plain HTTP if it is missing) and makes the
+same sequential calls two ways: a new OpenAI/AsyncOpenAI client per call, as
+the route handlers used to, and llm_clients' shared client. Reports the mean
+time per call and how many TCP connections the server accepted.
+
+Needs the openai package. Run from the repository root:
+    python benchmarks/bench_llm_clients.py
+"""
+import asyncio
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CALLS = 50
+API_KEY = "sk-bench"
+
+COMPLETION = json.dumps({
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4o",
+    "choices": [{"index": 0, "finish_reason": "stop",
+                 "message": {"role": "assistant", "content": "Hello from the mock server."}}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 6, "total_tokens": 16}
+}).encode('utf-8')
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, *args):
+        pass
+
+
+class CountingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+
+def start_server(work_dir):
+    """Starts the mock server; returns (server, base_url)"""
+    server = CountingServer(("127.0.0.1", 0), MockHandler)
+    scheme = "http"
+    if shutil.which("openssl"):
+        cert = os.path.join(work_dir, "cert.pem")
+        key = os.path.join(work_dir, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                        "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                        "-keyout", key, "-out", cert], check=True, capture_output=True)
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        # httpx trusts the certificate through SSL_CERT_FILE
+        os.environ['SSL_CERT_FILE'] = cert
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def call(client):
+    return client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "Hi"}])
+
+
+def run_sync(label, server, get_client):
+    before = server.connections
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        call(get_client())
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {elapsed / CALLS * 1000:>8.2f} ms/call {server.connections - before:>6} connections")
+
+
+async def run_async(label, server, get_client):
+    before = server.connections
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        await call(get_client())
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {elapsed / CALLS * 1000:>8.2f} ms/call {server.connections - before:>6} connections")
+
+
+def main():
+    from openai import AsyncOpenAI, OpenAI
+    import llm_clients
+
+    work_dir = tempfile.mkdtemp(prefix="bench_llm_clients_")
+    try:
+        server, base_url = start_server(work_dir)
+        print(f"Mock server at {base_url}, {CALLS} sequential calls each, HTTP/2: {llm_clients.LLM_HTTP2}")
+
+        run_sync("OpenAI client per call", server, lambda: OpenAI(api_key=API_KEY, base_url=base_url))
+        run_sync("llm_clients.get_openai", server, lambda: llm_clients.get_openai(API_KEY, base_url=base_url))
+
+        async def run_both():
+            await run_async("AsyncOpenAI client per call", server,
+                            lambda: AsyncOpenAI(api_key=API_KEY, base_url=base_url))
+            await run_async("llm_clients.get_async_openai", server,
+                            lambda: llm_clients.get_async_openai(API_KEY, base_url=base_url))
+        asyncio.run(run_both())
+        server.shutdown()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Microbenchmark: inlining assets into a gallery preview's HTML.
+
+Compares the per-file regex loops extract_zip_and_process_html used before
+gallery_html.inline_assets (one re.sub over the whole HTML per files_dict
+key) with the single-pass rewriter, on a synthetic 200-asset package, and
+checks that both produce identical HTML.
+
+Run from the repository root:
+    python benchmarks/bench_preview_inlining.py
+"""
+import base64
+import io
+import mimetypes
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Publish into a throwaway store
+os.environ['ZIP_STORE_DIR'] = tempfile.mkdtemp(prefix="bench_zip_store_")
+import zip_store
+import gallery_html
+
+CSS_COUNT = 40
+JS_COUNT = 40
+IMAGE_COUNT = 120
+FILLER_PARAGRAPHS = 2000
+ROUNDS = 5
+
+
+def build_package():
+    buffer = io.BytesIO()
+    body = []
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(CSS_COUNT):
+            zip_ref.writestr(f"css/style{i}.css", f".rule{i} {{ color: #{i:06x}; }}\n" * 50)
+            href = f"css/style{i}.css" if i % 2 else f"style{i}.css"
+            body.append(f'<link rel="stylesheet" href="{href}">')
+        for i in range(JS_COUNT):
+            zip_ref.writestr(f"js/script{i}.js", f"var value{i} = {i};\nconsole.log(value{i});\n" * 50)
+            body.append(f'<script type="text/javascript" src="js/script{i}.js"></script>')
+        for i in range(IMAGE_COUNT):
+            extension = ("png", "gif", "svg")[i % 3]
+            zip_ref.writestr(f"images/pic{i}.{extension}", os.urandom(2048))
+            body.append(f'<img alt="picture {i}" src="images/pic{i}.{extension}">')
+        for i in range(FILLER_PARAGRAPHS):
+            body.append(f"<p>Paragraph {i} of the lesson text, with <a href='#s{i}'>a link</a>.</p>")
+        zip_ref.writestr("index.html", "<html><head></head><body>\n" + "\n".join(body) + "\n</body></html>")
+    return buffer.getvalue()
+
+
+def files_dict_for(manifest):
+    # files_dict as extract_zip_and_process_html builds it
+    files_dict = {}
+    for rel_path in manifest["files"]:
+        files_dict[rel_path] = rel_path
+        files_dict[rel_path.replace('/', os.path.sep)] = rel_path
+        files_dict[rel_path.rsplit('/', 1)[-1]] = rel_path
+    return files_dict
+
+
+def old_inline(html_content, digest, manifest, files_dict):
+    # The loops extract_zip_and_process_html ran before the single-pass rewriter
+    for file_rel_path, file_store_path in files_dict.items():
+        if manifest["files"][file_store_path] < 1024 * 1024:
+            if file_rel_path.endswith('.css'):
+                css_content = gallery_html.read_store_text(digest, manifest, file_store_path)
+                pattern = f'<link[^>]*href=[\'"]({re.escape(file_rel_path)})[\'"][^>]*>'
+                html_content = re.sub(pattern, f'<style>{css_content}</style>', html_content)
+            elif file_rel_path.endswith('.js'):
+                js_content = gallery_html.read_store_text(digest, manifest, file_store_path)
+                pattern = f'<script[^>]*src=[\'"]({re.escape(file_rel_path)})[\'"][^>]*></script>'
+                html_content = re.sub(pattern, f'<script>{js_content}</script>', html_content)
+
+    for rel_path, store_path in files_dict.items():
+        if manifest["files"][store_path] < 100 * 1024:
+            if any(rel_path.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.svg']):
+                img_data = zip_store.read_file(digest, manifest, store_path)
+                mime_type, _ = mimetypes.guess_type(rel_path)
+                if not mime_type:
+                    mime_type = "image/png"
+                data_uri = f"data:{mime_type};base64,{base64.b64encode(img_data).decode('utf-8')}"
+                html_content = re.sub(
+                    f'src=[\'"]({re.escape(rel_path)})[\'"]',
+                    f'src="{data_uri}"',
+                    html_content
+                )
+    return html_content
+
+
+def bench(label, inliner, html_content, digest, manifest, files_dict):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        result = inliner(html_content, digest, manifest, files_dict)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<12} {best * 1000:10.1f} ms (best of {ROUNDS})")
+    return best, result
+
+
+def main():
+    digest, _, manifest = zip_store.publish(build_package())
+    files_dict = files_dict_for(manifest)
+    html_content = gallery_html.read_store_text(digest, manifest, "index.html")
+    print(f"{len(manifest['files']) - 1} assets, {len(html_content) / 1024:.0f} KB of HTML")
+
+    old, old_html = bench("old", old_inline, html_content, digest, manifest, files_dict)
+    new, new_html = bench("single-pass", gallery_html.inline_assets, html_content, digest, manifest, files_dict)
+    print(f"Speedup: {old / new:.0f}x, identical output: {old_html == new_html}")
+
+    shutil.rmtree(zip_store.ZIP_STORE_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import httpx
+
+import blob_storage
+
+# On-disk cache of downloaded blobs (submission ZIPs), keyed by URL:
+#   {BLOB_CACHE_DIR}/{sha256(url)}.blob   the downloaded body
+#   {BLOB_CACHE_DIR}/{sha256(url)}.json   url, ETag, Last-Modified, size, fetched_at
+# Blobs stored on local disk (blob_storage's local backend) are used in place.
+# Downloads stream to a temporary file in the cache directory and are moved
+# into place with os.replace, so readers only ever see complete blobs.
+# Entries younger than BLOB_CACHE_FRESH_SECONDS are used without a network
+# call; older ones are revalidated with If-None-Match / If-Modified-Since.
+# The least recently used blobs are evicted past BLOB_CACHE_MAX_BYTES.
+BLOB_CACHE_DIR = os.environ.get('BLOB_CACHE_DIR', os.path.join(tempfile.gettempdir(), "gallery_blob_cache"))
+BLOB_CACHE_MAX_BYTES = int(os.environ.get('BLOB_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))  # 2 GB
+BLOB_CACHE_FRESH_SECONDS = int(os.environ.get('BLOB_CACHE_FRESH_SECONDS', 3600))
+BLOB_FETCH_MAX_BYTES = int(os.environ.get('BLOB_FETCH_MAX_BYTES', 200 * 1024 * 1024))  # 200 MB
+BLOB_FETCH_TIMEOUT = float(os.environ.get('BLOB_FETCH_TIMEOUT', 60))  # seconds for the whole download
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobFetchError(Exception):
+    """A blob could not be downloaded (HTTP error, too large or timed out)"""
+
+
+def _paths(url):
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return os.path.join(BLOB_CACHE_DIR, f"{key}.blob"), os.path.join(BLOB_CACHE_DIR, f"{key}.json")
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(meta_path, meta):
+    tmp_path = f"{meta_path}.{os.urandom(4).hex()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+async def _download(url, meta, blob_path, meta_path):
+    """Fetches url (conditionally if meta is set) into the cache; returns False on 304"""
+    headers = {}
+    if meta:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    async with blob_storage.get_storage().get_stream(url, headers) as response:
+        if response.status_code == 304 and meta:
+            return False
+        if response.status_code != 200:
+            raise BlobFetchError(f"Download of {url} failed with HTTP {response.status_code}")
+
+        content_length = response.headers.get('content-length')
+        if content_length and content_length.isdigit() and int(content_length) > BLOB_FETCH_MAX_BYTES:
+            raise BlobFetchError(f"{url} is {content_length} bytes, over the {BLOB_FETCH_MAX_BYTES} byte limit")
+
+        os.makedirs(BLOB_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".download-", dir=BLOB_CACHE_DIR)
+        try:
+            size = 0
+            with os.fdopen(fd, 'wb') as f:
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > BLOB_FETCH_MAX_BYTES:
+                        raise BlobFetchError(f"{url} is over the {BLOB_FETCH_MAX_BYTES} byte limit")
+                    f.write(chunk)
+            os.replace(tmp_path, blob_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        _write_meta(meta_path, {
+            "url": url,
+            "etag": response.headers.get('etag'),
+            "last_modified": response.headers.get('last-modified'),
+            "size": size,
+            "fetched_at": time.time()
+        })
+    return True
+
+
+async def fetch(url):
+    """
+    Returns the path of a local copy of url, downloading or revalidating it if needed.
+
+    Raises:
+        BlobFetchError: If the blob cannot be downloaded and no cached copy exists
+    """
+    local_path = blob_storage.get_storage().local_path(url)
+    if local_path:
+        # Blobs on this machine's storage backend are read in place
+        return local_path
+
+    blob_path, meta_path = _paths(url)
+    meta = _read_meta(meta_path) if os.path.exists(blob_path) else None
+
+    if meta and time.time() - meta.get('fetched_at', 0) < BLOB_CACHE_FRESH_SECONDS:
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        return blob_path
+
+    try:
+        downloaded = await asyncio.wait_for(_download(url, meta, blob_path, meta_path), BLOB_FETCH_TIMEOUT)
+    except (BlobFetchError, httpx.HTTPError, asyncio.TimeoutError) as e:
+        if meta:
+            # Serve the cached copy rather than failing while the blob host is unavailable
+            print(f"Revalidating {url} failed ({str(e) or type(e).__name__}); using cached copy")
+            return blob_path
+        if isinstance(e, BlobFetchError):
+            raise
+        raise BlobFetchError(f"Download of {url} failed: {str(e) or type(e).__name__}") from e
+
+    if downloaded:
+        print(f"Downloaded {url} into the blob cache")
+        await asyncio.to_thread(evict, keep=blob_path)
+    else:
+        meta["fetched_at"] = time.time()
+        _write_meta(meta_path, meta)
+    return blob_path
+
+
+def evict(max_bytes=None, keep=None):
+    """
+    Removes least recently used blobs until the cache fits in max_bytes.
+    The blob at keep (usually the one just downloaded) is never removed.
+
+    Returns:
+        int: Number of blobs removed
+    """
+    if max_bytes is None:
+        max_bytes = BLOB_CACHE_MAX_BYTES
+    if not os.path.isdir(BLOB_CACHE_DIR):
+        return 0
+
+    entries = []
+    total_size = 0
+    removed = 0
+    now = time.time()
+    for name in os.listdir(BLOB_CACHE_DIR):
+        if name.startswith(".download-"):
+            # Partial downloads left behind by a crashed worker
+            path = os.path.join(BLOB_CACHE_DIR, name)
+            try:
+                if now - os.path.getmtime(path) > 3600:
+                    os.remove(path)
+            except OSError:
+                pass
+            continue
+        if not name.endswith('.blob'):
+            continue
+        blob_path = os.path.join(BLOB_CACHE_DIR, name)
+        meta_path = blob_path[:-len('.blob')] + '.json'
+        try:
+            size = os.path.getsize(blob_path)
+            last_used = os.path.getmtime(meta_path) if os.path.exists(meta_path) else 0
+        except OSError:
+            continue
+        total_size += size
+        if blob_path != keep:
+            entries.append((last_used, size, blob_path, meta_path))
+
+    entries.sort()
+    for _, size, blob_path, meta_path in entries:
+        if total_size <= max_bytes:
+            break
+        for path in (meta_path, blob_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total_size -= size
+        removed += 1
+    return removed
@@ -0,0 +1,355 @@
+import abc
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+
+import httpx
+
+import blob_upload
+
+# Where gallery uploads (ZIPs and reference images) are stored. Every path that
+# touches a blob (uploads, preview downloads, link health checks) goes through
+# get_storage(), so the backend can be swapped without touching the routes.
+#
+#   vercel  Vercel Blob (needs BLOB_READ_WRITE_TOKEN); browsers upload directly
+#   local   Content-addressed files under BLOB_LOCAL_DIR, served by this app:
+#             {BLOB_LOCAL_DIR}/objects/{sha256}   one copy of each distinct body
+#             {BLOB_LOCAL_DIR}/paths/{pathname}   hard link to its object
+#             {BLOB_LOCAL_DIR}/meta/{pathname}    JSON: content type checked at
+#                                                 upload, sha256, inode and size
+#           Identical uploads share one object; an object is removed with its
+#           last pathname. Used by default when no Blob token is set.
+BLOB_STORAGE = os.environ.get('BLOB_STORAGE') or ('vercel' if blob_upload.BLOB_TOKEN else 'local')
+BLOB_LOCAL_DIR = os.environ.get('BLOB_LOCAL_DIR', os.path.join(os.getcwd(), "blob_storage"))
+BLOB_LOCAL_URL_PREFIX = "/api/blob/local/"
+BLOB_CONNECTIONS = int(os.environ.get('BLOB_FETCH_CONNECTIONS', 20))
+
+CHUNK_SIZE = 64 * 1024
+
+# Local blobs are served from the app's own origin, so only types a browser
+# can't run script from are served inline; everything else is a download
+INLINE_CONTENT_TYPES = (
+    "application/zip", "application/x-zip-compressed",
+    "image/png", "image/jpeg", "image/gif", "image/webp", "image/avif", "image/bmp",
+)
+
+
+def serve_inline(content_type):
+    """Whether a blob of this type may be displayed inline from the app's origin"""
+    return content_type.split(';', 1)[0].strip().lower() in INLINE_CONTENT_TYPES
+
+_storage = None
+_client = None
+
+
+def get_client():
+    """The shared, pooled HTTP client used for remote blob requests"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(60, connect=10),
+            limits=httpx.Limits(max_connections=BLOB_CONNECTIONS, max_keepalive_connections=BLOB_CONNECTIONS),
+            follow_redirects=True
+        )
+    return _client
+
+
+class BlobStorage(abc.ABC):
+    """
+    Interface every storage backend implements. Results of put and put_stream
+    are dicts shaped like the Vercel Blob API's (url, pathname, contentType,
+    contentDisposition, size).
+    """
+
+    name = None
+    # Whether browsers can upload straight to the backend with a client token
+    supports_direct_upload = False
+
+    @abc.abstractmethod
+    def put(self, pathname, data, content_type="application/octet-stream"):
+        """Stores bytes or a binary file object at pathname (blocking)"""
+
+    @abc.abstractmethod
+    async def put_stream(self, pathname, chunks, content_type="application/octet-stream"):
+        """Stores an async iterator of byte chunks at pathname"""
+
+    @contextlib.asynccontextmanager
+    async def get_stream(self, url, headers=None):
+        """
+        Async context manager for reading a blob. Yields a response with
+        status_code, headers and aiter_bytes(chunk_size); conditional request
+        headers (If-None-Match) may produce a 304.
+
+        Blobs are public, so any backend can read a URL over HTTP (for example
+        submissions uploaded before the backend was switched).
+        """
+        async with get_client().stream("GET", url, headers=headers or {}) as response:
+            yield response
+
+    async def head(self, url):
+        """Whether the blob at url exists"""
+        response = await get_client().head(url, timeout=5)
+        # Check if response is successful (2xx) or redirect (3xx)
+        return 200 <= response.status_code < 400
+
+    @abc.abstractmethod
+    async def delete(self, url):
+        """Deletes the blob at url"""
+
+    def local_path(self, url):
+        """The blob's path on this machine if it is stored locally, else None"""
+        return None
+
+
+class VercelBlobStorage(BlobStorage):
+    name = "vercel"
+    supports_direct_upload = True
+
+    def put(self, pathname, data, content_type="application/octet-stream"):
+        import vercel_blob
+        if hasattr(data, 'read'):
+            data = data.read()
+        result = vercel_blob.put(pathname, data, {"access": "public", "addRandomSuffix": "false"})
+        result.setdefault("size", len(data))
+        return result
+
+    async def put_stream(self, pathname, chunks, content_type="application/octet-stream"):
+        return await blob_upload.stream_upload(pathname, chunks, content_type)
+
+    async def delete(self, url):
+        import vercel_blob
+        await asyncio.to_thread(vercel_blob.delete, url)
+
+
+class LocalFileResponse:
+    """The subset of an httpx streaming response blob readers use, backed by a file"""
+
+    def __init__(self, path, status_code, headers):
+        self.path = path
+        self.status_code = status_code
+        self.headers = headers
+
+    async def aiter_bytes(self, chunk_size=CHUNK_SIZE):
+        if self.status_code != 200:
+            return
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
+class LocalBlobStorage(BlobStorage):
+    name = "local"
+
+    def __init__(self, root=None):
+        self.root = root or BLOB_LOCAL_DIR
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.paths_dir = os.path.join(self.root, "paths")
+        self.meta_dir = os.path.join(self.root, "meta")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.paths_dir, exist_ok=True)
+        os.makedirs(self.meta_dir, exist_ok=True)
+
+    def _path_for(self, pathname):
+        pathname = os.path.normpath(pathname.replace('\\', '/').lstrip('/'))
+        if pathname in ('', '.') or pathname.startswith('..') or os.path.isabs(pathname):
+            raise ValueError(f"Invalid blob pathname: {pathname}")
+        return os.path.join(self.paths_dir, pathname), pathname.replace(os.sep, '/')
+
+    def local_path(self, url):
+        if not url or not url.startswith(BLOB_LOCAL_URL_PREFIX):
+            return None
+        try:
+            path, _ = self._path_for(url[len(BLOB_LOCAL_URL_PREFIX):].split('?', 1)[0])
+        except ValueError:
+            return None
+        return path if os.path.isfile(path) else None
+
+    def _meta_path(self, path):
+        return os.path.join(self.meta_dir, os.path.relpath(path, self.paths_dir))
+
+    def _read_meta(self, path):
+        """
+        The metadata a pathname was stored with, or None if it is missing or
+        describes other content (the inode and size must match the file)
+        """
+        try:
+            with open(self._meta_path(path), encoding='utf-8') as f:
+                meta = json.load(f)
+            stat = os.stat(path)
+            if meta.get("inode") == stat.st_ino and meta.get("size") == stat.st_size:
+                return meta
+        except (OSError, ValueError, AttributeError):
+            pass
+        return None
+
+    def _write_meta(self, path, meta):
+        meta_path = self._meta_path(path)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        tmp_path = f"{meta_path}.{os.urandom(4).hex()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def content_type(self, path):
+        """The content type a local blob was stored with (application/octet-stream if unknown)"""
+        meta = self._read_meta(path)
+        return (meta or {}).get("contentType") or "application/octet-stream"
+
+    def _commit(self, tmp_path, digest, size, pathname, content_type):
+        """Moves a hashed temporary file into the object store and links pathname to it"""
+        path, pathname = self._path_for(pathname)
+        object_path = os.path.join(self.objects_dir, digest)
+        if os.path.exists(object_path):
+            os.remove(tmp_path)  # Already stored: keep the existing copy
+        else:
+            os.replace(tmp_path, object_path)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        link_path = f"{path}.{os.urandom(4).hex()}.tmp"
+        try:
+            os.link(object_path, link_path)
+        except OSError:
+            # Filesystems without hard links get a copy instead of sharing the object
+            with open(object_path, 'rb') as src, open(link_path, 'wb') as dst:
+                while chunk := src.read(CHUNK_SIZE):
+                    dst.write(chunk)
+        replaced = self._object_for(path) if os.path.exists(path) else None
+        # The metadata names the new file's inode, so until the rename below
+        # lands it doesn't match the old body (served as octet-stream meanwhile)
+        self._write_meta(path, {
+            "contentType": content_type,
+            "sha256": digest,
+            "inode": os.stat(link_path).st_ino,
+            "size": size
+        })
+        os.replace(link_path, path)
+        if replaced and replaced != object_path:
+            self._release(replaced)
+
+        return {
+            "url": f"{BLOB_LOCAL_URL_PREFIX}{pathname}",
+            "downloadUrl": f"{BLOB_LOCAL_URL_PREFIX}{pathname}?download=1",
+            "pathname": pathname,
+            "contentType": content_type,
+            "contentDisposition": f'inline; filename="{os.path.basename(pathname)}"',
+            "size": size,
+            "sha256": digest
+        }
+
+    def _object_for(self, path):
+        """The object a pathname was stored from (pathnames hold their object's content)"""
+        meta = self._read_meta(path)
+        if meta and meta.get("sha256"):
+            return os.path.join(self.objects_dir, meta["sha256"])
+        # No metadata for this content (written by an older version): hash it
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(CHUNK_SIZE):
+                sha.update(chunk)
+        return os.path.join(self.objects_dir, sha.hexdigest())
+
+    def _release(self, object_path):
+        """Removes an object once no pathname links to it (copies never share it)"""
+        try:
+            if os.stat(object_path).st_nlink <= 1:
+                os.remove(object_path)
+        except OSError:
+            pass
+
+    def _spool(self):
+        return tempfile.mkstemp(prefix=".upload-", dir=self.objects_dir)
+
+    def put(self, pathname, data, content_type="application/octet-stream"):
+        fd, tmp_path = self._spool()
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    data = [bytes(data)]
+                else:
+                    data = iter(lambda: data.read(CHUNK_SIZE), b'')
+                for chunk in data:
+                    sha.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            return self._commit(tmp_path, sha.hexdigest(), size, pathname, content_type)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+    async def put_stream(self, pathname, chunks, content_type="application/octet-stream"):
+        fd, tmp_path = self._spool()
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > blob_upload.BLOB_UPLOAD_MAX_BYTES:
+                        raise blob_upload.BlobUploadError(f"Upload is over the {blob_upload.BLOB_UPLOAD_MAX_BYTES} byte limit")
+                    sha.update(chunk)
+                    f.write(chunk)
+            return await asyncio.to_thread(self._commit, tmp_path, sha.hexdigest(), size, pathname, content_type)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+    @contextlib.asynccontextmanager
+    async def get_stream(self, url, headers=None):
+        if not url.startswith(BLOB_LOCAL_URL_PREFIX):
+            async with super().get_stream(url, headers) as response:
+                yield response
+            return
+        path = self.local_path(url)
+        if path is None:
+            yield LocalFileResponse(None, 404, {})
+            return
+        stat = os.stat(path)
+        # Objects are immutable, so the inode identifies the content
+        etag = f'"{stat.st_ino:x}-{stat.st_size:x}"'
+        response_headers = {
+            "etag": etag,
+            "content-length": str(stat.st_size),
+            "content-type": self.content_type(path)
+        }
+        status_code = 304 if (headers or {}).get('If-None-Match') == etag else 200
+        yield LocalFileResponse(path, status_code, response_headers)
+
+    async def head(self, url):
+        if not url.startswith(BLOB_LOCAL_URL_PREFIX):
+            return await super().head(url)
+        return self.local_path(url) is not None
+
+    async def delete(self, url):
+        path = self.local_path(url)
+        if path is None:
+            return
+        object_path = await asyncio.to_thread(self._object_for, path)
+        os.remove(path)
+        with contextlib.suppress(OSError):
+            os.remove(self._meta_path(path))
+        if object_path:
+            self._release(object_path)
+
+
+def get_storage():
+    """The configured storage backend (BLOB_STORAGE)"""
+    global _storage
+    if _storage is None:
+        if BLOB_STORAGE == "vercel":
+            _storage = VercelBlobStorage()
+        elif BLOB_STORAGE == "local":
+            _storage = LocalBlobStorage()
+        else:
+            raise ValueError(f"Unknown BLOB_STORAGE backend: {BLOB_STORAGE}")
+        print(f"Blob storage backend: {_storage.name}")
+    return _storage
@@ -0,0 +1,198 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import time
+
+import httpx
+
+# Uploads to Vercel Blob without holding the file in a worker.
+#
+# Direct uploads: the server signs a short-lived client token scoped to one
+# pathname, size limit and content type list (the format @vercel/blob uses for
+# client uploads), and the browser sends the file to the Blob API itself in
+# multipart chunks (static/js/blob_upload.js).
+#
+# Server fallback: /api/blob/upload streams the request body to the same
+# multipart API chunk by chunk, so at most one chunk is in memory at a time.
+BLOB_TOKEN = os.environ.get('BLOB_READ_WRITE_TOKEN')
+BLOB_API_URL = os.environ.get('BLOB_API_URL', 'https://blob.vercel-storage.com').rstrip('/')
+BLOB_API_VERSION = "7"
+BLOB_UPLOAD_CHUNK_SIZE = int(os.environ.get('BLOB_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))  # parts must be >= 5 MB except the last
+BLOB_UPLOAD_MAX_BYTES = int(os.environ.get('BLOB_UPLOAD_MAX_BYTES', 50 * 1024 * 1024))  # matches the upload forms
+BLOB_UPLOAD_TOKEN_TTL = int(os.environ.get('BLOB_UPLOAD_TOKEN_TTL', 600))  # seconds a client token stays valid
+# Browsers report ZIPs under several types, or none at all (application/octet-stream)
+BLOB_UPLOAD_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed", "application/octet-stream", "image/*")
+
+
+class BlobUploadError(Exception):
+    """An upload was rejected or the Blob API returned an error"""
+
+
+def _store_id(token):
+    # Read-write tokens look like vercel_blob_rw_{storeId}_{secret}
+    parts = token.split('_')
+    return parts[3] if len(parts) > 3 else ""
+
+
+def make_pathname(filename):
+    """A unique blob pathname for an uploaded file, keeping its extension"""
+    name = re.sub(r'[^A-Za-z0-9._-]+', '-', os.path.basename(filename or "upload")).strip('-.') or "upload"
+    stem, ext = os.path.splitext(name)
+    return f"{stem[:80]}-{os.urandom(8).hex()}{ext[:16]}"
+
+
+def content_type_allowed(content_type):
+    for allowed in BLOB_UPLOAD_CONTENT_TYPES:
+        if allowed.endswith('/*') and content_type.startswith(allowed[:-1]):
+            return True
+        if content_type == allowed:
+            return True
+    return False
+
+
+def sign_payload(payload, token):
+    return hmac.new(token.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def create_client_token(pathname, maximum_size, allowed_content_types=BLOB_UPLOAD_CONTENT_TYPES, token=None):
+    """
+    Signs a client token that only allows uploading pathname.
+
+    Args:
+        pathname (str): The blob pathname the browser may write
+        maximum_size (int): Largest accepted upload in bytes
+        allowed_content_types (tuple): Content types the upload may declare
+        token (str, optional): Read-write token to sign with; defaults to BLOB_READ_WRITE_TOKEN
+
+    Returns:
+        str: vercel_blob_client_{storeId}_{base64(signature.payload)}
+    """
+    token = token or BLOB_TOKEN
+    if not token:
+        raise BlobUploadError("BLOB_READ_WRITE_TOKEN not set")
+    payload = base64.b64encode(json.dumps({
+        "pathname": pathname,
+        "maximumSizeInBytes": maximum_size,
+        "allowedContentTypes": list(allowed_content_types),
+        "addRandomSuffix": False,
+        "validUntil": int((time.time() + BLOB_UPLOAD_TOKEN_TTL) * 1000),
+    }).encode('utf-8')).decode('ascii')
+    secured = f"{sign_payload(payload, token)}.{payload}"
+    return f"vercel_blob_client_{_store_id(token)}_{base64.b64encode(secured.encode('utf-8')).decode('ascii')}"
+
+
+def read_client_token(client_token, token):
+    """
+    Verifies a client token against the read-write token it was signed with.
+
+    Returns:
+        dict or None: The token's payload, or None if it is invalid or expired
+    """
+    prefix = f"vercel_blob_client_{_store_id(token)}_"
+    if not client_token.startswith(prefix):
+        return None
+    try:
+        signature, payload = base64.b64decode(client_token[len(prefix):]).decode('utf-8').split('.', 1)
+        claims = json.loads(base64.b64decode(payload))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not hmac.compare_digest(signature, sign_payload(payload, token)):
+        return None
+    if claims.get("validUntil", 0) < time.time() * 1000:
+        return None
+    return claims
+
+
+class MultipartUpload:
+    """
+    One multipart upload to the Blob API (create, upload parts, complete).
+    Calls are blocking; run them in a worker thread from async code.
+    """
+
+    def __init__(self, pathname, content_type, token=None, client=None):
+        self.pathname = pathname
+        self.content_type = content_type
+        self.token = token or BLOB_TOKEN
+        self.client = client or httpx.Client(timeout=120)
+        self.key = None
+        self.upload_id = None
+        self.parts = []
+
+    def _request(self, method, action, headers=None, **kwargs):
+        response = self.client.request(
+            method,
+            f"{BLOB_API_URL}/mpu",
+            params={"pathname": self.pathname},
+            headers={
+                "authorization": f"Bearer {self.token}",
+                "x-api-version": BLOB_API_VERSION,
+                "x-mpu-action": action,
+                **(headers or {}),
+            },
+            **kwargs
+        )
+        if response.status_code != 200:
+            raise BlobUploadError(f"Blob API {action} failed with HTTP {response.status_code}: {response.text[:200]}")
+        return response.json()
+
+    def create(self):
+        result = self._request("POST", "create", {
+            "x-content-type": self.content_type,
+            "x-add-random-suffix": "0",
+        })
+        self.key, self.upload_id = result["key"], result["uploadId"]
+
+    def upload_part(self, data):
+        part_number = len(self.parts) + 1
+        result = self._request("POST", "upload", {
+            "x-mpu-key": self.key,
+            "x-mpu-upload-id": self.upload_id,
+            "x-mpu-part-number": str(part_number),
+        }, content=data)
+        self.parts.append({"etag": result["etag"], "partNumber": part_number})
+
+    def complete(self):
+        return self._request("POST", "complete", {
+            "x-mpu-key": self.key,
+            "x-mpu-upload-id": self.upload_id,
+            "content-type": "application/json",
+        }, content=json.dumps(self.parts))
+
+
+async def stream_upload(pathname, chunks, content_type="application/octet-stream"):
+    """
+    Uploads an async iterator of byte chunks to the Blob store, one
+    BLOB_UPLOAD_CHUNK_SIZE part at a time, with the blocking API calls in a
+    worker thread.
+
+    Raises:
+        BlobUploadError: If the upload is too large or the Blob API fails
+
+    Returns:
+        dict: The Blob API's result (url, pathname, contentType, ...) plus size
+    """
+    upload = MultipartUpload(pathname, content_type)
+    try:
+        await asyncio.to_thread(upload.create)
+        buffer = bytearray()
+        size = 0
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > BLOB_UPLOAD_MAX_BYTES:
+                raise BlobUploadError(f"Upload is over the {BLOB_UPLOAD_MAX_BYTES} byte limit")
+            buffer += chunk
+            while len(buffer) >= BLOB_UPLOAD_CHUNK_SIZE:
+                part = bytes(buffer[:BLOB_UPLOAD_CHUNK_SIZE])
+                del buffer[:BLOB_UPLOAD_CHUNK_SIZE]
+                await asyncio.to_thread(upload.upload_part, part)
+        if buffer or not upload.parts:
+            await asyncio.to_thread(upload.upload_part, bytes(buffer))
+        result = await asyncio.to_thread(upload.complete)
+    finally:
+        upload.client.close()
+    result["size"] = size
+    return result
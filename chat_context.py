@@ -0,0 +1,172 @@
+import functools
+import hashlib
+import json
+import os
+
+# Builds the messages sent to the model for a LEA chat turn within a token
+# budget: the system prompt, an optional summary of older turns, and as many
+# of the most recent turns as fit. Token counts are computed once per message
+# and stored on it ("tokens"), so each turn only counts the new message.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('LEA_CONTEXT_TOKENS', 6000))  # prompt tokens per request
+CONTEXT_MAX_MESSAGES = int(os.environ.get('LEA_CONTEXT_MAX_MESSAGES', 100))  # most recent messages loaded per turn
+CONTEXT_SUMMARY = os.environ.get('LEA_CONTEXT_SUMMARY', '').lower() in ('1', 'true', 'yes')
+CONTEXT_SUMMARY_MODEL = os.environ.get('LEA_CONTEXT_SUMMARY_MODEL', 'gpt-4o-mini')
+CONTEXT_SUMMARY_MAX_TOKENS = 400
+CONTEXT_SUMMARY_BATCH = 10  # messages that must leave the window before the summary is updated
+
+# Per-message framing overhead in the chat format, and the reply primer
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMER_TOKENS = 3
+
+SUMMARY_PROMPT = (
+    "Summarize the earlier part of this conversation between a teacher and LEA, an AI assistant, "
+    "in a few sentences. Keep names, decisions, requirements and open questions; drop pleasantries."
+)
+
+
+@functools.lru_cache(maxsize=16)
+def get_encoding(model):
+    """The tiktoken encoding for a model (None if tiktoken is unavailable)"""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"Warning: tiktoken unavailable, approximating token counts: {e}")
+        return None
+
+
+def encoding_name(model):
+    encoding = get_encoding(model)
+    return encoding.name if encoding else "approx"
+
+
+@functools.lru_cache(maxsize=4096)
+def _count(model, text):
+    encoding = get_encoding(model)
+    if encoding is None:
+        # Fall back to the usual ~4 characters per token approximation
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_text_tokens(text, model):
+    if not text:
+        return 0
+    return _count(model, text)
+
+
+def message_tokens(message, model):
+    """
+    Tokens a chat message costs in the prompt. The count is cached on the
+    message ("tokens", keyed by encoding) so stored messages are counted once.
+    """
+    name = encoding_name(model)
+    cached = message.get("tokens")
+    if isinstance(cached, dict) and name in cached:
+        return cached[name]
+    tokens = count_text_tokens(message.get("content") or "", model) + MESSAGE_OVERHEAD_TOKENS
+    message["tokens"] = {**(cached if isinstance(cached, dict) else {}), name: tokens}
+    return tokens
+
+
+def message_key(message):
+    """A stable key for a stored message, used to remember how far the summary reaches"""
+    identity = json.dumps([message.get("role"), message.get("timestamp"), message.get("content")])
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()[:16]
+
+
+def select_window(system_prompt, messages, model, budget=None, summary=None):
+    """
+    Picks the most recent messages that fit the budget.
+
+    Args:
+        system_prompt (str): System prompt, always sent
+        messages (list): Conversation messages (role, content), oldest first
+        model (str): Model name, for its tokenizer
+        budget (int, optional): Prompt token budget; defaults to LEA_CONTEXT_TOKENS
+        summary (str, optional): Summary of turns older than the window
+
+    Returns:
+        tuple: (index of the first message in the window, prompt tokens used)
+    """
+    if budget is None:
+        budget = CONTEXT_TOKEN_BUDGET
+    used = count_text_tokens(system_prompt, model) + MESSAGE_OVERHEAD_TOKENS + REPLY_PRIMER_TOKENS
+    if summary:
+        used += count_text_tokens(summary, model) + MESSAGE_OVERHEAD_TOKENS
+
+    start = len(messages)
+    while start > 0:
+        tokens = message_tokens(messages[start - 1], model)
+        # The newest message is always sent, even if it alone is over budget
+        if used + tokens > budget and start < len(messages):
+            break
+        used += tokens
+        start -= 1
+    return start, used
+
+
+def build_context(system_prompt, messages, model, budget=None, summary=None):
+    """
+    The API messages for a turn: the system prompt, the summary of older turns
+    (if any) and the most recent messages within the budget.
+
+    Returns:
+        tuple: (api_messages, index of the first message sent)
+    """
+    start, _ = select_window(system_prompt, messages, model, budget, summary)
+    api_messages = [{"role": "system", "content": system_prompt}]
+    # Sent whenever there is one: the summarized turns may be older than the
+    # loaded history even when the whole of it fits the window
+    if summary:
+        api_messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+    api_messages.extend({"role": msg["role"], "content": msg["content"]} for msg in messages[start:])
+    return api_messages, start
+
+
+def pending_summary(messages, start, summary_through):
+    """
+    The messages that left the window since the summary was last updated
+
+    Args:
+        messages (list): Conversation messages, oldest first
+        start (int): Index of the first message in the window
+        summary_through (str): message_key of the last summarized message
+    """
+    begin = 0
+    if summary_through:
+        for i in range(start - 1, -1, -1):
+            if message_key(messages[i]) == summary_through:
+                begin = i + 1
+                break
+    return messages[begin:start]
+
+
+def summarize(client, previous_summary, messages):
+    """
+    Folds turns that left the window into the running summary.
+
+    Args:
+        client: OpenAI client
+        previous_summary (str): Summary so far (may be empty)
+        messages (list): Turns to add, oldest first
+
+    Returns:
+        str: The updated summary
+    """
+    transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    if previous_summary:
+        transcript = f"Summary so far: {previous_summary}\n\nLater turns:\n{transcript}"
+    response = client.chat.completions.create(
+        model=CONTEXT_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript}
+        ],
+        temperature=0.2,
+        max_tokens=CONTEXT_SUMMARY_MAX_TOKENS,
+    )
+    return response.choices[0].message.content.strip()
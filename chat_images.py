@@ -0,0 +1,84 @@
+import io
+import mimetypes
+import os
+
+# Prepares images uploaded to the LEA chatbot for the vision model, entirely
+# in memory. The image is decoded once, downsized to the largest size the
+# model actually looks at and re-encoded once; the same bytes are stored for
+# the chat preview and sent to the API. OpenAI's "high" detail fits an image
+# in 2048x2048 and then scales its short side to 768, so anything larger is
+# only uploaded to be thrown away.
+VISION_MAX_SIDE = int(os.environ.get('LEA_VISION_MAX_SIDE', 2048))
+VISION_SHORT_SIDE = int(os.environ.get('LEA_VISION_SHORT_SIDE', 768))
+VISION_JPEG_QUALITY = 85
+
+# Formats the vision API accepts as they are
+VISION_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+# Content types stored and served back for the chat preview; never markup
+# such as SVG or HTML, which would run script from the app's origin
+VISION_CONTENT_TYPES = frozenset(VISION_FORMATS.values())
+EXIF_ORIENTATION = 0x0112
+
+# Pillow is optional; without it uploads in a raster format are passed through unchanged
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+def vision_size(width, height):
+    """The size the vision model scales an image to (never larger than the image)"""
+    scale = min(1.0, VISION_MAX_SIDE / max(width, height))
+    short_side = min(width, height) * scale
+    if short_side > VISION_SHORT_SIDE:
+        scale *= VISION_SHORT_SIDE / short_side
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def prepare_image(data, filename=""):
+    """
+    Downsizes and re-encodes an uploaded image for the vision model.
+
+    Args:
+        data (bytes): The uploaded file
+        filename (str): Upload filename, for the content type without Pillow
+
+    Returns:
+        tuple: (image bytes, content type)
+
+    Raises:
+        ValueError: If the upload is not an image Pillow can read (without
+            Pillow, if its filename is not that of a JPEG, PNG, WebP or GIF)
+    """
+    if Image is None:
+        content_type = mimetypes.guess_type(filename)[0]
+        if content_type not in VISION_CONTENT_TYPES:
+            raise ValueError(f"Unsupported image type: {content_type or filename}")
+        return data, content_type
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        source_format = img.format
+        source_size = img.size
+        target = vision_size(*source_size)
+        upright = img.getexif().get(EXIF_ORIENTATION, 1) == 1
+        # Small enough already, upright and in a format the API takes: send as is
+        if (upright and source_size == target and source_format in VISION_FORMATS
+                and not getattr(img, "is_animated", False)):
+            return data, VISION_FORMATS[source_format]
+        # JPEGs can be decoded straight at a reduced scale
+        img.draft("RGB", target)
+        img = ImageOps.exif_transpose(img)
+    except Exception as e:
+        raise ValueError(f"Unsupported image: {str(e)}")
+
+    target = vision_size(*img.size)
+    if img.size != target:
+        img = img.resize(target, Image.LANCZOS, reducing_gap=2.0)
+
+    buffer = io.BytesIO()
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img.save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue(), "image/png"
+    img.convert("RGB").save(buffer, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue(), "image/jpeg"
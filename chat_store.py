@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import redis
+
+from redis_store import decode_field
+
+# Server-side store for LEA chatbot conversations, so the session cookie only
+# carries a conversation id instead of the whole history:
+#   lea_chat:{conversation_id}:messages   list of JSON messages, append-only
+#   lea_chat:{conversation_id}:meta       hash: system_prompt, selected_recipe, bytes
+#   lea_chat:{conversation_id}:images     set: digests of the images its messages show
+#   lea_chat_image:{sha256}               hash: data, content_type
+# Conversations expire CHAT_TTL seconds after their last write and keep at most
+# CHAT_MAX_MESSAGES messages / CHAT_MAX_BYTES of JSON, dropping the oldest.
+# Uploaded images are stored once by content hash and referenced by URL; every
+# write to a conversation keeps the images it shows for another CHAT_IMAGE_TTL.
+CHAT_KEY_PREFIX = "lea_chat"
+CHAT_IMAGE_PREFIX = "lea_chat_image"
+CHAT_TTL = int(os.environ.get('LEA_CHAT_TTL', 7 * 24 * 60 * 60))  # 7 days
+CHAT_MAX_MESSAGES = int(os.environ.get('LEA_CHAT_MAX_MESSAGES', 500))
+CHAT_MAX_BYTES = int(os.environ.get('LEA_CHAT_MAX_BYTES', 2 * 1024 * 1024))  # 2 MB
+CHAT_IMAGE_TTL = int(os.environ.get('LEA_CHAT_IMAGE_TTL', CHAT_TTL))
+CHAT_IMAGE_URL_PREFIX = "/api/lea/image/"
+
+# Session key holding the conversation id
+CONVERSATION_KEY = "lea_conversation"
+
+# Fallback store limits when Redis is not available
+MEMORY_MAX_CONVERSATIONS = 1000
+MEMORY_MAX_IMAGES = 200
+
+# Appends messages, drops the oldest past the caps and refreshes the TTLs of
+# the conversation and the images it shows in one round trip. KEYS: messages
+# list, meta hash, images set; ARGV: max messages, max bytes, ttl, image key
+# prefix, image ttl, number of new image digests, the digests, then the JSON
+# messages.
+APPEND_SCRIPT = """
+local image_count = tonumber(ARGV[6])
+for i = 7, 6 + image_count do
+    redis.call('SADD', KEYS[3], ARGV[i])
+end
+local added = 0
+for i = 7 + image_count, #ARGV do
+    redis.call('RPUSH', KEYS[1], ARGV[i])
+    added = added + string.len(ARGV[i])
+end
+local size = redis.call('HINCRBY', KEYS[2], 'bytes', added)
+local max_messages = tonumber(ARGV[1])
+local max_bytes = tonumber(ARGV[2])
+while redis.call('LLEN', KEYS[1]) > 1 and (redis.call('LLEN', KEYS[1]) > max_messages or size > max_bytes) do
+    local dropped = redis.call('LPOP', KEYS[1])
+    size = redis.call('HINCRBY', KEYS[2], 'bytes', -string.len(dropped))
+    local ok, message = pcall(cjson.decode, dropped)
+    if ok and type(message) == 'table' and type(message.image) == 'string' then
+        local digest = string.match(message.image, '(%x+)$')
+        if digest then
+            redis.call('SREM', KEYS[3], digest)
+        end
+    end
+end
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[3])
+end
+for _, digest in ipairs(redis.call('SMEMBERS', KEYS[3])) do
+    redis.call('EXPIRE', ARGV[4] .. ':' .. digest, ARGV[5])
+end
+return size
+"""
+
+redis_client = None
+try:
+    REDIS_URL = os.environ.get('HTML5_REDIS_URL', "redis://localhost:6379/0")
+    redis_client = redis.from_url(REDIS_URL)
+    redis_client.ping()  # Test connection
+except Exception as e:
+    print(f"Chat store: Error connecting to Redis: {str(e)}. Using fallback in-memory storage.")
+    redis_client = None
+
+# Registered on first use
+append_script = None
+
+# Fallback in-memory storage, least recently used first
+conversations_memory = OrderedDict()
+images_memory = OrderedDict()
+memory_lock = threading.Lock()
+
+
+def _messages_key(conversation_id):
+    return f"{CHAT_KEY_PREFIX}:{conversation_id}:messages"
+
+
+def _meta_key(conversation_id):
+    return f"{CHAT_KEY_PREFIX}:{conversation_id}:meta"
+
+
+def _images_key(conversation_id):
+    return f"{CHAT_KEY_PREFIX}:{conversation_id}:images"
+
+
+def _image_digests(messages):
+    """Digests of the stored images the messages show"""
+    return [
+        message["image"][len(CHAT_IMAGE_URL_PREFIX):] for message in messages
+        if isinstance(message.get("image"), str) and message["image"].startswith(CHAT_IMAGE_URL_PREFIX)
+    ]
+
+
+def get_conversation_id(session):
+    """The session's conversation id, creating one on first use"""
+    conversation_id = session.get(CONVERSATION_KEY)
+    if not conversation_id:
+        conversation_id = uuid.uuid4().hex
+        session[CONVERSATION_KEY] = conversation_id
+    return conversation_id
+
+
+def _memory_conversation(conversation_id):
+    """The in-memory conversation record (call with memory_lock held)"""
+    conversation = conversations_memory.get(conversation_id)
+    if conversation is None or conversation["expires"] < time.time():
+        conversation = {"messages": [], "meta": {}, "bytes": 0, "expires": 0}
+        conversations_memory[conversation_id] = conversation
+    conversations_memory.move_to_end(conversation_id)
+    while len(conversations_memory) > MEMORY_MAX_CONVERSATIONS:
+        conversations_memory.popitem(last=False)
+    return conversation
+
+
+def load_messages(conversation_id, limit=None):
+    """
+    Args:
+        limit (int, optional): Only load the most recent limit messages
+
+    Returns:
+        list: The conversation's messages, oldest first
+    """
+    if redis_client:
+        try:
+            start = -limit if limit else 0
+            return [json.loads(message) for message in redis_client.lrange(_messages_key(conversation_id), start, -1)]
+        except Exception as e:
+            print(f"Error loading chat history from Redis: {str(e)}")
+            return []
+    with memory_lock:
+        messages = _memory_conversation(conversation_id)["messages"]
+        return list(messages[-limit:] if limit else messages)
+
+
+def append_messages(conversation_id, *messages):
+    """Appends messages to a conversation, trimming it to its size caps"""
+    global append_script
+    encoded = [json.dumps(message) for message in messages]
+    if redis_client:
+        try:
+            if append_script is None:
+                append_script = redis_client.register_script(APPEND_SCRIPT)
+            digests = _image_digests(messages)
+            append_script(
+                keys=[_messages_key(conversation_id), _meta_key(conversation_id), _images_key(conversation_id)],
+                args=[CHAT_MAX_MESSAGES, CHAT_MAX_BYTES, CHAT_TTL, CHAT_IMAGE_PREFIX, CHAT_IMAGE_TTL,
+                      len(digests), *digests, *encoded]
+            )
+        except Exception as e:
+            print(f"Error saving chat history to Redis: {str(e)}")
+        return
+    with memory_lock:
+        conversation = _memory_conversation(conversation_id)
+        conversation["messages"].extend(messages)
+        conversation["bytes"] += sum(len(message) for message in encoded)
+        while len(conversation["messages"]) > 1 and (
+                len(conversation["messages"]) > CHAT_MAX_MESSAGES or conversation["bytes"] > CHAT_MAX_BYTES):
+            conversation["bytes"] -= len(json.dumps(conversation["messages"].pop(0)))
+        conversation["expires"] = time.time() + CHAT_TTL
+
+
+def clear_messages(conversation_id):
+    """Deletes a conversation's messages, keeping its settings"""
+    if redis_client:
+        try:
+            pipe = redis_client.pipeline()
+            pipe.unlink(_messages_key(conversation_id), _images_key(conversation_id))
+            pipe.hset(_meta_key(conversation_id), "bytes", 0)
+            pipe.expire(_meta_key(conversation_id), CHAT_TTL)
+            pipe.execute()
+        except Exception as e:
+            print(f"Error clearing chat history in Redis: {str(e)}")
+        return
+    with memory_lock:
+        conversation = _memory_conversation(conversation_id)
+        conversation["messages"] = []
+        conversation["bytes"] = 0
+
+
+def get_setting(conversation_id, name, default=None):
+    """Reads a per-conversation setting (system_prompt, selected_recipe)"""
+    if redis_client:
+        try:
+            value = redis_client.hget(_meta_key(conversation_id), name)
+            return default if value is None else decode_field(value)
+        except Exception as e:
+            print(f"Error reading chat setting from Redis: {str(e)}")
+            return default
+    with memory_lock:
+        return _memory_conversation(conversation_id)["meta"].get(name, default)
+
+
+def set_settings(conversation_id, **settings):
+    if redis_client:
+        try:
+            pipe = redis_client.pipeline()
+            pipe.hset(_meta_key(conversation_id), mapping=settings)
+            pipe.expire(_meta_key(conversation_id), CHAT_TTL)
+            pipe.execute()
+        except Exception as e:
+            print(f"Error saving chat setting to Redis: {str(e)}")
+        return
+    with memory_lock:
+        conversation = _memory_conversation(conversation_id)
+        conversation["meta"].update(settings)
+        conversation["expires"] = time.time() + CHAT_TTL
+
+
+def put_image(data, content_type):
+    """
+    Stores an image once by content hash.
+
+    Returns:
+        str: The URL the image is served from
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    if redis_client:
+        try:
+            key = f"{CHAT_IMAGE_PREFIX}:{digest}"
+            pipe = redis_client.pipeline()
+            pipe.hsetnx(key, "data", data)
+            pipe.hsetnx(key, "content_type", content_type)
+            pipe.expire(key, CHAT_IMAGE_TTL)
+            pipe.execute()
+        except Exception as e:
+            print(f"Error saving chat image to Redis: {str(e)}")
+    else:
+        with memory_lock:
+            images_memory[digest] = (data, content_type)
+            images_memory.move_to_end(digest)
+            while len(images_memory) > MEMORY_MAX_IMAGES:
+                images_memory.popitem(last=False)
+    return f"{CHAT_IMAGE_URL_PREFIX}{digest}"
+
+
+def get_image(digest):
+    """
+    Returns:
+        tuple or None: (data, content_type) if the image is stored
+    """
+    if redis_client:
+        try:
+            data, content_type = redis_client.hmget(f"{CHAT_IMAGE_PREFIX}:{digest}", "data", "content_type")
+            if data is None:
+                return None
+            return data, decode_field(content_type) or "application/octet-stream"
+        except Exception as e:
+            print(f"Error reading chat image from Redis: {str(e)}")
+            return None
+    with memory_lock:
+        return images_memory.get(digest)
@@ -4,8 +4,8 @@ import os
 import asyncio
 from typing import Dict, List, Any
 from dotenv import load_dotenv
-import openai
 from datetime import datetime
+import llm_clients
 
 # Load environment variables
 load_dotenv()
@@ -13,10 +13,14 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 
 class LessonGeneratorForm:
     def __init__(self):
-        self.openai_client = openai.OpenAI(api_key=openai_api_key)
         self.reasoning_model = "o4-mini"
         self.non_reasoning_model = "gpt-4o-mini-2024-07-18"
     
+    @property
+    def openai_client(self):
+        """The shared OpenAI client from llm_clients"""
+        return llm_clients.get_openai(openai_api_key)
+    
     def create_lesson_input_form(self):
         """Create the initial lesson details input form"""
         return Div(
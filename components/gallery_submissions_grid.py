@@ -575,4 +575,33 @@ def create_gallery_submissions_grid(submissions):
         """),
         
         cls="gallery-container"
-    ) 
\ No newline at end of file
+    ) 
+
+
+def create_gallery_pager(path, page, total, page_size):
+    """
+    Create previous/next links for a paginated gallery page.
+    
+    Parameters:
+    path (str): Route of the gallery page, e.g. "/primary/math"
+    page (int): Current page number (1-based)
+    total (int): Total number of matching submissions
+    page_size (int): Submissions per page
+    """
+    page_count = max(1, -(-total // page_size))
+    if page_count == 1:
+        return ""
+    
+    def page_link(label, target_page):
+        return A(label,
+                 href=f"#{path.lstrip('/')}",
+                 hx_get=f"{path}?page={target_page}",
+                 hx_target="#content-area",
+                 cls="px-3 py-1 border border-gray-600 rounded text-sm")
+    
+    return Div(
+        page_link("« Previous", page - 1) if page > 1 else "",
+        Span(f"Page {page} of {page_count} ({total} interactives)", cls="text-sm text-gray-400"),
+        page_link("Next »", page + 1) if page < page_count else "",
+        cls="flex items-center justify-center gap-4 my-6"
+    )
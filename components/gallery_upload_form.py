@@ -615,6 +615,9 @@ def create_gallery_upload_form(gallery_type="primary"):
                 cls="modal"
             ),
             
+            # Direct-to-blob uploader (uploadToBlob)
+            Script(src="/static/js/blob_upload.js"),
+            
             # JavaScript for form handling
             Script("""
                 // Store all subjects data - using window to make it globally accessible
@@ -831,16 +834,7 @@ def create_gallery_upload_form(gallery_type="primary"):
                         formData.append('file', file);
                         
                         // Upload to blob storage
-                        const response = await fetch('/api/blob/upload?filename=' + encodeURIComponent(file.name), {
-                            method: 'POST',
-                            body: file
-                        });
-                        
-                        if (!response.ok) {
-                            throw new Error('Failed to upload image');
-                        }
-                        
-                        const data = await response.json();
+                        const data = await uploadToBlob(file);
                         
                         // Store the image URL for submission
                         window.refImages[index] = data.url;
@@ -929,16 +923,7 @@ def create_gallery_upload_form(gallery_type="primary"):
                         zipFormData.append('filename', `interactive-${Date.now()}-${zipFile.name}`);
                         zipFormData.append('file', zipFile);
                         
-                        const zipResponse = await fetch('/api/blob/upload?filename=' + encodeURIComponent(zipFile.name), {
-                            method: 'POST',
-                            body: zipFile
-                        });
-                        
-                        if (!zipResponse.ok) {
-                            throw new Error('Failed to upload ZIP file');
-                        }
-                        
-                        const zipData = await zipResponse.json();
+                        const zipData = await uploadToBlob(zipFile);
                         
                         // Create metadata object
                         const metadata = {
@@ -1057,6 +1057,16 @@ def create_html5_form(api_key=None):
                             cls="mb-6 p-4 border border-gray-700 rounded bg-gray-900"
                         ),
                         
+                        # Skip cached results for identical requests
+                        Div(
+                            Label(
+                                Input(type="checkbox", id="force-regenerate", name="force-regenerate", cls="mr-2"),
+                                "Force regenerate (skip cached results)",
+                                cls="text-sm text-gray-300"
+                            ),
+                            cls="mb-4"
+                        ),
+                        
                         # Generate button
                         Button("Generate", 
                                type='submit',
@@ -1238,6 +1248,16 @@ def create_html5_form(api_key=None):
                         }
                         """),
                         
+                        # Skip cached results for identical requests
+                        Div(
+                            Label(
+                                Input(type="checkbox", id="iter-force-regenerate", name="force-regenerate", cls="mr-2"),
+                                "Force regenerate (skip cached results)",
+                                cls="text-sm text-gray-300"
+                            ),
+                            cls="mb-4"
+                        ),
+                        
                         # Refinement button
                         Button("Refine", 
                                type='submit',
@@ -1571,6 +1591,101 @@ def create_html5_form(api_key=None):
         ),
         
         Script("""
+                // Stream a generation from /api/html5/generate-code-stream (Server-Sent Events).
+                // The editors fill in as the model writes, then the final markup replaces them.
+                function streamGenerateCode(form) {
+                    const container = document.getElementById('code-editors-container');
+                    const indicator = document.getElementById('loading-indicator');
+                    const editorIds = { html: 'html-editor', css: 'css-editor', js: 'js-editor' };
+                    
+                    // The editors as they were, restored if the connection fails mid-stream
+                    let previous = null;
+                    
+                    indicator.style.display = 'block';
+                    
+                    function finish(html) {
+                        container.innerHTML = html;
+                        indicator.style.display = 'none';
+                        
+                        // Trigger HTMX afterSwap event for compatibility
+                        document.dispatchEvent(new CustomEvent('htmx:afterSwap', {
+                            detail: { target: container }
+                        }));
+                    }
+                    
+                    function showError(message) {
+                        const error = document.createElement('div');
+                        error.className = 'error alert alert-danger p-4';
+                        error.textContent = 'Error: ' + message;
+                        container.prepend(error);
+                        indicator.style.display = 'none';
+                    }
+                    
+                    function handleEvent(name, data) {
+                        if (name === 'start') {
+                            previous = container.innerHTML;
+                            container.innerHTML = data.editors;
+                        } else if (name === 'delta') {
+                            for (const field in data) {
+                                const editor = document.getElementById(editorIds[field]);
+                                if (editor) {
+                                    editor.value += data[field];
+                                    editor.scrollTop = editor.scrollHeight;
+                                }
+                            }
+                        } else if (name === 'done') {
+                            finish(data.html);
+                        } else if (name === 'error') {
+                            // Restore the code the user had, then show the error above it
+                            finish(data.html);
+                            showError(data.message);
+                        }
+                    }
+                    
+                    // Don't set Content-Type header - the browser will set the correct boundary
+                    fetch('/api/html5/generate-code-stream', {
+                        method: 'POST',
+                        body: new FormData(form),
+                    })
+                    .then(response => {
+                        const reader = response.body.getReader();
+                        const decoder = new TextDecoder();
+                        let buffer = '';
+                        
+                        function pump() {
+                            return reader.read().then(({ done, value }) => {
+                                if (done) {
+                                    indicator.style.display = 'none';
+                                    return;
+                                }
+                                buffer += decoder.decode(value, { stream: true });
+                                
+                                // Events are separated by a blank line
+                                let boundary;
+                                while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                                    const frame = buffer.slice(0, boundary);
+                                    buffer = buffer.slice(boundary + 2);
+                                    
+                                    let name = 'message';
+                                    let data = '';
+                                    frame.split('\\n').forEach(line => {
+                                        if (line.startsWith('event: ')) name = line.slice(7);
+                                        else if (line.startsWith('data: ')) data += line.slice(6);
+                                    });
+                                    if (data) handleEvent(name, JSON.parse(data));
+                                }
+                                return pump();
+                            });
+                        }
+                        return pump();
+                    })
+                    .catch(error => {
+                        console.error('Error:', error);
+                        if (previous !== null) container.innerHTML = previous;
+                        showError(error.message);
+                    });
+                }
+                
                 // Simple DOM ready function without TinyMCE
                 document.addEventListener('DOMContentLoaded', function() {
                     // Make sure textareas are visible
@@ -1602,38 +1717,7 @@ def create_html5_form(api_key=None):
                                 }
                                 
                                 if (shouldProceed) {
-                                    // Show loading indicator
-                                    document.getElementById('loading-indicator').style.display = 'block';
-                                    
-                                    // Create FormData object for proper file handling
-                                    const formData = new FormData(form);
-                                    
-                                    // Use fetch API for the request
-                                    fetch('/api/html5/generate-code', {
-                                        method: 'POST',
-                                        body: formData,
-                                        // Don't set Content-Type header - the browser will set the correct boundary
-                                    })
-                                    .then(response => response.text())
-                                    .then(html => {
-                                        // Update the code editors container
-                                        document.getElementById('code-editors-container').innerHTML = html;
-                                        
-                                        // Hide loading indicator
-                                        document.getElementById('loading-indicator').style.display = 'none';
-                                        
-                                        // Trigger HTMX afterSwap event for compatibility
-                                        const event = new CustomEvent('htmx:afterSwap', {
-                                            detail: { target: document.getElementById('code-editors-container') }
-                                        });
-                                        document.dispatchEvent(event);
-                                    })
-                                    .catch(error => {
-                                        console.error('Error:', error);
-                                        document.getElementById('loading-indicator').style.display = 'none';
-                                        document.getElementById('code-editors-container').innerHTML = 
-                                            '<div class="error alert alert-danger">Error: ' + error.message + '</div>';
-                                    });
+                                    streamGenerateCode(form);
                                 } else {
                                     console.log("Generation cancelled by user to preserve drafts");
                                 }
@@ -1641,38 +1725,7 @@ def create_html5_form(api_key=None):
                             .catch(error => {
                                 console.error('Error checking drafts:', error);
                                 // Proceed anyway if we can't check drafts
-                                // Show loading indicator
-                                document.getElementById('loading-indicator').style.display = 'block';
-                                
-                                // Create FormData object for proper file handling
-                                const formData = new FormData(form);
-                                
-                                // Use fetch API for the request
-                                fetch('/api/html5/generate-code', {
-                                    method: 'POST',
-                                    body: formData,
-                                    // Don't set Content-Type header - the browser will set the correct boundary
-                                })
-                                .then(response => response.text())
-                                .then(html => {
-                                    // Update the code editors container
-                                    document.getElementById('code-editors-container').innerHTML = html;
-                                    
-                                    // Hide loading indicator
-                                    document.getElementById('loading-indicator').style.display = 'none';
-                                    
-                                    // Trigger HTMX afterSwap event for compatibility
-                                    const event = new CustomEvent('htmx:afterSwap', {
-                                        detail: { target: document.getElementById('code-editors-container') }
-                                    });
-                                    document.dispatchEvent(event);
-                                })
-                                .catch(error => {
-                                    console.error('Error:', error);
-                                    document.getElementById('loading-indicator').style.display = 'none';
-                                    document.getElementById('code-editors-container').innerHTML = 
-                                        '<div class="error alert alert-danger">Error: ' + error.message + '</div>';
-                                });
+                                streamGenerateCode(form);
                             });
                     });
                 });
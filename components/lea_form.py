@@ -210,6 +210,7 @@ def create_lea_chatbot(api_key=None, base_template="", recipe_templates=None):
     return Div(
         # Load Tailwind and DaisyUI
         Script(src="https://cdn.tailwindcss.com"),
+        Script(src="/static/js/lea_stream.js"),
         Link(rel="stylesheet", href="https://cdn.jsdelivr.net/npm/daisyui@4.11.1/dist/full.min.css"),
         
         # Add styling with dark theme
@@ -411,11 +412,9 @@ def create_lea_chatbot(api_key=None, base_template="", recipe_templates=None):
                         "Send",
                         id="send-button",
                         type="button",
-                        hx_post="/api/lea/send-message",
-                        hx_include="closest form",
-                        hx_target="#chatlist",
-                        hx_swap="beforeend",
-                        hx_indicator="#typing-indicator",
+                        # Streams the reply (static/js/lea_stream.js); /api/lea/send-message
+                        # still returns the whole reply in one response
+                        onclick="leaSendMessage(this.form)",
                         cls="p-2 bg-blue-500 text-white rounded-r hover:bg-blue-600"
                     ),
                     
@@ -509,8 +508,12 @@ def ChatMessage(msg):
                 cls="chat-header"
             ),
             
-            # Message content
-            Div(msg['content'], cls=f"chat-bubble {bubble_class}"),
+            # Message content (uploaded images are referenced by URL)
+            Div(
+                Img(src=msg['image'], alt="Uploaded image", style="max-width: 100%; max-height: 300px;")
+                if msg.get('image') else msg['content'],
+                cls=f"chat-bubble {bubble_class}"
+            ),
             
             # Footer (optional)
             Div(
@@ -2,8 +2,20 @@ from fasthtml.common import *
 import datetime
 from pathlib import Path
 
-def create_token_usage_display():
-    """Create the main token usage display form"""
+# Download options, in the order they are listed
+EXPORT_FORMAT_LABELS = {
+    "csv": "CSV",
+    "csv.gz": "CSV (gzip)",
+    "parquet": "Parquet",
+}
+
+def create_token_usage_display(export_formats=("csv", "csv.gz")):
+    """
+    Create the main token usage display form
+
+    Args:
+        export_formats: Download formats to offer (keys of EXPORT_FORMAT_LABELS)
+    """
     return Div(
         Div(
             Div(id="token-summary-container", cls="mb-8",
@@ -47,13 +59,22 @@ def create_token_usage_display():
                 ),
                 cls="mt-6"
             ),
-            Div(
-                A("Download CSV", 
-                    href="/api/tokens/download-csv",
-                    cls="bg-green-500 hover:bg-green-700 text-white font-bold py-2 px-4 rounded inline-block",
-                    download=True
+            Form(
+                Input(type="date", name="start_date", title="From", cls="border rounded px-2 py-1 mr-2"),
+                Input(type="date", name="end_date", title="To", cls="border rounded px-2 py-1 mr-2"),
+                Input(type="text", name="user_id", placeholder="Username (optional)", cls="border rounded px-2 py-1 mr-2"),
+                Select(
+                    *[Option(label, value=value) for value, label in EXPORT_FORMAT_LABELS.items() if value in export_formats],
+                    name="format",
+                    cls="border rounded px-2 py-1 mr-2"
+                ),
+                Button("Download", 
+                    type="submit",
+                    cls="bg-green-500 hover:bg-green-700 text-white font-bold py-2 px-4 rounded"
                 ),
-                cls="mt-4 mb-4"
+                action="/api/tokens/download-csv",
+                method="get",
+                cls="mt-4 mb-4 flex flex-wrap items-center"
             ),
             Div(id="db-status", cls="mt-6"),
             Div(id="reset-confirmation", cls="mt-6"),
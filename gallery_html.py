@@ -0,0 +1,113 @@
+import base64
+import io
+import mimetypes
+import re
+
+import zip_store
+
+# Files referenced from the preview HTML are inlined below these sizes
+INLINE_TEXT_MAX_BYTES = 1024 * 1024  # CSS and JS
+INLINE_IMAGE_MAX_BYTES = 100 * 1024
+INLINE_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.svg')
+
+# One scan finds every reference the preview inliner rewrites:
+#   <link ...>                       stylesheet links (href)
+#   <script ...></script>            empty external scripts (src)
+#   src="..."                        image sources anywhere else
+ASSET_REFERENCE_RE = re.compile(
+    r'(?P<link><link[^>]*>)'
+    r'|(?P<script><script[^>]*></script>)'
+    r'|src=[\'"](?P<src>[^\'"]*)[\'"]'
+)
+HREF_RE = re.compile(r'href=[\'"]([^\'"]*)[\'"]')
+SRC_RE = re.compile(r'src=[\'"]([^\'"]*)[\'"]')
+
+
+def read_store_text(digest, manifest, rel_path):
+    """Reads a text file from the extraction store with universal newlines, like open(path, 'r')"""
+    data = zip_store.read_file(digest, manifest, rel_path)
+    return io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', errors='replace').read()
+
+
+class AssetInliner:
+    """
+    Rewrites a preview's HTML so it renders without its asset files: small
+    stylesheets become <style> blocks, small external scripts become inline
+    <script> blocks and small images become data URIs.
+
+    The HTML is scanned once. References are looked up in files_dict (as
+    built by extract_zip_and_process_html) and each asset is read at most
+    once, however many times it is referenced.
+    """
+
+    def __init__(self, digest, manifest, files_dict):
+        self.digest = digest
+        self.manifest = manifest
+        self.files_dict = files_dict
+        self.texts = {}
+        self.data_uris = {}
+
+    def _size(self, key):
+        return self.manifest["files"][self.files_dict[key]]
+
+    def _text(self, key):
+        store_path = self.files_dict[key]
+        if store_path not in self.texts:
+            self.texts[store_path] = read_store_text(self.digest, self.manifest, store_path)
+        return self.texts[store_path]
+
+    def _inline_text(self, key, extension):
+        if key in self.files_dict and key.endswith(extension) and self._size(key) < INLINE_TEXT_MAX_BYTES:
+            return self._text(key)
+        return None
+
+    def _data_uri(self, key):
+        if key not in self.files_dict or not key.lower().endswith(INLINE_IMAGE_EXTENSIONS):
+            return None
+        if self._size(key) >= INLINE_IMAGE_MAX_BYTES:
+            return None
+        if key not in self.data_uris:
+            img_data = zip_store.read_file(self.digest, self.manifest, self.files_dict[key])
+            mime_type, _ = mimetypes.guess_type(key)
+            if not mime_type:
+                mime_type = "image/png"  # Default
+            self.data_uris[key] = f"data:{mime_type};base64,{base64.b64encode(img_data).decode('utf-8')}"
+        return self.data_uris[key]
+
+    def _replace_src(self, match):
+        data_uri = self._data_uri(match.group(1))
+        return f'src="{data_uri}"' if data_uri else match.group(0)
+
+    def rewrite_images(self, text):
+        """Replaces src="..." references to small images with data URIs"""
+        if 'src=' not in text:
+            return text
+        return SRC_RE.sub(self._replace_src, text)
+
+    def _replace_reference(self, match):
+        if match.group('link'):
+            tag = match.group('link')
+            for href in HREF_RE.findall(tag):
+                css_content = self._inline_text(href, '.css')
+                if css_content is not None:
+                    return f'<style>{self.rewrite_images(css_content)}</style>'
+            return self.rewrite_images(tag)
+
+        if match.group('script'):
+            tag = match.group('script')
+            for src in SRC_RE.findall(tag):
+                js_content = self._inline_text(src, '.js')
+                if js_content is not None:
+                    return f'<script>{self.rewrite_images(js_content)}</script>'
+            return self.rewrite_images(tag)
+
+        data_uri = self._data_uri(match.group('src'))
+        return f'src="{data_uri}"' if data_uri else match.group(0)
+
+    def rewrite(self, html_content):
+        return ASSET_REFERENCE_RE.sub(self._replace_reference, html_content)
+
+
+def inline_assets(html_content, digest, manifest, files_dict):
+    """Inlines the small CSS, JS and image files a preview's HTML references"""
+    return AssetInliner(digest, manifest, files_dict).rewrite(html_content)
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import importlib.util
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+
+# Process-wide registry of LLM API clients (OpenAI, Anthropic, Gemini), keyed
+# by (provider, api_key, options), so every call reuses the same keep-alive
+# connection pool instead of paying TCP and TLS setup again. Clients for the
+# keys configured in the environment live for the whole process; clients for
+# user-supplied keys are dropped after LLM_CLIENT_MAX_IDLE seconds unused, or
+# least recently used first past LLM_CLIENT_MAX_KEYS.
+LLM_CLIENT_MAX_IDLE = int(os.environ.get('LLM_CLIENT_MAX_IDLE', 15 * 60))  # longer than any request timeout
+LLM_CLIENT_MAX_KEYS = int(os.environ.get('LLM_CLIENT_MAX_KEYS', 32))
+LLM_CLIENT_CONNECTIONS = int(os.environ.get('LLM_CLIENT_CONNECTIONS', 20))  # per client
+LLM_CLIENT_KEEPALIVE = 60  # seconds an idle pooled connection is kept open
+
+# HTTP/2 needs the h2 package; without it clients stay on HTTP/1.1 keep-alive
+LLM_HTTP2 = (os.environ.get('LLM_HTTP2', 'true').lower() in ('1', 'true', 'yes')
+             and importlib.util.find_spec("h2") is not None)
+
+# Keys read from these variables are never evicted
+ENV_KEY_VARIABLES = ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "GEMINI_API_KEY")
+
+clients = OrderedDict()  # registry key -> [client, last used]
+retired = []  # [client, last used] of clients dropped over the cap, closed once idle
+clients_lock = threading.Lock()
+close_tasks = set()  # pending async closes, referenced so they aren't garbage collected
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=LLM_CLIENT_CONNECTIONS,
+        max_keepalive_connections=LLM_CLIENT_CONNECTIONS,
+        keepalive_expiry=LLM_CLIENT_KEEPALIVE
+    )
+
+
+def _build_openai(api_key, **options):
+    from openai import OpenAI
+    return OpenAI(api_key=api_key, **options,
+                  http_client=httpx.Client(http2=LLM_HTTP2, limits=_limits(), follow_redirects=True))
+
+
+def _build_openai_async(api_key, **options):
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=api_key, **options,
+                       http_client=httpx.AsyncClient(http2=LLM_HTTP2, limits=_limits(), follow_redirects=True))
+
+
+def _build_anthropic_async(api_key, **options):
+    import anthropic
+    return anthropic.AsyncAnthropic(api_key=api_key, **options,
+                                    http_client=httpx.AsyncClient(http2=LLM_HTTP2, limits=_limits()))
+
+
+def _build_gemini(api_key):
+    # google-genai manages its own httpx clients; reusing the Client reuses them
+    from google import genai
+    return genai.Client(api_key=api_key)
+
+
+BUILDERS = {
+    "openai": _build_openai,
+    "openai_async": _build_openai_async,
+    "anthropic_async": _build_anthropic_async,
+    "gemini": _build_gemini,
+}
+
+
+def _is_env_key(api_key):
+    return any(api_key and api_key == os.environ.get(name) for name in ENV_KEY_VARIABLES)
+
+
+def _close(client):
+    """Closes an evicted client's connection pool"""
+    close = getattr(client, "close", None)
+    if close is None:
+        return
+    try:
+        if asyncio.iscoroutinefunction(close):
+            task = asyncio.get_running_loop().create_task(close())
+            close_tasks.add(task)
+            task.add_done_callback(close_tasks.discard)
+        else:
+            close()
+    except RuntimeError:
+        # An async client evicted outside the event loop; its pool is freed with it
+        pass
+    except Exception as e:
+        print(f"Error closing LLM client: {str(e)}")
+
+
+def _evict(now):
+    """Drops idle clients for user-supplied keys (call with clients_lock held)"""
+    evicted = []
+    user_keys = [key for key in clients if not key[2]]
+    for key in user_keys:
+        if now - clients[key][1] > LLM_CLIENT_MAX_IDLE:
+            evicted.append(clients.pop(key)[0])
+    user_keys = [key for key in clients if not key[2]]
+    # Over the cap, the least recently used are dropped but may still be
+    # serving a request, so they are only closed once idle for as long
+    for key in user_keys[:max(0, len(user_keys) - LLM_CLIENT_MAX_KEYS)]:
+        retired.append(clients.pop(key))
+    idle = [entry for entry in retired if now - entry[1] > LLM_CLIENT_MAX_IDLE]
+    retired[:] = [entry for entry in retired if now - entry[1] <= LLM_CLIENT_MAX_IDLE]
+    evicted.extend(entry[0] for entry in idle)
+    return evicted
+
+
+def get_client(provider, api_key, **options):
+    """
+    The shared client for a provider and API key, created on first use.
+
+    Args:
+        provider (str): "openai", "openai_async", "anthropic_async" or "gemini"
+        api_key (str): API key
+        **options: Client options (base_url, timeout) that are part of the registry key
+
+    Returns:
+        The SDK client
+    """
+    digest = hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()
+    key = (provider, digest, _is_env_key(api_key), tuple(sorted(options.items())))
+    now = time.monotonic()
+    with clients_lock:
+        entry = clients.get(key)
+        if entry is None:
+            entry = clients[key] = [BUILDERS[provider](api_key, **options), now]
+        entry[1] = now
+        clients.move_to_end(key)
+        evicted = _evict(now)
+    for client in evicted:
+        _close(client)
+    return entry[0]
+
+
+def get_openai(api_key, **options):
+    """Shared synchronous OpenAI client"""
+    return get_client("openai", api_key, **options)
+
+
+def get_async_openai(api_key, **options):
+    """Shared AsyncOpenAI client"""
+    return get_client("openai_async", api_key, **options)
+
+
+def get_async_anthropic(api_key, **options):
+    """Shared AsyncAnthropic client"""
+    return get_client("anthropic_async", api_key, **options)
+
+
+def get_gemini(api_key):
+    """Shared google-genai client (sync and .aio)"""
+    return get_client("gemini", api_key)
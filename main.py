@@ -582,6 +582,7 @@ def get(req):
             hx_get="/api/gallery/list-interactives",
             hx_trigger="load"
         ),
+        Script(src="/static/js/blob_upload.js"),
         Script("""
             function showReplaceForm(id, title) {
                 document.getElementById('replace-form-container').style.display = 'block';
@@ -638,16 +639,7 @@ def get(req):
                 
                 try {
                     // Upload ZIP file to blob storage
-                    const zipResponse = await fetch('/api/blob/upload?filename=' + encodeURIComponent(zipFile.name), {
-                        method: 'POST',
-                        body: zipFile
-                    });
-                    
-                    if (!zipResponse.ok) {
-                        throw new Error('Failed to upload ZIP file');
-                    }
-                    
-                    const zipData = await zipResponse.json();
+                    const zipData = await uploadToBlob(zipFile);
                     
                     // Update the interactive with the new ZIP URL
                     const updateResponse = await fetch('/api/gallery/update-zip', {
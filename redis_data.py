@@ -6,6 +6,8 @@ import redis
 import argparse
 from tabulate import tabulate
 import sys
+import redis_store
+import redis_keys
 
 # Check for Redis URL (same as in api.py)
 REDIS_URL = os.environ.get('HTML5_REDIS_URL')
@@ -39,11 +41,15 @@ def get_submission(submission_id):
 def delete_submission(submission_id):
     """Delete a specific submission by ID"""
     # Check if submission exists
-    if not redis_client.hexists("submission", submission_id):
+    submission = get_submission(submission_id)
+    if submission is None:
         return False
     
-    # Delete the submission
-    result = redis_client.hdel("submission", submission_id)
+    # Delete the submission and its gallery index entries
+    pipe = redis_client.pipeline()
+    pipe.hdel("submission", submission_id)
+    redis_store.unindex_submission(pipe, submission_id, submission)
+    result = pipe.execute()[0]
     return result > 0
 
 def delete_all_submissions():
@@ -63,36 +69,29 @@ def delete_all_submissions():
     # Reset submissions count
     redis_client.set("submissions_count", 0)
     
+    # Clear the gallery indexes
+    redis_store.rebuild_submission_indexes(redis_client)
+    
     return deleted_count
 
 def get_all_submissions():
     """Get all submissions in the Redis database"""
-    all_submissions = []
-    submission_ids = redis_client.hkeys("submission")
-    for sid in submission_ids:
-        submission_data = redis_client.hget("submission", sid)
-        if submission_data:
-            submission = json.loads(submission_data)
-            # Convert byte ID to string to ensure consistency
-            submission['id'] = sid.decode('utf-8') if isinstance(sid, bytes) else sid
-            all_submissions.append(submission)
-    return all_submissions
+    return redis_store.load_submissions(redis_client)
 
 def get_all_draft_keys():
     """Get all draft-related keys in Redis"""
-    return redis_client.keys("html5_drafts:*") + redis_client.keys("html5_drafts_count:*")
+    return list(redis_keys.scan_keys(redis_client, "html5_drafts:*")) + list(redis_keys.scan_keys(redis_client, "html5_drafts_count:*"))
 
 def get_drafts_by_user():
     """Get count of drafts by user"""
-    draft_keys = redis_client.keys("html5_drafts:*")
-    user_drafts = {}
+    draft_keys = list(redis_keys.scan_keys(redis_client, "html5_drafts:*"))
     
+    # One pipelined round trip for all the HLENs
+    pipe = redis_client.pipeline(transaction=False)
     for key in draft_keys:
-        user_id = key.decode('utf-8').split(':')[1] if isinstance(key, bytes) else key.split(':')[1]
-        draft_count = redis_client.hlen(key)
-        user_drafts[user_id] = draft_count
+        pipe.hlen(key)
     
-    return user_drafts
+    return {key.split(':', 1)[1]: count for key, count in zip(draft_keys, pipe.execute())}
 
 def delete_all_drafts(user_id=None):
     """
@@ -109,43 +108,25 @@ def delete_all_drafts(user_id=None):
         user_drafts_key = f"html5_drafts:{user_id}"
         user_count_key = f"html5_drafts_count:{user_id}"
         
-        # Get all draft IDs for this user
-        draft_ids = redis_client.hkeys(user_drafts_key)
-        deleted_count = 0
+        # Count the drafts, then drop the hash and the count key together
+        deleted_count = redis_client.hlen(user_drafts_key)
         
-        if draft_ids:
-            # Delete each draft
-            for draft_id in draft_ids:
-                deleted_count += redis_client.hdel(user_drafts_key, draft_id)
-            
-            # Reset the draft count
-            redis_client.delete(user_count_key)
-            
+        if deleted_count:
+            redis_keys.unlink_keys(redis_client, [user_drafts_key, user_count_key])
             return deleted_count, 2  # Count drafts and the count key
         return 0, 0
     else:
         # Delete all drafts for all users
-        draft_keys = get_all_draft_keys()
-        deleted_keys = 0
-        total_drafts = 0
-        
-        for key in draft_keys:
-            key_str = key.decode('utf-8') if isinstance(key, bytes) else key
-            
-            # For draft hash, count the drafts first
-            if key_str.startswith("html5_drafts:"):
-                total_drafts += redis_client.hlen(key)
-            
-            # Delete the key
-            redis_client.delete(key)
-            deleted_keys += 1
+        # Count the drafts first, then delete every draft key in batches
+        total_drafts = sum(get_drafts_by_user().values())
+        deleted_keys = redis_keys.unlink_keys(redis_client, get_all_draft_keys())
         
         return total_drafts, deleted_keys
 
 def get_submissions_by_gallery_type(gallery_type):
     """Get submissions filtered by gallery type"""
-    all_submissions = get_all_submissions()
-    return [s for s in all_submissions if s.get('galleryType') == gallery_type]
+    submissions, _ = redis_store.query_submissions(redis_client, gallery_type)
+    return submissions
 
 def get_available_gallery_types():
     """Get a list of all available gallery types"""
@@ -182,7 +163,7 @@ def get_submission_stats():
 
 def list_all_keys():
     """List all keys in the Redis database"""
-    return redis_client.keys("*")
+    return list(redis_keys.scan_keys(redis_client, "*"))
 
 def get_redis_info():
     """Get Redis server information"""
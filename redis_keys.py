@@ -0,0 +1,132 @@
+from redis_store import decode_field
+
+# Non-blocking key management. KEYS walks the whole keyspace in one command
+# and blocks Redis for every client while it runs, and DEL frees large values
+# on the main thread. Instead:
+#   - SCAN iterates keys with a cursor, a batch per round trip
+#   - UNLINK frees values in a background thread, pipelined in batches
+#   - key registries record the keys of a family as they are written, so the
+#     family can be wiped without scanning at all:
+#       key_registry:{name}   set of key names
+SCAN_BATCH_SIZE = 1000
+UNLINK_BATCH_SIZE = 500
+KEY_REGISTRY_PREFIX = "key_registry"
+
+# Registries shared across modules
+PREVIEW_CACHE_REGISTRY = "gallery_preview_html"
+
+
+def scan_keys(client, pattern, batch_size=SCAN_BATCH_SIZE):
+    """
+    Iterate over the keys matching a glob pattern with SCAN
+
+    Keys created or deleted during the scan may or may not be returned; every
+    key present for the whole scan is returned at least once.
+
+    Yields:
+        str: Key names
+    """
+    for key in client.scan_iter(match=pattern, count=batch_size):
+        yield decode_field(key)
+
+
+def unlink_keys(client, keys, batch_size=UNLINK_BATCH_SIZE):
+    """
+    Delete keys with pipelined UNLINK batches
+
+    Args:
+        client: Redis client
+        keys: Iterable of key names (consumed lazily, so a scan can be passed in)
+        batch_size (int): Keys per UNLINK command
+
+    Returns:
+        int: Number of keys that existed and were removed
+    """
+    removed = 0
+    pipe = client.pipeline(transaction=False)
+    batch = []
+    queued = 0
+    for key in keys:
+        batch.append(key)
+        if len(batch) >= batch_size:
+            pipe.unlink(*batch)
+            batch = []
+            queued += 1
+            if queued >= 10:
+                removed += sum(pipe.execute())
+                queued = 0
+    if batch:
+        pipe.unlink(*batch)
+    removed += sum(pipe.execute())
+    return removed
+
+
+def unlink_matching(client, pattern, batch_size=UNLINK_BATCH_SIZE):
+    """
+    Delete every key matching a glob pattern without blocking Redis
+
+    Returns:
+        int: Number of keys removed
+    """
+    return unlink_keys(client, scan_keys(client, pattern), batch_size)
+
+
+def registry_key(registry):
+    return f"{KEY_REGISTRY_PREFIX}:{registry}"
+
+
+def register_key(pipe, registry, key, ttl=None):
+    """
+    Queue recording a key in a registry on a pipeline (or client)
+
+    Args:
+        pipe: Redis pipeline, executed by the caller with the key's own write
+        registry (str): Registry name
+        key (str): Key being written
+        ttl (int, optional): When the registered keys expire, the registry's own
+            expiry is pushed back to match, so it disappears with them
+    """
+    pipe.sadd(registry_key(registry), key)
+    if ttl:
+        pipe.expire(registry_key(registry), ttl)
+
+
+def unlink_registered(client, registry, batch_size=UNLINK_BATCH_SIZE):
+    """
+    Delete every key recorded in a registry, and the registry itself
+
+    Members are popped in batches with SPOP, so keys registered while the
+    wipe runs are either deleted by it or kept in the registry for the next.
+
+    Returns:
+        int: Number of keys that still existed and were removed
+    """
+    removed = 0
+    key = registry_key(registry)
+    while True:
+        batch = client.spop(key, batch_size)
+        if not batch:
+            break
+        removed += client.unlink(*batch)
+    return removed
+
+
+def prune_registry(client, registry, batch_size=SCAN_BATCH_SIZE):
+    """
+    Drop registry members whose keys have expired or were deleted elsewhere
+
+    Returns:
+        int: Number of members removed
+    """
+    key = registry_key(registry)
+    members = [decode_field(member) for member in client.sscan_iter(key, count=batch_size)]
+    stale = []
+    for start in range(0, len(members), batch_size):
+        batch = members[start:start + batch_size]
+        pipe = client.pipeline(transaction=False)
+        for member in batch:
+            pipe.exists(member)
+        stale.extend(member for member, exists in zip(batch, pipe.execute()) if not exists)
+    for start in range(0, len(stale), batch_size):
+        client.srem(key, *stale[start:start + batch_size])
+    return len(stale)
@@ -0,0 +1,291 @@
+import json
+import uuid
+from datetime import datetime
+from typing import TypedDict
+
+# orjson is optional; it decodes large batches of records noticeably faster
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+# Secondary indexes over the "submission" hash. Each is a sorted set of
+# submission ids scored by submission date:
+#   submission_idx:all                  every submission
+#   submission_idx:gallery:{galleryType}
+#   submission_idx:level:{level}
+#   submission_idx:subject:{keyword}    subjects containing the keyword
+SUBMISSION_INDEX_PREFIX = "submission_idx"
+SUBMISSION_INDEX_BUILT_KEY = f"{SUBMISSION_INDEX_PREFIX}:built"
+# Temporary result sets of query_submissions; not indexes, never rebuilt
+SUBMISSION_INDEX_TMP_PREFIX = f"{SUBMISSION_INDEX_PREFIX}:tmp:"
+# Held while the indexes are rebuilt, so only one process rebuilds at a time
+SUBMISSION_INDEX_REBUILD_LOCK_KEY = "submission_idx_rebuild_lock"
+SUBMISSION_INDEX_REBUILD_LOCK_TTL = 60  # seconds
+
+# Subject keywords the gallery pages filter on (case-insensitive substring match)
+SUBJECT_KEYWORDS = (
+    "math", "algebra", "geometry", "trigonometry", "statistics", "calculus", "further mathematics",
+    "science", "physics", "chemistry", "biology",
+    "history", "geography", "social studies", "humanities", "economics", "arts",
+    "design", "technology", "computing", "food", "consumer",
+    "english", "chinese", "malay", "tamil", "language", "literature", "general paper",
+)
+
+# Hashes up to this size are read with a single HGETALL; larger ones are
+# read with HSCAN in batches of this many fields so Redis isn't blocked
+HASH_BATCH_SIZE = 1000
+
+
+class SubmissionRecord(TypedDict, total=False):
+    """A gallery submission as stored in the "submission" hash"""
+    id: str
+    title: str
+    author: str
+    level: str
+    subject: str
+    galleryType: str
+    description: str
+    zipUrl: str
+    referenceImages: list
+    dateSubmitted: str
+
+
+class DraftRecord(TypedDict, total=False):
+    """An HTML5 draft as stored in a user's "html5_drafts:{user_id}" hash"""
+    id: str
+    html: str
+    css: str
+    js: str
+    timestamp: str
+
+
+def decode_field(field):
+    """Redis returns bytes; hash fields are used as str ids throughout the app"""
+    return field.decode('utf-8') if isinstance(field, bytes) else field
+
+
+def scan_hash(client, key, batch_size=HASH_BATCH_SIZE):
+    """
+    Read every field of a Redis hash in as few round trips as possible
+
+    Args:
+        client: Redis client
+        key (str): Hash key
+        batch_size (int): Fields per HSCAN batch for large hashes
+
+    Returns:
+        dict: Raw field -> value mapping
+    """
+    if client.hlen(key) <= batch_size:
+        return client.hgetall(key)
+
+    values = {}
+    cursor = None
+    while cursor != 0:
+        cursor, page = client.hscan(key, cursor or 0, count=batch_size)
+        values.update(page)
+    return values
+
+
+def load_hash_records(client, key, batch_size=HASH_BATCH_SIZE):
+    """
+    Load and JSON-decode every record in a Redis hash, adding the field as "id"
+
+    Returns:
+        list: Decoded records; values that aren't valid JSON objects are skipped
+    """
+    records = []
+    for field, value in scan_hash(client, key, batch_size).items():
+        try:
+            record = loads(value)
+        except ValueError as e:
+            print(f"Skipping malformed record {decode_field(field)} in {key}: {str(e)}")
+            continue
+        if isinstance(record, dict):
+            record['id'] = decode_field(field)
+            records.append(record)
+    return records
+
+
+def load_submissions(client, batch_size=HASH_BATCH_SIZE) -> list[SubmissionRecord]:
+    """Load all gallery submissions"""
+    return load_hash_records(client, "submission", batch_size)
+
+
+def load_drafts(client, user_id, batch_size=HASH_BATCH_SIZE) -> list[DraftRecord]:
+    """Load all of a user's HTML5 drafts"""
+    return load_hash_records(client, f"html5_drafts:{user_id}", batch_size)
+
+
+def submission_date_score(submission):
+    """Sort score for a submission: its dateSubmitted as a Unix timestamp (0 if missing)"""
+    try:
+        return datetime.fromisoformat(submission.get('dateSubmitted', '').replace('Z', '+00:00')).timestamp()
+    except (ValueError, AttributeError):
+        return 0
+
+
+def submission_index_keys(submission):
+    """The index sorted sets a submission belongs in"""
+    keys = [f"{SUBMISSION_INDEX_PREFIX}:all"]
+    if submission.get('galleryType'):
+        keys.append(f"{SUBMISSION_INDEX_PREFIX}:gallery:{submission['galleryType']}")
+    if submission.get('level'):
+        keys.append(f"{SUBMISSION_INDEX_PREFIX}:level:{submission['level'].lower()}")
+    subject = (submission.get('subject') or '').lower()
+    keys.extend(f"{SUBMISSION_INDEX_PREFIX}:subject:{keyword}" for keyword in SUBJECT_KEYWORDS if keyword in subject)
+    return keys
+
+
+def index_submission(pipe, submission_id, submission, previous=None):
+    """
+    Queue index updates for a saved submission on a pipeline
+
+    Args:
+        pipe: Redis pipeline (executed by the caller)
+        submission_id: Submission hash field
+        submission (dict): Submission as saved
+        previous (dict): Submission before the change, to drop stale index entries
+    """
+    submission_id = str(submission_id)
+    keys = submission_index_keys(submission)
+    if previous:
+        for key in set(submission_index_keys(previous)) - set(keys):
+            pipe.zrem(key, submission_id)
+
+    score = submission_date_score(submission)
+    for key in keys:
+        pipe.zadd(key, {submission_id: score})
+
+
+# Allocates the next submission id and writes the record and its index
+# entries atomically, in one round trip. KEYS: submissions_count, submission,
+# then the index sorted sets; ARGV: record JSON, index score.
+# Ids are 0-based (the counter holds the number of ids handed out); ids that
+# already exist in the hash (a counter reset by hand) are skipped.
+SAVE_SUBMISSION_SCRIPT = """
+local submission_id = redis.call('INCR', KEYS[1]) - 1
+while redis.call('HEXISTS', KEYS[2], submission_id) == 1 do
+    submission_id = redis.call('INCR', KEYS[1]) - 1
+end
+redis.call('HSET', KEYS[2], submission_id, ARGV[1])
+for i = 3, #KEYS do
+    redis.call('ZADD', KEYS[i], ARGV[2], submission_id)
+end
+return submission_id
+"""
+
+
+# Registered on first use; each call runs it on the caller's client
+save_submission_script = None
+
+
+def save_submission(client, submission):
+    """
+    Save a new submission under a freshly allocated id and index it
+
+    Returns:
+        int: The submission's id
+    """
+    global save_submission_script
+    if save_submission_script is None:
+        save_submission_script = client.register_script(SAVE_SUBMISSION_SCRIPT)
+    keys = ["submissions_count", "submission"] + submission_index_keys(submission)
+    return int(save_submission_script(keys=keys, args=[json.dumps(submission), submission_date_score(submission)],
+                                      client=client))
+
+
+def unindex_submission(pipe, submission_id, submission):
+    """Queue removal of a deleted submission from its indexes on a pipeline"""
+    for key in submission_index_keys(submission):
+        pipe.zrem(key, str(submission_id))
+
+
+def rebuild_submission_indexes(client):
+    """
+    Rebuild every submission index from the "submission" hash
+
+    Returns:
+        int: Number of submissions indexed, or None if another rebuild is running
+    """
+    token = uuid.uuid4().hex
+    if not client.set(SUBMISSION_INDEX_REBUILD_LOCK_KEY, token, nx=True, ex=SUBMISSION_INDEX_REBUILD_LOCK_TTL):
+        print("Submission indexes are already being rebuilt")
+        return None
+
+    try:
+        submissions = load_submissions(client)
+
+        pipe = client.pipeline()
+        for key in client.scan_iter(match=f"{SUBMISSION_INDEX_PREFIX}:*", count=HASH_BATCH_SIZE):
+            # Leave in-flight query results alone
+            if not decode_field(key).startswith(SUBMISSION_INDEX_TMP_PREFIX):
+                pipe.unlink(key)
+        for submission in submissions:
+            index_submission(pipe, submission['id'], submission)
+        pipe.set(SUBMISSION_INDEX_BUILT_KEY, 1)
+        pipe.execute()
+    finally:
+        if decode_field(client.get(SUBMISSION_INDEX_REBUILD_LOCK_KEY)) == token:
+            client.delete(SUBMISSION_INDEX_REBUILD_LOCK_KEY)
+
+    print(f"Rebuilt submission indexes for {len(submissions)} submissions")
+    return len(submissions)
+
+
+def query_submissions(client, gallery_type=None, level=None, keywords=None, offset=0, limit=None) -> tuple[list[SubmissionRecord], int]:
+    """
+    Fetch one page of submissions matching all filters, newest first, using the indexes
+
+    Args:
+        gallery_type (str): galleryType to match
+        level (str): Education level to match
+        keywords (list): Subject keywords from SUBJECT_KEYWORDS; matches any of them
+        offset (int): Index of the first result to return
+        limit (int): Maximum results to return (None for all)
+
+    Returns:
+        tuple: (submissions, total number of matches)
+    """
+    if keywords:
+        unknown = [keyword for keyword in keywords if keyword not in SUBJECT_KEYWORDS]
+        if unknown:
+            raise ValueError(f"Subject keywords not indexed: {unknown}")
+
+    if not client.exists(SUBMISSION_INDEX_BUILT_KEY):
+        rebuild_submission_indexes(client)
+
+    keys = []
+    if gallery_type:
+        keys.append(f"{SUBMISSION_INDEX_PREFIX}:gallery:{gallery_type}")
+    if level:
+        keys.append(f"{SUBMISSION_INDEX_PREFIX}:level:{level.lower()}")
+
+    # Combine the filters into a temporary sorted set in one transaction
+    temp_key = f"{SUBMISSION_INDEX_TMP_PREFIX}{uuid.uuid4().hex}"
+    pipe = client.pipeline()
+    if keywords:
+        pipe.zunionstore(temp_key, [f"{SUBMISSION_INDEX_PREFIX}:subject:{keyword}" for keyword in keywords], aggregate="MAX")
+        keys.append(temp_key)
+    if len(keys) > 1:
+        pipe.zinterstore(temp_key, keys, aggregate="MAX")
+    result_key = temp_key if len(keys) > 1 or keywords else (keys[0] if keys else f"{SUBMISSION_INDEX_PREFIX}:all")
+
+    pipe.zrevrange(result_key, offset, -1 if limit is None else offset + limit - 1)
+    pipe.zcard(result_key)
+    pipe.delete(temp_key)
+    submission_ids, total = pipe.execute()[-3:-1]
+
+    if not submission_ids:
+        return [], total
+
+    submissions = []
+    for submission_id, value in zip(submission_ids, client.hmget("submission", submission_ids)):
+        # Entries deleted outside the app are skipped until the next rebuild
+        if value:
+            submission = loads(value)
+            submission['id'] = decode_field(submission_id)
+            submissions.append(submission)
+    return submissions, total
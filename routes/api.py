@@ -1,28 +1,30 @@
 from fasthtml.common import *
 import json
 import os
-import io
-import zipfile
-import urllib.request
-import tempfile
 import shutil
 import mimetypes
-import base64
 import re
 import redis
 import time
-import http.client
-from urllib.parse import urlparse
+import asyncio
+import threading
+import hashlib
 from pathlib import Path
 from starlette.requests import Request
-from starlette.responses import JSONResponse, Response, HTMLResponse, FileResponse
+from starlette.responses import JSONResponse, Response, HTMLResponse, FileResponse, StreamingResponse
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
 from datetime import datetime
+import redis_store
+import redis_keys
+import zip_store
+import gallery_html
+import blob_cache
+import blob_upload
+import blob_storage
 
 # Check for blob token
-BLOB_TOKEN = os.environ.get('BLOB_READ_WRITE_TOKEN')
-if not BLOB_TOKEN:
-    print("WARNING: BLOB_READ_WRITE_TOKEN environment variable not set. Blob storage will use mock implementation.")
+if not blob_upload.BLOB_TOKEN:
+    print("WARNING: BLOB_READ_WRITE_TOKEN environment variable not set. Blobs will be stored with the local backend.")
 
 # Check for Redis URL
 REDIS_URL = os.environ.get('HTML5_REDIS_URL')
@@ -39,147 +41,200 @@ except Exception as e:
     print(f"Error connecting to Redis: {str(e)}. Using fallback in-memory storage.")
     redis_client = None
 
-# Import Vercel Blob SDK if available
-try:
-    import vercel_blob
-    # Only use vercel_blob if we have a token
-    if BLOB_TOKEN:
-        def blob_put(path, data, options=None):
-            print(f"VERCEL: Uploading to {path} with options {options}")
-            return vercel_blob.put(path, data, options)
-    else:
-        raise ImportError("BLOB_READ_WRITE_TOKEN not set")
-except ImportError as e:
-    print(f"Vercel Blob not available: {str(e)}. Using mock implementation.")
-    # Mock implementation for development without Vercel Blob
-    def blob_put(path, data, options=None):
-        print(f"MOCK: Would upload to {path} with options {options}")
-        return {
-            "url": f"https://example-blob-storage.com/{path}",
-            "pathname": path,
-            "contentType": getattr(data, "content_type", "application/octet-stream"),
-            "contentDisposition": None,
-            "size": getattr(data, "size", 0)
-        }
-
 # Fallback in-memory storage for when Redis is not available
 submissions_memory = []
+submissions_memory_lock = threading.Lock()
 
-# In-memory storage for extracted ZIP files
-# Key: submission_id, Value: (temp_dir_path, files_dict)
-extracted_zips = {}
 
-# Function to validate if a URL exists without downloading the entire file
-def url_exists(url):
-    try:
-        parsed_url = urlparse(url)
-        conn = http.client.HTTPSConnection(parsed_url.netloc, timeout=5)
-        path = parsed_url.path
-        if parsed_url.query:
-            path += f"?{parsed_url.query}"
-        
-        conn.request("HEAD", path)
-        response = conn.getresponse()
-        conn.close()
-        
-        # Check if response is successful (2xx) or redirect (3xx)
-        return 200 <= response.status < 400
-    except Exception as e:
-        print(f"Error checking URL {url}: {str(e)}")
-        return False
+# Link health index: a background task revalidates every submission's blob URLs
+# on a schedule and records the result per submission, so gallery requests only
+# read the index instead of making network calls
+LINK_HEALTH_KEY = "submission_health"
+LINK_HEALTH_LAST_RUN_KEY = "submission_health_last_run"
+LINK_HEALTH_INTERVAL = int(os.environ.get('LINK_HEALTH_INTERVAL', 900))  # seconds between checks
+LINK_HEALTH_CONCURRENCY = int(os.environ.get('LINK_HEALTH_CONCURRENCY', 10))  # concurrent HEAD requests
+LINK_HEALTH_MAX_FAILURES = int(os.environ.get('LINK_HEALTH_MAX_FAILURES', 3))  # consecutive failed checks before removal
+
+# Fallback link health index when Redis is not available
+link_health_memory = {}
+link_health_task = None
 
-# Function to validate a submission record's blob URLs
-def validate_submission(submission):
+# Function to check if a URL exists without downloading the entire file
+async def url_exists(semaphore, url):
+    async with semaphore:
+        try:
+            return await blob_storage.get_storage().head(url)
+        except Exception as e:
+            print(f"Error checking URL {url}: {str(e)}")
+            return False
+
+# Function to check a submission record's blob URLs
+async def check_submission_links(semaphore, submission):
     """
-    Validates that all blob URLs in a submission record are accessible.
+    Checks that all blob URLs in a submission record are accessible.
     
     Returns:
-        bool: True if all URLs are valid, False if any are invalid
+        str: The first invalid URL, or None if all URLs are valid
     """
-    if not submission:
-        return False
+    urls = [submission.get('zipUrl')] + list(submission.get('referenceImages', []))
+    if not urls[0]:
+        return "(missing zipUrl)"
     
-    # Check main ZIP URL
-    zip_url = submission.get('zipUrl')
-    if not zip_url or not url_exists(zip_url):
-        print(f"Invalid ZIP URL in submission: {zip_url}")
-        return False
-    
-    # Check reference image URLs
-    reference_images = submission.get('referenceImages', [])
-    for img_url in reference_images:
-        if not url_exists(img_url):
-            print(f"Invalid reference image URL in submission: {img_url}")
-            return False
+    results = await asyncio.gather(*(url_exists(semaphore, url) for url in urls))
+    for url, ok in zip(urls, results):
+        if not ok:
+            return url
+    return None
+
+def get_link_health():
+    """
+    Read the link health index.
     
-    return True
+    Returns:
+        dict: submission id (str) -> {"status": "ok"|"broken", "checked_at": float, "failures": int, "invalid_url": str}
+    """
+    if redis_client:
+        try:
+            return {
+                (sid.decode('utf-8') if isinstance(sid, bytes) else sid): json.loads(entry)
+                for sid, entry in redis_client.hgetall(LINK_HEALTH_KEY).items()
+            }
+        except Exception as e:
+            print(f"Error reading link health from Redis: {str(e)}. Falling back to memory storage.")
+    return dict(link_health_memory)
 
-# Function to cleanup invalid submissions
-def cleanup_invalid_submissions():
+def is_submission_broken(submission_id):
+    """Whether the last link health check found a submission's blob URLs unavailable"""
+    entry = None
+    if redis_client:
+        try:
+            entry = redis_client.hget(LINK_HEALTH_KEY, str(submission_id))
+            entry = json.loads(entry) if entry else None
+        except Exception as e:
+            print(f"Error reading link health from Redis: {str(e)}")
+    else:
+        entry = link_health_memory.get(str(submission_id))
+    return bool(entry) and entry.get('status') == 'broken'
+
+async def run_link_health_check():
     """
-    Scans all submissions in Redis and removes those with invalid blob URLs.
+    Revalidates every submission's blob URLs with bounded concurrency and updates the
+    link health index. Submissions that fail LINK_HEALTH_MAX_FAILURES checks in a row are removed.
     
     Returns:
-        tuple: (cleaned_count, total_count) - number of records cleaned up and total checked
+        dict: checked, broken and removed counts and the time taken
     """
-    if not redis_client:
-        print("Redis not available, skipping cleanup")
-        return 0, 0
+    start_time = time.time()
+    submissions = list(await asyncio.to_thread(get_all_submissions))
+    previous = await asyncio.to_thread(get_link_health)
     
-    try:
-        cleaned_count = 0
-        submission_ids = redis_client.hkeys("submission")
-        print(f"Checking {len(submission_ids)} submissions for validity...")
-        
-        for sid in submission_ids:
-            try:
-                submission_data = redis_client.hget("submission", sid)
-                if submission_data:
-                    submission = json.loads(submission_data)
-                    if not validate_submission(submission):
-                        # Delete invalid submission
-                        redis_client.hdel("submission", sid)
-                        print(f"Deleted invalid submission with ID {sid}")
-                        cleaned_count += 1
-            except Exception as e:
-                print(f"Error processing submission {sid}: {str(e)}")
-        
-        print(f"Cleanup complete. Removed {cleaned_count} invalid submissions out of {len(submission_ids)}.")
-        return cleaned_count, len(submission_ids)
+    # The storage backend's pooled client keeps connections alive per blob host
+    semaphore = asyncio.Semaphore(LINK_HEALTH_CONCURRENCY)
+    invalid_urls = await asyncio.gather(*(check_submission_links(semaphore, submission) for submission in submissions))
     
-    except Exception as e:
-        print(f"Error during cleanup: {str(e)}")
-        return 0, 0
+    # Failing submissions are re-read before acting on them: one changed during the
+    # pass (its ZIP replaced, say) is checked again, and one deleted is skipped
+    deleted = set()
+    for i, (submission, invalid_url) in enumerate(zip(submissions, invalid_urls)):
+        if not invalid_url:
+            continue
+        current = await asyncio.to_thread(get_submission_record, submission.get('id'))
+        if current is None:
+            deleted.add(str(submission.get('id')))
+        elif current != submission:
+            submissions[i] = current
+            invalid_urls[i] = await check_submission_links(semaphore, current)
+    
+    health = {}
+    removed = {}
+    for submission, invalid_url in zip(submissions, invalid_urls):
+        sid = str(submission.get('id'))
+        if sid in deleted:
+            continue
+        failures = previous.get(sid, {}).get('failures', 0) + 1 if invalid_url else 0
+        if failures >= LINK_HEALTH_MAX_FAILURES:
+            removed[sid] = submission
+            continue
+        health[sid] = {
+            "status": "broken" if invalid_url else "ok",
+            "checked_at": time.time(),
+            "failures": failures,
+            "invalid_url": invalid_url
+        }
+    
+    if redis_client:
+        try:
+            pipe = redis_client.pipeline()
+            pipe.delete(LINK_HEALTH_KEY)
+            if health:
+                pipe.hset(LINK_HEALTH_KEY, mapping={sid: json.dumps(entry) for sid, entry in health.items()})
+            if removed:
+                pipe.hdel("submission", *removed)
+                for sid, submission in removed.items():
+                    redis_store.unindex_submission(pipe, sid, submission)
+            pipe.execute()
+        except Exception as e:
+            print(f"Error writing link health to Redis: {str(e)}")
+    else:
+        link_health_memory.clear()
+        link_health_memory.update(health)
+    
+    for sid in removed:
+        print(f"Deleted submission {sid} after {LINK_HEALTH_MAX_FAILURES} failed link checks")
+    
+    broken = sum(1 for entry in health.values() if entry['status'] == 'broken')
+    elapsed_time = time.time() - start_time
+    print(f"Link health check complete in {elapsed_time:.2f} seconds: {len(submissions)} checked, {broken} broken, {len(removed)} removed.")
+    return {
+        "checked": len(submissions),
+        "broken": broken,
+        "removed": len(removed),
+        "time_seconds": round(elapsed_time, 2)
+    }
+
+def claim_link_health_run():
+    """
+    Whether this worker should run the scheduled check: every worker runs the loop,
+    but the first to set LINK_HEALTH_LAST_RUN_KEY (NX, expiring after one interval)
+    runs the pass for that interval
+    """
+    if redis_client:
+        try:
+            return bool(redis_client.set(LINK_HEALTH_LAST_RUN_KEY, time.time(), nx=True, ex=LINK_HEALTH_INTERVAL))
+        except Exception as e:
+            print(f"Error claiming link health run in Redis: {str(e)}")
+    return True
+
+async def link_health_loop():
+    """Run the link health check every LINK_HEALTH_INTERVAL seconds, once across all workers"""
+    while True:
+        try:
+            if await asyncio.to_thread(claim_link_health_run):
+                await run_link_health_check()
+        except Exception as e:
+            print(f"Error during link health check: {str(e)}")
+        await asyncio.sleep(LINK_HEALTH_INTERVAL)
+
+def ensure_link_health_checker():
+    """Start the background link health task on the running event loop if it isn't running yet"""
+    global link_health_task
+    if link_health_task is None or link_health_task.done():
+        link_health_task = asyncio.get_running_loop().create_task(link_health_loop())
 
 # Function to save submission to Redis
 def save_submission(submission):
     if redis_client:
         try:
-            # Get current submissions count for ID assignment
-            submission_count = redis_client.get("submissions_count")
-            if submission_count is None:
-                submission_count = 0
-            else:
-                submission_count = int(submission_count)
-            
-            # Assign ID to submission
-            submission_id = submission_count
-            
-            # Save the submission
-            redis_client.hset("submission", submission_id, json.dumps(submission))
-            
-            # Increment submissions count
-            redis_client.set("submissions_count", submission_count + 1)
-            
-            return submission_id
+            # Allocate the ID (INCR) and write the record and its gallery indexes atomically
+            return redis_store.save_submission(redis_client, submission)
         except Exception as e:
             print(f"Error saving to Redis: {str(e)}. Falling back to memory storage.")
-            submissions_memory.append(submission)
-            return len(submissions_memory) - 1
-    else:
-        # Fallback to memory storage
-        submissions_memory.append(submission)
-        return len(submissions_memory) - 1
+    
+    # Fallback to memory storage: the ID is the list position, taken under a lock
+    with submissions_memory_lock:
+        submission_id = len(submissions_memory)
+        submissions_memory.append(dict(submission, id=str(submission_id)))
+    return submission_id
 
 # Function to get a submission by ID
 def get_submission(submission_id):
@@ -200,20 +255,25 @@ def get_submission(submission_id):
             return submissions_memory[submission_id]
         return None
 
+def get_submission_record(submission_id):
+    """A submission as currently stored, with its id added (None if it no longer exists)"""
+    if redis_client:
+        try:
+            submission_data = redis_client.hget("submission", str(submission_id))
+            return dict(json.loads(submission_data), id=str(submission_id)) if submission_data else None
+        except Exception as e:
+            print(f"Error getting submission from Redis: {str(e)}. Falling back to memory storage.")
+    for submission in submissions_memory:
+        if str(submission.get('id')) == str(submission_id):
+            return submission
+    return None
+
 # Function to get all submissions
 def get_all_submissions():
     if redis_client:
         try:
-            all_submissions = []
-            submission_ids = redis_client.hkeys("submission")
-            for sid in submission_ids:
-                submission_data = redis_client.hget("submission", sid)
-                if submission_data:
-                    submission = json.loads(submission_data)
-                    # Add ID to the submission data
-                    submission['id'] = sid.decode('utf-8') if isinstance(sid, bytes) else sid
-                    all_submissions.append(submission)
-            return all_submissions
+            # Bulk read of the whole hash, with the hash field added as 'id'
+            return redis_store.load_submissions(redis_client)
         except Exception as e:
             print(f"Error getting all submissions from Redis: {str(e)}. Falling back to memory storage.")
             return submissions_memory
@@ -221,243 +281,211 @@ def get_all_submissions():
         # Fallback to memory storage
         return submissions_memory
 
+# Submissions per gallery page
+GALLERY_PAGE_SIZE = 24
+
+def parse_gallery_page(req):
+    """Read the 1-based ?page= number of a gallery page request"""
+    try:
+        return max(1, int(req.query_params.get('page', 1)))
+    except ValueError:
+        return 1
+
 # Function to get submissions by gallery type
 def get_submissions_by_gallery_type(gallery_type):
-    all_submissions = get_all_submissions()
-    return [s for s in all_submissions if s.get('galleryType') == gallery_type]
+    submissions, _ = get_submissions_page(gallery_type)
+    return submissions
+
+# Function to get one page of submissions, newest first
+def get_submissions_page(gallery_type, keywords=None, level=None, offset=0, limit=None):
+    """
+    Get the submissions for a gallery, optionally filtered by subject keywords and level.
+    Uses the Redis indexes so only the requested slice is loaded.
+    
+    Args:
+        gallery_type (str): 'primary', 'secondary' or 'jc_ci'
+        keywords (list): Subject keywords (case-insensitive contains match on subject, any of them)
+        level (str): Education level
+        offset (int): Index of the first submission to return
+        limit (int): Maximum number of submissions to return (None for all)
+        
+    Returns:
+        tuple: (submissions, total number of matching submissions)
+    """
+    if redis_client:
+        try:
+            return redis_store.query_submissions(redis_client, gallery_type, level=level, keywords=keywords, offset=offset, limit=limit)
+        except Exception as e:
+            print(f"Error querying submission indexes: {str(e)}. Filtering all submissions instead.")
+    
+    # Fallback: filter everything in Python
+    matches = [
+        s for s in get_all_submissions()
+        if s.get('galleryType') == gallery_type
+        and (not level or (s.get('level') or '').lower() == level.lower())
+        and (not keywords or any(keyword in (s.get('subject') or '').lower() for keyword in keywords))
+    ]
+    matches.sort(key=redis_store.submission_date_score, reverse=True)
+    return matches[offset:None if limit is None else offset + limit], len(matches)
 
 # Function to extract ZIP and return modified HTML
 def extract_zip_and_process_html(zip_data, submission_id=None):
     """
-    Extracts a ZIP file, processes the HTML content, and optionally stores file references
-    for later retrieval.
+    Extracts a ZIP file into the shared extraction store, processes the HTML content,
+    and optionally records the archive against a submission for later asset retrieval.
     
     Args:
-        zip_data (bytes): The ZIP file content as bytes
+        zip_data (bytes or str): The ZIP file content as bytes, or a path to the ZIP file
         submission_id (str, optional): An ID to associate with the extracted files for later retrieval
     
     Returns:
         tuple: (processed_html_content, temp_dir_path, files_dict)
             - processed_html_content: The HTML content with paths modified to point to assets
-            - temp_dir_path: Path to the temporary directory where files were extracted
-            - files_dict: Dictionary mapping relative paths to absolute file paths
+            - temp_dir_path: Path to the store directory where files were extracted
+            - files_dict: Dictionary mapping lookup keys to the archive's relative paths
     """
     try:
-        # Create a temporary directory to extract files
-        temp_dir = tempfile.mkdtemp(prefix="gallery_preview_")
+        # Extract into the shared store; identical archives are only extracted once
+        digest, temp_dir, manifest = zip_store.publish(zip_data)
+        
+        # Create a dictionary to store file paths
+        files_dict = {}
         
-        # Create a zip file object from the zip data
-        zip_buffer = io.BytesIO(zip_data)
-        with zipfile.ZipFile(zip_buffer, 'r') as zip_ref:
-            # Extract all files to the temporary directory
-            zip_ref.extractall(temp_dir)
+        # Find index.html file
+        index_html_path = None
+        for rel_path in manifest["files"]:
+            file = rel_path.rsplit('/', 1)[-1]
             
-            # Create a dictionary to store file paths
-            files_dict = {}
+            files_dict[rel_path] = rel_path
+            files_dict[rel_path.replace('/', os.path.sep)] = rel_path
+            
+            # Also store just the filename for easier lookup
+            files_dict[file] = rel_path
             
             # Find index.html file
-            index_html_path = None
-            for root, _, files in os.walk(temp_dir):
-                for file in files:
-                    # Get the absolute path of the file
-                    abs_path = os.path.join(root, file)
-                    
-                    # Calculate relative path for dictionary key
-                    rel_path = os.path.relpath(abs_path, temp_dir)
-                    files_dict[rel_path] = abs_path
-                    files_dict[rel_path.replace(os.path.sep, '/')] = abs_path
+            if file.lower() == 'index.html':
+                index_html_path = rel_path
+        
+        # If index.html not found, look for any HTML file
+        if not index_html_path:
+            html_files = [path for path in files_dict.values() if path.lower().endswith('.html')]
+            if html_files:
+                index_html_path = html_files[0]
+            else:
+                raise ValueError("No HTML files found in the ZIP archive")
+        
+        # Read the HTML content
+        html_content = gallery_html.read_store_text(digest, manifest, index_html_path)
+        
+        # Process the HTML to correct asset paths
+        if submission_id:
+            # If we have a submission ID, use it to create a base path for assets
+            base_path = f"/api/gallery/asset/{submission_id}/"
+            
+            # Rewrite links to CSS files
+            html_content = re.sub(
+                r'<link\s+[^>]*href=[\'"](.*?)[\'"]',
+                lambda m: f'<link href="{base_path + m.group(1)}"' if not m.group(1).startswith(('http://', 'https://', '/')) else m.group(0),
+                html_content
+            )
+            
+            # Rewrite links to JavaScript files
+            html_content = re.sub(
+                r'<script\s+[^>]*src=[\'"](.*?)[\'"]',
+                lambda m: f'<script src="{base_path + m.group(1)}"' if not m.group(1).startswith(('http://', 'https://', '/')) else m.group(0),
+                html_content
+            )
+            
+            # Rewrite image sources
+            html_content = re.sub(
+                r'<img\s+[^>]*src=[\'"](.*?)[\'"]',
+                lambda m: f'<img src="{base_path + m.group(1)}"' if not m.group(1).startswith(('http://', 'https://', '/')) else m.group(0),
+                html_content
+            )
+            
+            # Add base tag to head if not present
+            if "<base" not in html_content and "<head" in html_content:
+                head_end = html_content.find("</head>")
+                if head_end > 0:
+                    html_content = html_content[:head_end] + f'<base href="{base_path}">' + html_content[head_end:]
+            
+            # # Process JavaScript files to update image paths
+            # js_files = [path for path in files_dict.values() if path.lower().endswith('.js')]
+            # for js_path in js_files:
+            #     try:
+            #         with open(js_path, 'r', encoding='utf-8', errors='replace') as f:
+            #             js_content = f.read()
                     
-                    # Also store just the filename for easier lookup
-                    files_dict[file] = abs_path
+            #         # Replace image paths in JavaScript - targeting patterns like: image: "image/filename.png"
+            #         # This regex looks for image paths in JavaScript object properties
+            #         js_content = re.sub(
+            #             r'(image:\s*["\'])([\w\-./]+?)(["\'])',
+            #             lambda m: f'{m.group(1)}{base_path}{m.group(2)}{m.group(3)}' if not m.group(2).startswith(('http://', 'https://', '/')) else m.group(0),
+            #             js_content
+            #         )
                     
-                    # Find index.html file
-                    if file.lower() == 'index.html':
-                        index_html_path = abs_path
-            
-            # If index.html not found, look for any HTML file
-            if not index_html_path:
-                html_files = [path for path in files_dict.values() if path.lower().endswith('.html')]
-                if html_files:
-                    index_html_path = html_files[0]
-                else:
-                    raise ValueError("No HTML files found in the ZIP archive")
-            
-            # Read the HTML content
-            with open(index_html_path, 'r', encoding='utf-8', errors='replace') as f:
-                html_content = f.read()
-            
-            # Process the HTML to correct asset paths
-            if submission_id:
-                # If we have a submission ID, use it to create a base path for assets
-                base_path = f"/api/gallery/asset/{submission_id}/"
-                
-                # Rewrite links to CSS files
-                html_content = re.sub(
-                    r'<link\s+[^>]*href=[\'"](.*?)[\'"]',
-                    lambda m: f'<link href="{base_path + m.group(1)}"' if not m.group(1).startswith(('http://', 'https://', '/')) else m.group(0),
-                    html_content
-                )
-                
-                # Rewrite links to JavaScript files
-                html_content = re.sub(
-                    r'<script\s+[^>]*src=[\'"](.*?)[\'"]',
-                    lambda m: f'<script src="{base_path + m.group(1)}"' if not m.group(1).startswith(('http://', 'https://', '/')) else m.group(0),
-                    html_content
-                )
-                
-                # Rewrite image sources
-                html_content = re.sub(
-                    r'<img\s+[^>]*src=[\'"](.*?)[\'"]',
-                    lambda m: f'<img src="{base_path + m.group(1)}"' if not m.group(1).startswith(('http://', 'https://', '/')) else m.group(0),
-                    html_content
-                )
-                
-                # Add base tag to head if not present
-                if "<base" not in html_content and "<head" in html_content:
-                    head_end = html_content.find("</head>")
-                    if head_end > 0:
-                        html_content = html_content[:head_end] + f'<base href="{base_path}">' + html_content[head_end:]
+            #         with open(js_path, 'w', encoding='utf-8') as f:
+            #             f.write(js_content)
+            #     except Exception as e:
+            #         print(f"Error processing JavaScript file {js_path}: {str(e)}")
+            
+            # Record the archive so any worker can serve this submission's assets
+            zip_store.set_ref(submission_id, digest)
+        else:
+            # For direct preview without submission_id, use relative paths
+            # We still need to fix paths that might be broken during extraction
+            
+            # Inline small CSS, JS and images in a single pass over the HTML
+            html_content = gallery_html.inline_assets(html_content, digest, manifest, files_dict)
+            
+            # Store in Redis for temporary access (if using Redis)
+            if redis_client and not submission_id:
+                # Generate a temporary ID for this preview
+                temp_id = f"temp_preview_{int(time.time())}_{os.urandom(4).hex()}"
                 
-                # # Process JavaScript files to update image paths
-                # js_files = [path for path in files_dict.values() if path.lower().endswith('.js')]
-                # for js_path in js_files:
-                #     try:
-                #         with open(js_path, 'r', encoding='utf-8', errors='replace') as f:
-                #             js_content = f.read()
-                        
-                #         # Replace image paths in JavaScript - targeting patterns like: image: "image/filename.png"
-                #         # This regex looks for image paths in JavaScript object properties
-                #         js_content = re.sub(
-                #             r'(image:\s*["\'])([\w\-./]+?)(["\'])',
-                #             lambda m: f'{m.group(1)}{base_path}{m.group(2)}{m.group(3)}' if not m.group(2).startswith(('http://', 'https://', '/')) else m.group(0),
-                #             js_content
-                #         )
-                        
-                #         with open(js_path, 'w', encoding='utf-8') as f:
-                #             f.write(js_content)
-                #     except Exception as e:
-                #         print(f"Error processing JavaScript file {js_path}: {str(e)}")
-                
-                # Store the extracted files for later retrieval
-                if submission_id:
-                    extracted_zips[submission_id] = (temp_dir, files_dict)
-                    
-                    # Store a cleanup flag in Redis to delete this temp data when no longer needed
-                    # The timeout is set to 30 minutes (1800 seconds)
-                    if redis_client:
-                        try:
-                            redis_client.setex(f"gallery_preview_{submission_id}", 1800, "1")
-                        except Exception as e:
-                            print(f"Error setting Redis cleanup key: {str(e)}")
-            else:
-                # For direct preview without submission_id, use relative paths
-                # We still need to fix paths that might be broken during extraction
-                
-                # Create a data URI for inline resources (small files)
-                for file_rel_path, file_abs_path in files_dict.items():
-                    if os.path.getsize(file_abs_path) < 1024 * 1024:  # Less than 1MB
-                        # Only process CSS and JS files for inline inclusion
-                        if file_rel_path.endswith('.css'):
-                            with open(file_abs_path, 'r', encoding='utf-8', errors='replace') as f:
-                                css_content = f.read()
-                            # Find CSS references in HTML and replace with inline content
-                            pattern = f'<link[^>]*href=[\'"]({re.escape(file_rel_path)})[\'"][^>]*>'
-                            replacement = f'<style>{css_content}</style>'
-                            html_content = re.sub(pattern, replacement, html_content)
-                        
-                        elif file_rel_path.endswith('.js'):
-                            with open(file_abs_path, 'r', encoding='utf-8', errors='replace') as f:
-                                js_content = f.read()
-                            
-                            # # Process image paths in JS files
-                            # js_content = re.sub(
-                            #     r'(image:\s*["\'])([\w\-./]+?)(["\'])',
-                            #     lambda m: f'{m.group(1)}data:image/png;base64,{base64.b64encode(open(os.path.join(temp_dir, m.group(2)), "rb").read()).decode("utf-8")}{m.group(3)}' 
-                            #     if os.path.exists(os.path.join(temp_dir, m.group(2))) and os.path.getsize(os.path.join(temp_dir, m.group(2))) < 100 * 1024 
-                            #     else m.group(0),
-                            #     js_content
-                            # )
-                            
-                            # Find JS references in HTML and replace with inline content
-                            pattern = f'<script[^>]*src=[\'"]({re.escape(file_rel_path)})[\'"][^>]*></script>'
-                            replacement = f'<script>{js_content}</script>'
-                            html_content = re.sub(pattern, replacement, html_content)
-                
-                # For images, we convert small images to data URIs
-                for rel_path, abs_path in files_dict.items():
-                    if os.path.getsize(abs_path) < 100 * 1024:  # Less than 100KB
-                        if any(rel_path.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.svg']):
-                            with open(abs_path, 'rb') as f:
-                                img_data = f.read()
-                            
-                            # Get the MIME type
-                            mime_type, _ = mimetypes.guess_type(rel_path)
-                            if not mime_type:
-                                mime_type = "image/png"  # Default
-                            
-                            # Create data URI
-                            data_uri = f"data:{mime_type};base64,{base64.b64encode(img_data).decode('utf-8')}"
-                            
-                            # Replace in HTML
-                            html_content = re.sub(
-                                f'src=[\'"]({re.escape(rel_path)})[\'"]',
-                                f'src="{data_uri}"',
-                                html_content
-                            )
-                
-                # Store in Redis for temporary access (if using Redis)
-                if redis_client and not submission_id:
-                    # Generate a temporary ID for this preview
-                    temp_id = f"temp_preview_{int(time.time())}_{os.urandom(4).hex()}"
-                    
-                    # Store the HTML content in Redis with 30-minute expiration
-                    try:
-                        redis_client.setex(f"preview_html_{temp_id}", 1800, html_content)
-                        
-                        # Store the temp directory for cleanup
-                        redis_client.setex(f"preview_tempdir_{temp_id}", 1800, temp_dir)
-                    except Exception as e:
-                        print(f"Error storing preview in Redis: {str(e)}")
-            
-            return html_content, temp_dir, files_dict
+                # Store the HTML content in Redis with 30-minute expiration
+                try:
+                    redis_client.setex(f"preview_html_{temp_id}", 1800, html_content)
+                except Exception as e:
+                    print(f"Error storing preview in Redis: {str(e)}")
+        
+        return html_content, temp_dir, files_dict
     
     except Exception as e:
         print(f"Error extracting ZIP: {str(e)}")
-        # Clean up temp directory if it exists
-        if 'temp_dir' in locals():
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as cleanup_error:
-                print(f"Error cleaning up temp directory: {str(cleanup_error)}")
-        
         # Re-raise the exception
         raise
 
 # Function to cleanup temporary files
 def cleanup_temporary_files():
     """
-    Cleans up temporary directories for expired previews.
+    Trims the extracted ZIP store to its byte budget and cleans up temporary
+    directories left by older previews.
     This should be called periodically to free up disk space.
     """
-    if not redis_client:
-        print("Redis not available, skipping temporary file cleanup")
-        return 0
-    
     cleanup_count = 0
     try:
-        # Get all keys for temporary previews that are about to expire
-        temp_keys = redis_client.keys("preview_tempdir_*")
+        # Evict least recently used archives and downloaded blobs
+        cleanup_count += zip_store.evict()
+        cleanup_count += blob_cache.evict()
+        
+        if not redis_client:
+            return cleanup_count
+        
+        # Forget preview cache entries that have expired since they were registered
+        redis_keys.prune_registry(redis_client, redis_keys.PREVIEW_CACHE_REGISTRY)
         
-        for key in temp_keys:
-            # Check if the key is still valid (not expired)
-            if not redis_client.exists(key):
+        # Previews extracted before the shared store recorded their temp directory here
+        temp_keys = list(redis_keys.scan_keys(redis_client, "preview_tempdir_*"))
+        temp_keys += redis_keys.scan_keys(redis_client, "gallery_preview_tempdir_*")
+        
+        for key, temp_dir in zip(temp_keys, redis_client.mget(temp_keys) if temp_keys else []):
+            if not temp_dir:
                 continue
-                
-            # Get the temp directory path
-            temp_dir = redis_client.get(key).decode('utf-8')
+            temp_dir = temp_dir.decode('utf-8')
             
-            # Check if the directory exists
-            if os.path.exists(temp_dir):
+            # Check if the directory exists (never touch the shared store)
+            if os.path.exists(temp_dir) and not os.path.abspath(temp_dir).startswith(os.path.abspath(zip_store.ZIP_STORE_DIR)):
                 try:
                     # Remove the temporary directory
                     shutil.rmtree(temp_dir)
@@ -465,52 +493,311 @@ def cleanup_temporary_files():
                     cleanup_count += 1
                 except Exception as e:
                     print(f"Error cleaning up directory {temp_dir}: {str(e)}")
-            
-            # Remove the key from Redis
-            redis_client.delete(key)
-            
-        # Also clean up any extracted_zips that might be in memory but no longer needed
-        keys_to_delete = []
-        for submission_id, (temp_dir, _) in extracted_zips.items():
-            # Check if the associated Redis key exists
-            if not redis_client.exists(f"gallery_preview_{submission_id}"):
-                try:
-                    # Remove the temporary directory
-                    if os.path.exists(temp_dir):
-                        shutil.rmtree(temp_dir)
-                        print(f"Cleaned up extracted ZIP directory: {temp_dir}")
-                    keys_to_delete.append(submission_id)
-                    cleanup_count += 1
-                except Exception as e:
-                    print(f"Error cleaning up ZIP directory {temp_dir}: {str(e)}")
         
-        # Remove the cleaned up entries from the in-memory dictionary
-        for key in keys_to_delete:
-            extracted_zips.pop(key, None)
+        # Remove the keys from Redis
+        redis_keys.unlink_keys(redis_client, temp_keys)
             
         return cleanup_count
             
     except Exception as e:
         print(f"Error during temporary file cleanup: {str(e)}")
-        return 0
+        return cleanup_count
+
+# Preview HTML cache: one Redis hash per submission and zipUrl (html, built_at).
+# Entries are served as fresh for PREVIEW_SOFT_TTL seconds, then served stale
+# while a single rebuild runs in the background, and dropped after
+# PREVIEW_HARD_TTL. Rebuilds are coalesced per worker with an in-process task
+# and across workers with a Redis lock.
+PREVIEW_CACHE_PREFIX = "gallery_preview_html"
+PREVIEW_SOFT_TTL = int(os.environ.get('PREVIEW_SOFT_TTL', 1800))  # seconds before a rebuild is triggered
+PREVIEW_HARD_TTL = int(os.environ.get('PREVIEW_HARD_TTL', 86400))  # seconds a stale entry may still be served
+PREVIEW_BUILD_LOCK_TTL = 120  # seconds before an abandoned rebuild lock expires
+PREVIEW_BUILD_WAIT = 60  # seconds to wait for another worker's rebuild
+
+# In-flight preview rebuilds in this worker, by cache key
+preview_builds = {}
+
+# Release a lock only if it still holds our token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+def preview_cache_key(submission_id, zip_url):
+    """Cache key for a submission's preview HTML, versioned by its zipUrl"""
+    version = hashlib.sha256((zip_url or "").encode('utf-8')).hexdigest()[:16]
+    return f"{PREVIEW_CACHE_PREFIX}_{submission_id}:{version}"
+
+def read_preview_cache(cache_key):
+    """
+    Returns:
+        tuple or None: (html_content, built_at) if the entry exists
+    """
+    if not redis_client:
+        return None
+    try:
+        html_content, built_at = redis_client.hmget(cache_key, "html", "built_at")
+        if html_content is None:
+            return None
+        return html_content.decode('utf-8'), float(built_at or 0)
+    except Exception as e:
+        print(f"Error retrieving from Redis cache: {str(e)}")
+        return None
+
+def write_preview_cache(cache_key, html_content):
+    if not redis_client:
+        return
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(cache_key, mapping={"html": html_content, "built_at": time.time()})
+        pipe.expire(cache_key, PREVIEW_HARD_TTL)
+        redis_keys.register_key(pipe, redis_keys.PREVIEW_CACHE_REGISTRY, cache_key, ttl=PREVIEW_HARD_TTL)
+        pipe.execute()
+    except Exception as e:
+        print(f"Error caching in Redis: {str(e)}")
+
+async def build_preview(submission_id, zip_url, cache_key):
+    """
+    Downloads and extracts a submission's ZIP and caches the preview HTML.
+    If another worker holds the rebuild lock, waits for its result instead.
+    """
+    lock_key = f"{cache_key}:lock"
+    token = os.urandom(8).hex()
+    have_lock = False
+    if redis_client:
+        try:
+            have_lock = bool(redis_client.set(lock_key, token, nx=True, ex=PREVIEW_BUILD_LOCK_TTL))
+            if not have_lock:
+                deadline = time.time() + PREVIEW_BUILD_WAIT
+                while time.time() < deadline:
+                    await asyncio.sleep(0.25)
+                    entry = read_preview_cache(cache_key)
+                    if entry and time.time() - entry[1] < PREVIEW_SOFT_TTL:
+                        return entry[0]
+                    if not redis_client.exists(lock_key):
+                        break
+                print(f"Rebuild of preview {submission_id} by another worker did not finish; building here")
+        except Exception as e:
+            print(f"Error coordinating preview rebuild: {str(e)}")
+    
+    try:
+        # Fetch the ZIP through the local blob cache (downloads at most once per node)
+        zip_path = await blob_cache.fetch(zip_url)
+        
+        # Extract the ZIP and process HTML - use the same processing as preview_content_from_zip
+        html_content, _, _ = await asyncio.to_thread(extract_zip_and_process_html, zip_path)
+        write_preview_cache(cache_key, html_content)
+        print(f"Cached HTML for submission {submission_id} in Redis")
+        return html_content
+    finally:
+        if have_lock:
+            try:
+                redis_client.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            except Exception as e:
+                print(f"Error releasing preview rebuild lock: {str(e)}")
+
+def _preview_build_done(cache_key, task):
+    if preview_builds.get(cache_key) is task:
+        preview_builds.pop(cache_key, None)
+    if not task.cancelled() and task.exception():
+        print(f"Error rebuilding preview {cache_key}: {str(task.exception())}")
+
+def start_preview_build(submission_id, zip_url, cache_key):
+    """Returns the in-flight rebuild for cache_key, starting one if none is running"""
+    task = preview_builds.get(cache_key)
+    if task is None or task.done():
+        task = asyncio.get_running_loop().create_task(build_preview(submission_id, zip_url, cache_key))
+        preview_builds[cache_key] = task
+        task.add_done_callback(lambda done: _preview_build_done(cache_key, done))
+    return task
+
+async def get_preview_html(submission_id, zip_url):
+    """
+    Returns a submission's preview HTML, serving stale entries while a
+    background rebuild runs and coalescing concurrent misses into one build.
+    """
+    cache_key = preview_cache_key(submission_id, zip_url)
+    entry = read_preview_cache(cache_key)
+    if entry:
+        html_content, built_at = entry
+        if time.time() - built_at >= PREVIEW_SOFT_TTL:
+            start_preview_build(submission_id, zip_url, cache_key)
+        return html_content
+    
+    # Shield the shared build so one client disconnecting doesn't cancel it for everyone
+    return await asyncio.shield(start_preview_build(submission_id, zip_url, cache_key))
+
+# Cache policy for gallery assets. Submission URLs can change content when the
+# ZIP is replaced, so they are revalidated by ETag
+ASSET_CACHE_CONTROL = "no-cache"
+
+def parse_byte_range(range_header, size):
+    """
+    Parses a single "bytes=start-end" Range header.
+    
+    Returns:
+        tuple or None: (start, end) inclusive, or None to serve the whole file
+    
+    Raises:
+        ValueError: If the range cannot be satisfied
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start, _, end = range_header[len("bytes="):].strip().partition("-")
+    try:
+        suffix_length = int(end) if not start else None
+        start = int(start) if start else None
+        end = int(end) if end else size - 1
+    except ValueError:
+        # Malformed ranges are ignored
+        return None
+    if suffix_length is not None:
+        # Suffix range: the last N bytes
+        if suffix_length <= 0 or size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(size - suffix_length, 0), size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+def store_file_response(req, digest, manifest, files_dir, rel_path):
+    """
+    Serves one file of a stored archive with ETag and Range support.
+    Extracted archives are served from disk; archive-mode entries are streamed
+    straight out of the ZIP.
+    """
+    content_type, _ = mimetypes.guess_type(rel_path)
+    if not content_type:
+        content_type = "application/octet-stream"
+    
+    etag = zip_store.file_etag(digest, rel_path)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": ASSET_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    
+    if manifest.get("mode") != "archive":
+        return FileResponse(
+            os.path.join(files_dir, *rel_path.split('/')),
+            media_type=content_type,
+            headers=headers
+        )
+    
+    if_none_match = req.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    
+    size = manifest["files"][rel_path]
+    byte_range = None
+    if_range = req.headers.get("if-range")
+    if not if_range or if_range.strip() == etag:
+        try:
+            byte_range = parse_byte_range(req.headers.get("range"), size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+    
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            zip_store.iter_file(digest, manifest, rel_path, start, end),
+            status_code=206,
+            media_type=content_type,
+            headers=headers
+        )
+    
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(
+        zip_store.iter_file(digest, manifest, rel_path),
+        media_type=content_type,
+        headers=headers
+    )
 
 def routes(router):
+    @router.post("/api/blob/upload-token")
+    async def create_upload_token(req: Request):
+        """
+        Issues a client token so the browser can upload one file straight to blob storage
+        """
+        try:
+            if not blob_storage.get_storage().supports_direct_upload:
+                return JSONResponse(
+                    {"error": "Direct uploads are not supported by this storage backend"},
+                    status_code=503
+                )
+            
+            data = await req.json()
+            filename = data.get("filename") or "upload.bin"
+            size = int(data.get("size") or 0)
+            content_type = data.get("contentType") or "application/octet-stream"
+            
+            if size > blob_upload.BLOB_UPLOAD_MAX_BYTES:
+                return JSONResponse(
+                    {"error": f"File must be less than {blob_upload.BLOB_UPLOAD_MAX_BYTES // (1024 * 1024)}MB"},
+                    status_code=413
+                )
+            if not blob_upload.content_type_allowed(content_type):
+                return JSONResponse(
+                    {"error": f"Uploads of type {content_type} are not allowed"},
+                    status_code=415
+                )
+            
+            pathname = blob_upload.make_pathname(filename)
+            return JSONResponse({
+                "clientToken": blob_upload.create_client_token(pathname, blob_upload.BLOB_UPLOAD_MAX_BYTES),
+                "pathname": pathname,
+                "uploadUrl": blob_upload.BLOB_API_URL,
+                "apiVersion": blob_upload.BLOB_API_VERSION,
+                "chunkSize": blob_upload.BLOB_UPLOAD_CHUNK_SIZE
+            })
+        
+        except Exception as e:
+            print(f"Error creating upload token: {str(e)}")
+            return JSONResponse(
+                {"error": str(e)},
+                status_code=HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    
     @router.post("/api/blob/upload")
     async def upload_to_blob(req: Request):
+        """
+        Fallback upload path: streams the request body to blob storage in chunks
+        """
         try:
             # Get filename from query parameter
-            filename = req.query_params.get("filename", f"unknown-{len(get_all_submissions())}.bin")
+            filename = req.query_params.get("filename") or "upload.bin"
+            content_type = req.headers.get("content-type") or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            if not blob_upload.content_type_allowed(content_type):
+                return JSONResponse(
+                    {"error": f"File type {content_type} is not allowed"},
+                    status_code=415
+                )
             
-            # Read the file content from the request body
-            file_data = await req.body()
+            content_length = req.headers.get("content-length")
+            if content_length and content_length.isdigit() and int(content_length) > blob_upload.BLOB_UPLOAD_MAX_BYTES:
+                return JSONResponse(
+                    {"error": f"File must be less than {blob_upload.BLOB_UPLOAD_MAX_BYTES // (1024 * 1024)}MB"},
+                    status_code=413
+                )
             
-            # Upload to Vercel Blob (not awaited as vercel_blob.put is synchronous)
             print(f"Uploading {filename} to blob storage...")
-            blob_result = blob_put(
-                filename, 
-                file_data, 
-                {"access": "public", "addRandomSuffix": True}
-            )
+            try:
+                blob_result = await blob_storage.get_storage().put_stream(
+                    blob_upload.make_pathname(filename),
+                    req.stream(),
+                    content_type
+                )
+            except blob_upload.BlobUploadError as e:
+                print(f"Error uploading to blob: {str(e)}")
+                return JSONResponse(
+                    {"error": str(e)},
+                    status_code=502
+                )
             print(f"Upload complete: {blob_result.get('url', 'No URL returned')}")
             
             # Return the blob information
@@ -523,6 +810,33 @@ def routes(router):
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @router.get("/api/blob/local/{pathname:path}")
+    async def get_local_blob(req: Request):
+        """
+        Serves blobs stored with the local storage backend
+        """
+        storage = blob_storage.get_storage()
+        path = storage.local_path(req.url.path)
+        if path is None:
+            return JSONResponse(
+                {"error": "Blob not found"},
+                status_code=404
+            )
+        
+        # Served from the app's own origin: only the type checked at upload is
+        # used, never sniffed, and anything but ZIPs and raster images is a download
+        content_type = storage.content_type(path)
+        headers = {
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "X-Content-Type-Options": "nosniff",
+            "Content-Security-Policy": "sandbox"
+        }
+        if req.query_params.get("download") or not blob_storage.serve_inline(content_type):
+            headers["Content-Disposition"] = f'attachment; filename="{os.path.basename(path)}"'
+        if not blob_storage.serve_inline(content_type):
+            content_type = "application/octet-stream"
+        return FileResponse(path, headers=headers, media_type=content_type)
+    
     @router.post("/api/gallery/save-metadata")
     async def save_gallery_metadata(req: Request):
         try:
@@ -539,8 +853,8 @@ def routes(router):
             if metadata.get('description'):
                 print(f"Description: {metadata['description'][:100]}{'...' if len(metadata['description']) > 100 else ''}")
             
-            # Run cleanup of temporary files
-            cleanup_count = cleanup_temporary_files()
+            # Run cleanup of temporary files off the event loop
+            cleanup_count = await asyncio.to_thread(cleanup_temporary_files)
             if cleanup_count > 0:
                 print(f"Cleaned up {cleanup_count} temporary files after submission")
             
@@ -561,22 +875,25 @@ def routes(router):
     @router.get("/api/gallery/submissions/{gallery_type}")
     async def get_gallery_submissions(req: Request):
         try:
-            # Run cleanup to remove invalid submissions every time gallery is accessed
-            start_time = time.time()
-            cleaned, total = cleanup_invalid_submissions()
-            cleanup_time = time.time() - start_time
-            print(f"Cleanup took {cleanup_time:.2f} seconds. Removed {cleaned}/{total} invalid submissions.")
+            # Links are revalidated in the background; here we only read the index
+            ensure_link_health_checker()
+            health = get_link_health()
             
-            # Get submissions for the requested gallery type
+            # Get submissions for the requested gallery type, hiding ones with broken links
+            # (submissions not checked yet are shown)
             gallery_type = req.path_params.get("gallery_type")
             filtered_submissions = get_submissions_by_gallery_type(gallery_type)
+            visible_submissions = [
+                s for s in filtered_submissions
+                if health.get(str(s.get('id')), {}).get('status') != 'broken'
+            ]
             
             return JSONResponse({
-                "submissions": filtered_submissions,
+                "submissions": visible_submissions,
                 "data_integrity": {
-                    "total_checked": total,
-                    "cleaned_count": cleaned,
-                    "cleanup_time_seconds": round(cleanup_time, 2)
+                    "total_checked": len(health),
+                    "broken_hidden": len(filtered_submissions) - len(visible_submissions),
+                    "last_checked": max((entry.get('checked_at', 0) for entry in health.values()), default=None)
                 }
             })
         except Exception as e:
@@ -605,16 +922,8 @@ def routes(router):
                     status_code=404
                 )
             
-            # Validate the submission's URLs
-            if not validate_submission(submission):
-                # If using Redis, remove the invalid submission
-                if redis_client:
-                    try:
-                        redis_client.hdel("submission", submission_id)
-                        print(f"Removed invalid submission with ID {submission_id} during preview")
-                    except Exception as e:
-                        print(f"Error removing invalid submission: {str(e)}")
-                
+            # Check the link health index for the submission's URLs
+            if is_submission_broken(submission_id):
                 return JSONResponse(
                     {"error": "Submission resources are no longer available"},
                     status_code=404
@@ -622,41 +931,15 @@ def routes(router):
             
             zip_url = submission.get('zipUrl')
             
-            # Check if the zip has already been processed and cached in Redis
-            cache_key = f"gallery_preview_html_{submission_id}"
-            if redis_client:
-                try:
-                    cached_html = redis_client.get(cache_key)
-                    if cached_html:
-                        print(f"Using cached HTML for submission {submission_id}")
-                        # Create response with security headers
-                        response = HTMLResponse(cached_html)
-                        # Add security headers to allow proper iframe communication
-                        response.headers["Content-Security-Policy"] = "frame-ancestors 'self'; default-src 'self' 'unsafe-inline' 'unsafe-eval' data: blob:;"
-                        response.headers["X-Frame-Options"] = "SAMEORIGIN"
-                        return response
-                except Exception as e:
-                    print(f"Error retrieving from Redis cache: {str(e)}")
-            
-            # Download the ZIP file if not already extracted
-            print(f"Downloading ZIP from {zip_url}")
-            response = urllib.request.urlopen(zip_url)
-            zip_data = response.read()
-                
-            # Extract the ZIP and process HTML - use the same processing as preview_content_from_zip
-            html_content, temp_dir, files_dict = extract_zip_and_process_html(zip_data)
-            
-            # Store HTML in Redis cache for future requests (with 30 minute TTL)
-            if redis_client:
-                try:
-                    redis_client.setex(cache_key, 1800, html_content)
-                    
-                    # Also store temp directory path for cleanup
-                    redis_client.setex(f"gallery_preview_tempdir_{submission_id}", 1800, temp_dir)
-                    
-                    print(f"Cached HTML for submission {submission_id} in Redis (30 min TTL)")
-                except Exception as e:
-                    print(f"Error caching in Redis: {str(e)}")
+            # Serve from the preview cache, rebuilding at most once per submission
+            try:
+                html_content = await get_preview_html(submission_id, zip_url)
+            except blob_cache.BlobFetchError as e:
+                print(f"Error downloading ZIP: {str(e)}")
+                return JSONResponse(
+                    {"error": str(e)},
+                    status_code=502
+                )
             
             # Return the processed HTML content with security headers
             response = HTMLResponse(html_content)
@@ -685,92 +968,43 @@ def routes(router):
             
             print(f"Asset request: {asset_path} for submission {submission_id}")
             
-            # Check if the ZIP has been extracted
-            if submission_id not in extracted_zips:
+            # Find the submission's archive in the shared extraction store
+            entry = None
+            digest = zip_store.get_ref(submission_id)
+            if digest:
+                entry = zip_store.lookup(digest)
+            
+            # Evicted, or never extracted on this host: extract it again from the submission's ZIP
+            if entry is None:
+                submission = get_submission(submission_id)
+                zip_url = submission.get('zipUrl') if submission else None
+                if not zip_url:
+                    return JSONResponse(
+                        {"error": "Submission not found or not extracted"},
+                        status_code=404
+                    )
+                try:
+                    zip_path = await blob_cache.fetch(zip_url)
+                except blob_cache.BlobFetchError as e:
+                    print(f"Error downloading ZIP: {str(e)}")
+                    return JSONResponse(
+                        {"error": str(e)},
+                        status_code=502
+                    )
+                digest, files_dir, manifest = await asyncio.to_thread(zip_store.publish, zip_path)
+                zip_store.set_ref(submission_id, digest)
+                entry = (files_dir, manifest)
+            
+            files_dir, manifest = entry
+            match = zip_store.resolve(manifest, asset_path)
+            if match is None:
+                print(f"Asset not found: {asset_path} in archive {digest}")
                 return JSONResponse(
-                    {"error": "Submission not found or not extracted"},
+                    {"error": f"Asset {asset_path} not found"},
                     status_code=404
                 )
             
-            temp_dir, files_dict = extracted_zips[submission_id]
-            
-            # Debug: Print all keys in files_dict for troubleshooting
-            print(f"All files in dictionary: {list(files_dict.keys())}")
-            
-            # Try all possible path variations to find the file
-            possible_paths = [
-                asset_path,
-                asset_path.replace('/', os.path.sep),
-                asset_path.replace(os.path.sep, '/'),
-                os.path.basename(asset_path)
-            ]
-            
-            # Debug each path attempt
-            for path in possible_paths:
-                print(f"Trying path: {path}")
-                
-                # Try direct match
-                if path in files_dict:
-                    asset_file_path = files_dict[path]
-                    print(f"Direct match found: {path} -> {asset_file_path}")
-                    
-                    # Determine content type
-                    content_type, _ = mimetypes.guess_type(asset_file_path)
-                    if not content_type:
-                        content_type = "application/octet-stream"
-                    
-                    print(f"Serving asset: {asset_file_path} as {content_type}")
-                    return FileResponse(
-                        asset_file_path,
-                        media_type=content_type
-                    )
-                
-                # Try case-insensitive match
-                lower_path = path.lower()
-                for dict_path, file_path in files_dict.items():
-                    if dict_path.lower() == lower_path:
-                        print(f"Case-insensitive match found: {dict_path} -> {file_path}")
-                        content_type, _ = mimetypes.guess_type(file_path)
-                        if not content_type:
-                            content_type = "application/octet-stream"
-                        return FileResponse(
-                            file_path,
-                            media_type=content_type
-                        )
-            
-            # If the above fails, try a more direct approach - look in the temp directory
-            file_path_in_temp = os.path.join(temp_dir, asset_path.replace('/', os.path.sep))
-            if os.path.isfile(file_path_in_temp):
-                print(f"Found file directly in temp dir: {file_path_in_temp}")
-                content_type, _ = mimetypes.guess_type(file_path_in_temp)
-                if not content_type:
-                    content_type = "application/octet-stream"
-                return FileResponse(
-                    file_path_in_temp,
-                    media_type=content_type
-                )
-            
-            # Try to find just by basename in temp_dir (recursive search)
-            filename = os.path.basename(asset_path)
-            for root, _, files in os.walk(temp_dir):
-                if filename in files:
-                    file_path = os.path.join(root, filename)
-                    print(f"Found file by basename search: {file_path}")
-                    content_type, _ = mimetypes.guess_type(file_path)
-                    if not content_type:
-                        content_type = "application/octet-stream"
-                    return FileResponse(
-                        file_path,
-                        media_type=content_type
-                    )
-            
-            # Asset not found
-            print(f"Asset not found: {asset_path}")
-            print(f"Temp directory: {temp_dir}")
-            return JSONResponse(
-                {"error": f"Asset {asset_path} not found"},
-                status_code=404
-            )
+            return store_file_response(req, digest, manifest, files_dir, match)
             
         except Exception as e:
             print(f"Error serving asset: {str(e)}")
@@ -778,7 +1012,7 @@ def routes(router):
                 {"error": str(e)},
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR
             )
-            
+    
     @router.post("/api/html5/preview-content-from-zip")
     async def preview_content_from_zip(req: Request):
         try:
@@ -815,20 +1049,19 @@ def routes(router):
     @router.get("/api/gallery/validate-data")
     async def validate_gallery_data(req: Request):
         """
-        Endpoint to manually run validation and cleanup of Redis records.
+        Endpoint to manually run a link health check of Redis records.
         """
         try:
-            start_time = time.time()
-            cleaned, total = cleanup_invalid_submissions()
-            elapsed_time = time.time() - start_time
+            result = await run_link_health_check()
             
             return JSONResponse({
                 "success": True,
-                "message": f"Validation completed in {elapsed_time:.2f} seconds",
+                "message": f"Validation completed in {result['time_seconds']:.2f} seconds",
                 "data": {
-                    "total_records": total,
-                    "invalid_records_removed": cleaned,
-                    "time_seconds": round(elapsed_time, 2)
+                    "total_records": result["checked"],
+                    "broken_records": result["broken"],
+                    "invalid_records_removed": result["removed"],
+                    "time_seconds": result["time_seconds"]
                 }
             })
             
@@ -872,21 +1105,17 @@ def routes(router):
                     "error": "Redis not available"
                 }, status_code=500)
                 
-            # Get all preview cache keys
-            preview_keys = redis_client.keys("gallery_preview_html_*")
+            # Delete the registered preview cache keys, then sweep for entries
+            # written before the registry existed
+            deleted_count = redis_keys.unlink_registered(redis_client, redis_keys.PREVIEW_CACHE_REGISTRY)
+            deleted_count += redis_keys.unlink_matching(redis_client, f"{PREVIEW_CACHE_PREFIX}_*")
             
-            if not preview_keys:
+            if not deleted_count:
                 return JSONResponse({
                     "success": True,
                     "message": "No preview caches found"
                 })
             
-            # Delete all preview cache keys
-            deleted_count = 0
-            for key in preview_keys:
-                redis_client.delete(key)
-                deleted_count += 1
-            
             return JSONResponse({
                 "success": True,
                 "message": f"Cleared {deleted_count} preview caches"
@@ -1017,6 +1246,7 @@ def routes(router):
             
             # Store the old ZIP URL for reference
             old_zip_url = submission.get('zipUrl')
+            previous_submission = dict(submission)
             
             # Update the ZIP URL
             submission['zipUrl'] = new_zip_url
@@ -1035,7 +1265,12 @@ def routes(router):
             # Update the submission in storage
             if redis_client:
                 try:
-                    redis_client.hset("submission", submission_id, json.dumps(submission))
+                    pipe = redis_client.pipeline()
+                    pipe.hset("submission", submission_id, json.dumps(submission))
+                    redis_store.index_submission(pipe, submission_id, submission, previous=previous_submission)
+                    # The new ZIP hasn't failed a check; the next pass revalidates it
+                    pipe.hdel(LINK_HEALTH_KEY, str(submission_id))
+                    pipe.execute()
                 except Exception as e:
                     print(f"Error updating submission in Redis: {str(e)}")
                     return JSONResponse(
@@ -1050,6 +1285,7 @@ def routes(router):
                         if str(s.get('id')) == str(submission_id):
                             submissions_memory[i] = submission
                             break
+                    link_health_memory.pop(str(submission_id), None)
                 except Exception as e:
                     print(f"Error updating submission in memory: {str(e)}")
                     return JSONResponse(
@@ -1057,23 +1293,14 @@ def routes(router):
                         status_code=HTTP_500_INTERNAL_SERVER_ERROR
                     )
             
+            # Point asset requests away from the old archive; the store evicts it once unused
+            zip_store.clear_ref(submission_id)
+            
             # Clear the HTML cache for this submission if it exists
             if redis_client:
                 try:
-                    cache_key = f"gallery_preview_html_{submission_id}"
-                    if redis_client.exists(cache_key):
-                        redis_client.delete(cache_key)
+                    if redis_client.delete(preview_cache_key(submission_id, old_zip_url)):
                         print(f"Cleared HTML cache for submission {submission_id}")
-                        
-                    # Also clear extracted ZIP if present
-                    if submission_id in extracted_zips:
-                        temp_dir, _ = extracted_zips.pop(submission_id)
-                        if os.path.exists(temp_dir):
-                            try:
-                                shutil.rmtree(temp_dir)
-                                print(f"Removed extracted ZIP for submission {submission_id}")
-                            except Exception as cleanup_error:
-                                print(f"Error removing extracted ZIP: {str(cleanup_error)}")
                 except Exception as e:
                     print(f"Error clearing cache: {str(e)}")
             
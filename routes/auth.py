@@ -4,6 +4,7 @@ from ptt_bascode.authentication import check_password
 from starlette.responses import RedirectResponse, JSONResponse
 import redis
 import os
+import redis_keys
 
 # Redis connection for cache clearing
 redis_client = None
@@ -22,18 +23,12 @@ def clear_preview_cache():
         return 0
     
     try:
-        # Get all preview cache keys
-        preview_keys = redis_client.keys("gallery_preview_html_*")
+        # Delete the keys the preview cache registered when writing them (no keyspace scan)
+        deleted_count = redis_keys.unlink_registered(redis_client, redis_keys.PREVIEW_CACHE_REGISTRY)
         
-        if not preview_keys:
+        if not deleted_count:
             return 0
         
-        # Delete all preview cache keys
-        deleted_count = 0
-        for key in preview_keys:
-            redis_client.delete(key)
-            deleted_count += 1
-        
         print(f"Logout: Cleared {deleted_count} preview caches")
         return deleted_count
     except Exception as e:
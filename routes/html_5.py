@@ -3,8 +3,12 @@ import re
 import base64
 import datetime
 import json
+import asyncio
+import hashlib
+import time
+import cachetools
 from fasthtml.common import *
-from starlette.responses import RedirectResponse, JSONResponse
+from starlette.responses import RedirectResponse, JSONResponse, StreamingResponse
 from starlette.middleware.sessions import SessionMiddleware
 
 from pathlib import Path
@@ -17,6 +21,8 @@ import yaml  # Add import for yaml config
 
 # Import token tracking functionality
 import token_count
+import redis_store
+import llm_clients
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -27,10 +33,16 @@ try:
         config = yaml.safe_load(file)
     SETTINGS = config.get('settings', {})
     EXTENDED_THINKING_MODE = SETTINGS.get('extended_thinking_mode', False)
+    MAX_PROMPT_TOKENS = SETTINGS.get('max_prompt_tokens', 180000)
+    GENERATION_CACHE_TTL = SETTINGS.get('generation_cache_ttl', 7 * 24 * 3600)
+    GENERATION_CACHE_MAX_BYTES = SETTINGS.get('generation_cache_max_bytes', 64 * 1024 * 1024)
     print(f"Loaded settings from config.yaml. Extended thinking mode: {EXTENDED_THINKING_MODE}")
 except Exception as e:
     print(f"Error loading config.yaml: {e}. Using default settings.")
     EXTENDED_THINKING_MODE = False
+    MAX_PROMPT_TOKENS = 180000
+    GENERATION_CACHE_TTL = 7 * 24 * 3600
+    GENERATION_CACHE_MAX_BYTES = 64 * 1024 * 1024
     SETTINGS = {}
 
 # Global history backup storage
@@ -145,19 +157,12 @@ def get_all_drafts(user_id):
     
     if redis_client:
         try:
-            # Get all drafts for this user
-            user_drafts_key = f"html5_drafts:{user_id}"
-            draft_ids = redis_client.hkeys(user_drafts_key)
-            
-            for draft_id in draft_ids:
-                draft_id_str = draft_id.decode('utf-8') if isinstance(draft_id, bytes) else draft_id
-                draft_data_str = redis_client.hget(user_drafts_key, draft_id)
-                if draft_data_str:
-                    draft_data = json.loads(draft_data_str)
-                    drafts.append({
-                        "id": draft_id_str,
-                        "timestamp": draft_data.get("timestamp", "Unknown")
-                    })
+            # Get all drafts for this user in one bulk read
+            for draft_data in redis_store.load_drafts(redis_client, user_id):
+                drafts.append({
+                    "id": draft_data["id"],
+                    "timestamp": draft_data.get("timestamp", "Unknown")
+                })
             
             # Sort drafts by timestamp (newest first)
             drafts.sort(key=lambda x: x["timestamp"], reverse=True)
@@ -306,6 +311,214 @@ def delete_all_drafts(user_id):
             return True
         return False
 
+
+# Generation cache for identical HTML5 prompts
+# Redis layout: html5_gen_cache:{key} holds the JSON result (with TTL),
+# html5_gen_cache:lru is a sorted set of keys scored by last access time,
+# html5_gen_cache:sizes maps keys to their size in bytes and
+# html5_gen_cache:stats holds the hit/miss counters and the running total of
+# bytes, so writes only evict when the total is over the cap
+GENERATION_CACHE_PREFIX = "html5_gen_cache"
+
+# Stores an entry and adjusts the running total by the change in its size.
+# KEYS: entry, lru, sizes, stats; ARGV: cache key, ttl, data, access time.
+# Returns the new total.
+GENERATION_CACHE_PUT_SCRIPT = """
+local previous = tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or '0')
+redis.call('SETEX', KEYS[1], ARGV[2], ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+redis.call('HSET', KEYS[3], ARGV[1], string.len(ARGV[3]))
+return redis.call('HINCRBY', KEYS[4], 'bytes', string.len(ARGV[3]) - previous)
+"""
+
+# Drops index entries last used before the expiry cutoff, then the least
+# recently used entries until the total is under the cap, touching only the
+# entries it removes. KEYS: lru, sizes, stats; ARGV: entry key prefix, max
+# bytes, expiry cutoff. Returns the number of entries removed.
+GENERATION_CACHE_EVICT_SCRIPT = """
+local removed = 0
+local function remove(key)
+    local size = tonumber(redis.call('HGET', KEYS[2], key) or '0')
+    redis.call('DEL', ARGV[1] .. ':' .. key)
+    redis.call('ZREM', KEYS[1], key)
+    redis.call('HDEL', KEYS[2], key)
+    removed = removed + 1
+    return redis.call('HINCRBY', KEYS[3], 'bytes', -size)
+end
+local total = tonumber(redis.call('HGET', KEYS[3], 'bytes') or '0')
+for _, key in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])) do
+    total = remove(key)
+end
+local max_bytes = tonumber(ARGV[2])
+while total > max_bytes do
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 99)
+    if #oldest == 0 then
+        -- Nothing left to evict: the total has drifted, reset it
+        redis.call('HSET', KEYS[3], 'bytes', 0)
+        break
+    end
+    for _, key in ipairs(oldest) do
+        total = remove(key)
+        if total <= max_bytes then
+            break
+        end
+    end
+end
+return removed
+"""
+
+# Scripts are registered with the client on first use
+GENERATION_CACHE_SCRIPTS = {}
+
+# In-memory fallback when Redis is not available (LRU with TTL, capped by size)
+GENERATION_CACHE_MEMORY = cachetools.TTLCache(maxsize=GENERATION_CACHE_MAX_BYTES, ttl=GENERATION_CACHE_TTL, getsizeof=len)
+GENERATION_CACHE_STATS = {"hits": 0, "misses": 0}
+
+def normalize_image_bytes(image_data):
+    """Decode base64 image data (with or without data URL prefix) to raw bytes for hashing"""
+    if image_data.startswith('data:'):
+        image_data = image_data.split(',', 1)[-1]
+    padding_needed = len(image_data) % 4
+    if padding_needed:
+        image_data += '=' * (4 - padding_needed)
+    try:
+        return base64.b64decode(image_data)
+    except Exception:
+        return image_data.encode('utf-8')
+
+def generation_cache_key(model, prompt, images, is_iterative, current_html, current_css, current_js):
+    """
+    Build a content-addressed cache key for a generation request
+    
+    Returns:
+        str: SHA-256 hex digest of the model, system prompt, user prompt, reference images,
+            iterative flag and current code
+    """
+    system_prompt = build_system_prompt(is_iterative, current_html, current_css, current_js)
+    digest = hashlib.sha256()
+    for part in (model, system_prompt, prompt, "iterative" if is_iterative else "new", current_html, current_css, current_js):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    
+    # Hash the decoded image bytes so data URL prefixes and padding don't matter
+    for image_data in images:
+        if image_data and len(image_data) > 100:
+            digest.update(hashlib.sha256(normalize_image_bytes(image_data)).digest())
+    
+    return digest.hexdigest()
+
+def generation_cache_script(source):
+    """The registered Redis script for a generation cache script source"""
+    script = GENERATION_CACHE_SCRIPTS.get(source)
+    if script is None:
+        script = GENERATION_CACHE_SCRIPTS[source] = redis_client.register_script(source)
+    return script
+
+def get_cached_generation(cache_key):
+    """
+    Look up a cached generation and update the hit/miss counters
+    
+    Returns:
+        dict: Cached html, css and js, or None on a miss
+    """
+    if redis_client:
+        try:
+            cached = redis_client.get(f"{GENERATION_CACHE_PREFIX}:{cache_key}")
+            
+            pipe = redis_client.pipeline()
+            if cached:
+                # Refresh the key's position in the LRU order and its TTL, so entries
+                # the index still lists don't expire while they are in use
+                pipe.zadd(f"{GENERATION_CACHE_PREFIX}:lru", {cache_key: time.time()})
+                pipe.expire(f"{GENERATION_CACHE_PREFIX}:{cache_key}", GENERATION_CACHE_TTL)
+            pipe.hincrby(f"{GENERATION_CACHE_PREFIX}:stats", "hits" if cached else "misses", 1)
+            pipe.execute()
+            
+            return json.loads(cached) if cached else None
+        except Exception as e:
+            print(f"Error reading generation cache from Redis: {str(e)}. Falling back to memory.")
+    
+    cached = GENERATION_CACHE_MEMORY.get(cache_key)
+    GENERATION_CACHE_STATS["hits" if cached else "misses"] += 1
+    return json.loads(cached) if cached else None
+
+def cache_generation(cache_key, html, css, js):
+    """Store a generation result in the cache, evicting least recently used entries over the size cap"""
+    data = json.dumps({"html": html, "css": css, "js": js})
+    
+    if redis_client:
+        try:
+            total_bytes = generation_cache_script(GENERATION_CACHE_PUT_SCRIPT)(
+                keys=[f"{GENERATION_CACHE_PREFIX}:{cache_key}", f"{GENERATION_CACHE_PREFIX}:lru",
+                      f"{GENERATION_CACHE_PREFIX}:sizes", f"{GENERATION_CACHE_PREFIX}:stats"],
+                args=[cache_key, GENERATION_CACHE_TTL, data, time.time()]
+            )
+            
+            if int(total_bytes) > GENERATION_CACHE_MAX_BYTES:
+                evict_generation_cache()
+            return
+        except Exception as e:
+            print(f"Error writing generation cache to Redis: {str(e)}. Falling back to memory.")
+    
+    try:
+        GENERATION_CACHE_MEMORY[cache_key] = data
+    except ValueError:
+        # Larger than the whole cache
+        print(f"Generation result too large to cache: {len(data)} bytes")
+
+def evict_generation_cache():
+    """Drop expired entries from the Redis cache index, then evict LRU entries until under the size cap"""
+    evicted = generation_cache_script(GENERATION_CACHE_EVICT_SCRIPT)(
+        keys=[f"{GENERATION_CACHE_PREFIX}:lru", f"{GENERATION_CACHE_PREFIX}:sizes", f"{GENERATION_CACHE_PREFIX}:stats"],
+        # Entries not accessed within the TTL have already expired in Redis
+        args=[GENERATION_CACHE_PREFIX, GENERATION_CACHE_MAX_BYTES, time.time() - GENERATION_CACHE_TTL]
+    )
+    if evicted:
+        print(f"Evicted {evicted} generation cache entries to stay under {GENERATION_CACHE_MAX_BYTES} bytes")
+
+def get_generation_cache_stats():
+    """
+    Get generation cache counters
+    
+    Returns:
+        dict: hits, misses, entries and bytes
+    """
+    if redis_client:
+        try:
+            pipe = redis_client.pipeline()
+            pipe.hgetall(f"{GENERATION_CACHE_PREFIX}:stats")
+            pipe.hlen(f"{GENERATION_CACHE_PREFIX}:sizes")
+            stats, entries = pipe.execute()
+            return {
+                "hits": int(stats.get(b"hits", 0)),
+                "misses": int(stats.get(b"misses", 0)),
+                "entries": entries,
+                "bytes": int(stats.get(b"bytes", 0))
+            }
+        except Exception as e:
+            print(f"Error reading generation cache stats from Redis: {str(e)}. Falling back to memory.")
+    
+    return {
+        "hits": GENERATION_CACHE_STATS["hits"],
+        "misses": GENERATION_CACHE_STATS["misses"],
+        "entries": len(GENERATION_CACHE_MEMORY),
+        "bytes": GENERATION_CACHE_MEMORY.currsize
+    }
+
+def record_cache_hit(model, prompt, user_id, session_id, start_time):
+    """Record a generation served from the cache as a zero-token usage row"""
+    generation_time_ms = (datetime.datetime.now() - start_time).total_seconds() * 1000
+    token_count.record_token_usage(
+        model=model,
+        prompt=prompt if prompt else None,
+        prompt_tokens=0,
+        completion_tokens=0,
+        total_tokens=0,
+        user_id=user_id,
+        session_id=session_id,
+        generation_time_ms=generation_time_ms
+    )
+
 #try and load the environment variables
 if os.getenv("OPENAI_API_KEY") is None:
     os.environ["OPENAI_API_KEY"] = ""
@@ -318,8 +531,158 @@ else:
     os.environ["ANTHROPIC_API_KEY"] = os.getenv("ANTHROPIC_API_KEY")
 
 
+# Tool definition shared by every provider: the model returns the three code
+# components as structured arguments to extract_code_components
+CODE_COMPONENTS_DESCRIPTION = "Extract HTML, CSS, and JavaScript components from the generated code. All three components MUST be included for a complete interactive HTML5 experience."
+CODE_COMPONENTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "html": {
+            "type": "string",
+            "description": "HTML content without the body tags"
+        },
+        "css": {
+            "type": "string",
+            "description": "CSS content without the style tags"
+        },
+        "javascript": {
+            "type": "string",
+            "description": "JavaScript content without the script tags. This is REQUIRED for interactive content."
+        }
+    },
+    "required": ["html", "css", "javascript"]
+}
+
 
+# Map extract_code_components argument names to editor names
+COMPONENT_FIELDS = {"html": "html", "css": "css", "javascript": "js"}
+JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+REPLACEMENT_CHARACTER = "\ufffd"
 
+def parse_hex4(text):
+    """The value of a \\u escape's four hex digits, or None if they aren't valid"""
+    if len(text) != 4 or not HEX_DIGITS.issuperset(text):
+        return None
+    return int(text, 16)
+
+class ComponentStreamParser:
+    """
+    Incrementally decodes the streamed JSON arguments of extract_code_components.
+    
+    Providers stream tool input as raw JSON fragments ({"html": "<div>...), so the
+    string values are decoded as they arrive instead of waiting for valid JSON.
+    Each character is visited once, so a 16k-token response stays O(n).
+    """
+    def __init__(self):
+        self._parts = {"html": [], "css": [], "js": []}
+        self._state = "start"
+        self._pending = ""
+        self._key = []
+        self._field = None
+    
+    def feed(self, fragment):
+        """
+        Consume a JSON fragment
+        
+        Args:
+            fragment (str): The next piece of the streamed tool arguments
+            
+        Returns:
+            dict: Newly decoded text per editor ("html", "css", "js"); empty if none
+        """
+        buffer = self._pending + fragment
+        self._pending = ""
+        deltas = {}
+        i = 0
+        n = len(buffer)
+        while i < n and self._state != "done":
+            c = buffer[i]
+            if self._state in ("key", "value"):
+                # Copy plain runs in one slice, stopping at a quote or escape
+                j = i
+                while j < n and buffer[j] not in '"\\':
+                    j += 1
+                if j > i:
+                    self._append(buffer[i:j], deltas)
+                    i = j
+                    continue
+                if c == '"':
+                    self._state = "expect_colon" if self._state == "key" else "expect_key"
+                    i += 1
+                    continue
+                # Escape sequence - wait for more input if it is incomplete
+                if i + 1 >= n:
+                    self._pending = buffer[i:]
+                    break
+                escape = buffer[i + 1]
+                if escape == 'u':
+                    if i + 6 > n:
+                        self._pending = buffer[i:]
+                        break
+                    code = parse_hex4(buffer[i + 2:i + 6])
+                    if code is None:
+                        # Malformed escape: replace the \\u and decode what follows as text
+                        self._append(REPLACEMENT_CHARACTER, deltas)
+                        i += 2
+                    elif 0xD800 <= code < 0xDC00:
+                        # Surrogate pair: need the low half as well
+                        if i + 8 > n or (buffer[i + 6:i + 8] == '\\u' and i + 12 > n):
+                            self._pending = buffer[i:]
+                            break
+                        low = parse_hex4(buffer[i + 8:i + 12]) if buffer[i + 6:i + 8] == '\\u' else None
+                        if low is not None and 0xDC00 <= low < 0xE000:
+                            self._append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)), deltas)
+                            i += 12
+                        else:
+                            # Lone high surrogate; whatever follows is decoded on its own
+                            self._append(REPLACEMENT_CHARACTER, deltas)
+                            i += 6
+                    else:
+                        # A lone low surrogate can't be encoded either
+                        self._append(REPLACEMENT_CHARACTER if 0xDC00 <= code < 0xE000 else chr(code), deltas)
+                        i += 6
+                else:
+                    self._append(JSON_ESCAPES.get(escape, escape), deltas)
+                    i += 2
+                continue
+            
+            if c in ' \t\r\n':
+                i += 1
+                continue
+            if self._state == "start":
+                if c == '{':
+                    self._state = "expect_key"
+            elif self._state == "expect_key":
+                if c == '"':
+                    self._key = []
+                    self._state = "key"
+                elif c == '}':
+                    self._state = "done"
+                elif c != ',':
+                    self._state = "done"
+            elif self._state == "expect_colon":
+                self._state = "expect_value" if c == ':' else "done"
+            elif self._state == "expect_value":
+                if c == '"':
+                    self._field = COMPONENT_FIELDS.get("".join(self._key))
+                    self._state = "value"
+                else:
+                    # Only string arguments are expected
+                    self._state = "done"
+            i += 1
+        return deltas
+    
+    def values(self):
+        """Return the text decoded so far for each editor"""
+        return {field: "".join(parts) for field, parts in self._parts.items()}
+    
+    def _append(self, text, deltas):
+        if self._state == "key":
+            self._key.append(text)
+        elif self._field:
+            self._parts[self._field].append(text)
+            deltas[self._field] = deltas.get(self._field, "") + text
 
 
 def extract_components(code):
@@ -689,6 +1052,219 @@ def process_image_for_openai(base64_data):
 
 
 
+def render_generated_code(html, css, js, banner=None):
+    """
+    Build the response shown after a generation or refinement: the code editors,
+    the Create ZIP button and a data-URL preview iframe
+    
+    Args:
+        html (str): HTML content
+        css (str): CSS content
+        js (str): JavaScript content
+        banner (FT, optional): Status banner shown above the editors
+        
+    Returns:
+        list: FastHTML components for the code editors container
+    """
+    # Create preview content
+    preview_content = f"""<!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <style>
+        /* Reset some basic elements */
+        body {{
+            margin: 0;
+            padding: 0;
+            font-family: Arial, sans-serif;
+            min-height: 100vh;
+        }}
+        /* Default container for content */
+        #content-container {{
+            padding: 20px;
+        }}
+        /* User CSS */
+        {css}
+        </style>
+    </head>
+    <body>
+        <div id="content-container">
+            {html}
+        </div>
+        <script>
+        // Initialize content and catch errors
+        try {{
+            {js}
+        }} catch (error) {{
+            console.error('Error in JavaScript execution:', error);
+            const errorDiv = document.createElement('div');
+            errorDiv.style.color = 'red';
+            errorDiv.style.padding = '10px';
+            errorDiv.innerHTML = '<strong>JavaScript Error:</strong><br>' + error.message;
+            document.body.appendChild(errorDiv);
+        }}
+        </script>
+    </body>
+    </html>"""
+    
+    # Encode the content as base64
+    encoded_content = base64.b64encode(preview_content.encode('utf-8')).decode('utf-8')
+    
+    # Return with a data URL for the iframe instead of a URL to preview-content
+    return [
+        banner,
+        create_code_editors(html, css, js),
+        NotStr(f"""
+        <script>
+            // Add a create ZIP button after generation
+            const dynamicButtonsContainer = document.getElementById('dynamic-buttons');
+            if (dynamicButtonsContainer) {{
+                // Create a ZIP button
+                const zipButton = document.createElement('button');
+                zipButton.id = 'create-zip-button';
+                zipButton.innerHTML = `
+                    <div class="flex items-center justify-center w-full">
+                        <svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" width="20" height="20" fill="currentColor">
+                            <path d="M20 6h-3V4c0-1.1-.9-2-2-2H9c-1.1 0-2 .9-2 2v2H4c-1.1 0-2 .9-2 2v11c0 1.1.9 2 2 2h16c1.1 0 2-.9 2-2V8c0-1.1-.9-2-2-2zm-5-2v2H9V4h6zM4 8h16v3H4V8zm0 11v-6h16v6H4z"/>
+                        </svg>
+                        <span class="ml-2">Create ZIP</span>
+                    </div>`;
+                zipButton.className = 'action-button bg-gradient-to-r from-indigo-600 to-indigo-500';
+                // Add explicit onclick handler to call createZipPackage function directly
+                zipButton.onclick = function(e) {{
+                    e.preventDefault();
+                    console.log("ZIP button clicked with direct onclick handler");
+                    createZipPackage();
+                    return false;
+                }};
+                dynamicButtonsContainer.appendChild(zipButton);
+            }}
+        </script>
+        """),
+        NotStr(f"""
+        <script>
+            // Add data URL to iframe src
+            window.setTimeout(function() {{
+                const iframe = document.createElement('iframe');
+                iframe.src = "data:text/html;base64,{encoded_content}";
+                iframe.style.width = '100%';
+                iframe.style.height = '100%';
+                iframe.style.border = 'none';
+                
+                const container = document.getElementById('preview-container');
+                if (container) {{
+                    container.innerHTML = '';
+                    container.appendChild(iframe);
+                }}
+            }}, 300);
+        </script>
+        """)
+    ]
+
+
+async def collect_generation_inputs(req):
+    """
+    Read the generation form and resolve the current code state for a new generation.
+    Deletes the user's drafts and rotates the current state to previous, as the
+    generate endpoints always have.
+    
+    Returns:
+        dict: user_id, form, prompt, model, is_iterative, images and the current html/css/js
+    """
+    # Get user ID from session for storage
+    user_id = req.session.get('auth', 'anonymous')
+    
+    # Delete all drafts when generating new code
+    delete_all_drafts(user_id)
+    print(f"Deleted all drafts for user {user_id} before new generation")
+    
+    # Clear any existing refinement history
+    if user_id in GLOBAL_CODE_STORAGE:
+        del GLOBAL_CODE_STORAGE[user_id]
+        print(f"Cleared refinement history for user {user_id} before new generation")
+    
+    # Get current state from session or global storage
+    current_html = req.session.get('html', '')
+    current_css = req.session.get('css', '')
+    current_js = req.session.get('js', '')
+    
+    if not (current_html or current_css or current_js) and user_id in GLOBAL_CODE_STORAGE and 'current' in GLOBAL_CODE_STORAGE[user_id]:
+        # Get current state from global storage if session is empty
+        current_html = GLOBAL_CODE_STORAGE[user_id]['current']['html']
+        current_css = GLOBAL_CODE_STORAGE[user_id]['current']['css']
+        current_js = GLOBAL_CODE_STORAGE[user_id]['current']['js']
+        print("Retrieved current state from global storage")
+    
+    print("\n----- GENERATION DEBUG -----")
+    print(f"Current HTML length: {len(current_html)}")
+    print(f"Current CSS length: {len(current_css)}")
+    print(f"Current JS length: {len(current_js)}")
+    
+    # Get form data for current state if session is empty
+    form = await req.form()
+    form_html = form.get('html-editor', '')
+    form_css = form.get('css-editor', '')
+    form_js = form.get('js-editor', '')
+    
+    # Use form data if session is empty or if form has content
+    if (not (current_html or current_css or current_js)) or (form_html or form_css or form_js):
+        current_html = form_html
+        current_css = form_css
+        current_js = form_js
+        print("Got current state from form data")
+        print(f"Form HTML length: {len(current_html)}")
+        print(f"Form CSS length: {len(current_css)}")
+        print(f"Form JS length: {len(current_js)}")
+    
+    # If we have valid current state, save it before generating new code
+    if current_html or current_css or current_js:
+        # Initialize storage for this user if needed
+        if user_id not in GLOBAL_CODE_STORAGE:
+            GLOBAL_CODE_STORAGE[user_id] = {}
+    
+        # Check if we have a current state to move to previous
+        if 'current' in GLOBAL_CODE_STORAGE[user_id]:
+            # Save current state as previous before updating
+            print(f"\n----- GENERATE SAVING PREVIOUS STATE -----")
+            print(f"Saving previous content for user {user_id}")
+            current = GLOBAL_CODE_STORAGE[user_id]['current']
+            GLOBAL_CODE_STORAGE[user_id]['previous'] = dict(current)
+            print("Saved current state as previous")
+    
+    # Get the prompt and model from the form
+    prompt = form.get('prompt', '')
+    model = form.get('model', 'gpt-4o')
+    is_iterative = form.get('iterative-toggle') == 'on'
+    
+    # Get reference images - modified to handle prefixed fields
+    images = []
+    # First look for generation tab images
+    for i in range(5):
+        image_data = form.get(f"gen-image-data-{i}")
+        if image_data:
+            images.append(image_data)
+    
+    # If no images found, try without prefix (backward compatibility)
+    if not images:
+        for i in range(5):
+            image_data = form.get(f"image-data-{i}")
+            if image_data:
+                images.append(image_data)
+    
+    return {
+        "user_id": user_id,
+        "form": form,
+        "prompt": prompt,
+        "model": model,
+        "is_iterative": is_iterative,
+        "images": images,
+        "current_html": current_html,
+        "current_css": current_css,
+        "current_js": current_js
+    }
+
+
 def routes(rt):
     @rt('/menuD')
     def get(req):
@@ -1271,89 +1847,21 @@ def routes(rt):
     async def post(req):
         """Generate HTML5 interactive code based on prompt and reference images"""
         try:
-            # Get user ID from session for storage
-            user_id = req.session.get('auth', 'anonymous')
-            
-            # Delete all drafts when generating new code
-            delete_all_drafts(user_id)
-            print(f"Deleted all drafts for user {user_id} before new generation")
-            
-            # Clear any existing refinement history
-            if user_id in GLOBAL_CODE_STORAGE:
-                del GLOBAL_CODE_STORAGE[user_id]
-                print(f"Cleared refinement history for user {user_id} before new generation")
-                
-            # Get current state from session or global storage
-            current_html = req.session.get('html', '')
-            current_css = req.session.get('css', '')
-            current_js = req.session.get('js', '')
-            
-            if not (current_html or current_css or current_js) and user_id in GLOBAL_CODE_STORAGE and 'current' in GLOBAL_CODE_STORAGE[user_id]:
-                # Get current state from global storage if session is empty
-                current_html = GLOBAL_CODE_STORAGE[user_id]['current']['html']
-                current_css = GLOBAL_CODE_STORAGE[user_id]['current']['css']
-                current_js = GLOBAL_CODE_STORAGE[user_id]['current']['js']
-                print("Retrieved current state from global storage")
-            
-            print("\n----- GENERATION DEBUG -----")
-            print(f"Current HTML length: {len(current_html)}")
-            print(f"Current CSS length: {len(current_css)}")
-            print(f"Current JS length: {len(current_js)}")
-            
-            # Get form data for current state if session is empty
-            form = await req.form()
-            form_html = form.get('html-editor', '')
-            form_css = form.get('css-editor', '')
-            form_js = form.get('js-editor', '')
-            
-            # Use form data if session is empty or if form has content
-            if (not (current_html or current_css or current_js)) or (form_html or form_css or form_js):
-                current_html = form_html
-                current_css = form_css
-                current_js = form_js
-                print("Got current state from form data")
-                print(f"Form HTML length: {len(current_html)}")
-                print(f"Form CSS length: {len(current_css)}")
-                print(f"Form JS length: {len(current_js)}")
-            
-            # If we have valid current state, save it before generating new code
-            if current_html or current_css or current_js:
-                # Initialize storage for this user if needed
-                if user_id not in GLOBAL_CODE_STORAGE:
-                    GLOBAL_CODE_STORAGE[user_id] = {}
-                
-                # Check if we have a current state to move to previous
-                if 'current' in GLOBAL_CODE_STORAGE[user_id]:
-                    # Save current state as previous before updating
-                    print(f"\n----- GENERATE SAVING PREVIOUS STATE -----")
-                    print(f"Saving previous content for user {user_id}")
-                    current = GLOBAL_CODE_STORAGE[user_id]['current']
-                    GLOBAL_CODE_STORAGE[user_id]['previous'] = dict(current)
-                    print("Saved current state as previous")
-            
-            # Get the prompt and model from the form
-            prompt = form.get('prompt', '')
-            model = form.get('model', 'gpt-4o')
-            is_iterative = form.get('iterative-toggle') == 'on'
-            
-            # Get reference images - modified to handle prefixed fields
-            images = []
-            # First look for generation tab images
-            for i in range(5):
-                image_data = form.get(f"gen-image-data-{i}")
-                if image_data:
-                    images.append(image_data)
-                
-            # If no images found, try without prefix (backward compatibility)
-            if not images:
-                for i in range(5):
-                    image_data = form.get(f"image-data-{i}")
-                    if image_data:
-                        images.append(image_data)
+            # Read the form and resolve the current code state
+            inputs = await collect_generation_inputs(req)
+            user_id = inputs["user_id"]
+            prompt = inputs["prompt"]
+            model = inputs["model"]
+            is_iterative = inputs["is_iterative"]
+            images = inputs["images"]
+            current_html = inputs["current_html"]
+            current_css = inputs["current_css"]
+            current_js = inputs["current_js"]
+            force_regenerate = inputs["form"].get('force-regenerate') == 'on'
             
             # Generate new code
             try:
-                html, css, js = await generate_html5_code(prompt, images, model, is_iterative, current_html, current_css, current_js, user_id=user_id, session_id=req.session.session_id if hasattr(req.session, 'session_id') else None)
+                html, css, js = await generate_html5_code_cached(prompt, images, model, is_iterative, current_html, current_css, current_js, user_id=user_id, session_id=req.session.session_id if hasattr(req.session, 'session_id') else None, force_regenerate=force_regenerate)
                 print(f"Successfully generated code - HTML: {len(html)} chars, CSS: {len(css)} chars, JS: {len(js)} chars")
                 
                 # If in iterative mode and no content was returned, return an error
@@ -1457,51 +1965,6 @@ def routes(rt):
                     cls="error alert alert-danger p-4"
                 )
 
-            # Create preview content
-            preview_content = f"""<!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="UTF-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <style>
-                /* Reset some basic elements */
-                body {{
-                    margin: 0;
-                    padding: 0;
-                    font-family: Arial, sans-serif;
-                    min-height: 100vh;
-                }}
-                /* Default container for content */
-                #content-container {{
-                    padding: 20px;
-                }}
-                /* User CSS */
-                {css}
-                </style>
-            </head>
-            <body>
-                <div id="content-container">
-                    {html}
-                </div>
-                <script>
-                // Initialize content and catch errors
-                try {{
-                    {js}
-                }} catch (error) {{
-                    console.error('Error in JavaScript execution:', error);
-                    const errorDiv = document.createElement('div');
-                    errorDiv.style.color = 'red';
-                    errorDiv.style.padding = '10px';
-                    errorDiv.innerHTML = '<strong>JavaScript Error:</strong><br>' + error.message;
-                    document.body.appendChild(errorDiv);
-                }}
-                </script>
-            </body>
-            </html>"""
-            
-            # Encode the content as base64
-            encoded_content = base64.b64encode(preview_content.encode('utf-8')).decode('utf-8')
-            
             # Create iterative banner if needed
             iterative_banner = None
             if is_iterative:
@@ -1516,56 +1979,7 @@ def routes(rt):
                         cls="bg-blue-900 text-blue-100 p-2 rounded mb-4"
                     )
             
-            # Return with a data URL for the iframe instead of a URL to preview-content
-            return [
-                iterative_banner if is_iterative else None,
-                create_code_editors(html, css, js),
-                NotStr(f"""
-                <script>
-                    // Add a create ZIP button after generation
-                    const dynamicButtonsContainer = document.getElementById('dynamic-buttons');
-                    if (dynamicButtonsContainer) {{
-                        // Create a ZIP button
-                        const zipButton = document.createElement('button');
-                        zipButton.id = 'create-zip-button';
-                        zipButton.innerHTML = `
-                            <div class="flex items-center justify-center w-full">
-                                <svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" width="20" height="20" fill="currentColor">
-                                    <path d="M20 6h-3V4c0-1.1-.9-2-2-2H9c-1.1 0-2 .9-2 2v2H4c-1.1 0-2 .9-2 2v11c0 1.1.9 2 2 2h16c1.1 0 2-.9 2-2V8c0-1.1-.9-2-2-2zm-5-2v2H9V4h6zM4 8h16v3H4V8zm0 11v-6h16v6H4z"/>
-                                </svg>
-                                <span class="ml-2">Create ZIP</span>
-                            </div>`;
-                        zipButton.className = 'action-button bg-gradient-to-r from-indigo-600 to-indigo-500';
-                        // Add explicit onclick handler to call createZipPackage function directly
-                        zipButton.onclick = function(e) {{
-                            e.preventDefault();
-                            console.log("ZIP button clicked with direct onclick handler");
-                            createZipPackage();
-                            return false;
-                        }};
-                        dynamicButtonsContainer.appendChild(zipButton);
-                    }}
-                </script>
-                """),
-                NotStr(f"""
-                <script>
-                    // Add data URL to iframe src
-                    window.setTimeout(function() {{
-                        const iframe = document.createElement('iframe');
-                        iframe.src = "data:text/html;base64,{encoded_content}";
-                        iframe.style.width = '100%';
-                        iframe.style.height = '100%';
-                        iframe.style.border = 'none';
-                        
-                        const container = document.getElementById('preview-container');
-                        if (container) {{
-                            container.innerHTML = '';
-                            container.appendChild(iframe);
-                        }}
-                    }}, 300);
-                </script>
-                """)
-            ]
+            return render_generated_code(html, css, js, banner=iterative_banner if is_iterative else None)
                 
         except Exception as e:
             print(f"Error in generate-code route: {str(e)}")
@@ -1576,6 +1990,97 @@ def routes(rt):
                 cls="error alert alert-danger p-4"
             )
             
+    @rt('/api/html5/generate-code-stream')
+    async def post(req):
+        """Stream HTML5 code generation to the code editors over Server-Sent Events"""
+        # Read the form and resolve the current code state
+        inputs = await collect_generation_inputs(req)
+        user_id = inputs["user_id"]
+        is_iterative = inputs["is_iterative"]
+        current_html = inputs["current_html"]
+        current_css = inputs["current_css"]
+        current_js = inputs["current_js"]
+        session_id = req.session.session_id if hasattr(req.session, 'session_id') else None
+        force_regenerate = inputs["form"].get('force-regenerate') == 'on'
+        
+        # The session copy of the code is stale once this generation starts: the
+        # editors' content, posted with the next request, takes precedence. Pop it
+        # here, since the session cookie is sent before the stream body
+        for key in ('html', 'css', 'js'):
+            req.session.pop(key, None)
+        
+        async def event_stream():
+            # Send empty editors straight away so the browser has somewhere to stream into
+            yield sse_event("start", {"editors": to_xml(create_code_editors())})
+            
+            try:
+                html, css, js = "", "", ""
+                start_time = datetime.datetime.now()
+                cache_key = generation_cache_key(inputs["model"], inputs["prompt"], inputs["images"], is_iterative, current_html, current_css, current_js)
+                cached = None if force_regenerate else get_cached_generation(cache_key)
+                
+                if cached:
+                    # Identical request already generated - skip straight to the result
+                    print(f"Generation cache hit {cache_key[:12]} for user {user_id}")
+                    record_cache_hit(inputs["model"], inputs["prompt"], user_id, session_id, start_time)
+                    html, css, js = cached["html"], cached["css"], cached["js"]
+                else:
+                    async for event, payload in stream_html5_code(
+                        inputs["prompt"], inputs["images"], inputs["model"], is_iterative,
+                        current_html, current_css, current_js,
+                        user_id=user_id, session_id=session_id
+                    ):
+                        if event == "delta":
+                            yield sse_event("delta", payload)
+                        else:
+                            html, css, js = payload
+                    
+                    if (html or css or js) and (html, css, js) != (current_html, current_css, current_js):
+                        cache_generation(cache_key, html, css, js)
+                
+                # If in iterative mode and no content was returned, return an error
+                if is_iterative and not (html or css or js):
+                    raise ValueError("No content was generated in iterative mode. Please try again with different instructions.")
+                
+                # Store new code as current state
+                if user_id not in GLOBAL_CODE_STORAGE:
+                    GLOBAL_CODE_STORAGE[user_id] = {}
+                GLOBAL_CODE_STORAGE[user_id]['current'] = {
+                    'html': html,
+                    'css': css,
+                    'js': js
+                }
+                
+                iterative_banner = None
+                if is_iterative:
+                    iterative_banner = Div(
+                        "Iterative Mode: Using existing code as context" if (current_html or current_css or current_js)
+                        else "Iterative Mode: No existing code found, created new content",
+                        cls="bg-blue-900 text-blue-100 p-2 rounded mb-4"
+                    )
+                
+                parts = render_generated_code(html, css, js, banner=iterative_banner)
+                yield sse_event("done", {"html": "".join(to_xml(part) for part in parts if part is not None)})
+            except Exception as e:
+                print(f"Error in generate-code-stream route: {str(e)}")
+                # The editors were cleared for streaming, so send the user's code back with the error
+                parts = render_generated_code(current_html, current_css, current_js)
+                yield sse_event("error", {
+                    "message": str(e),
+                    "html": "".join(to_xml(part) for part in parts if part is not None)
+                })
+        
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    @rt('/api/html5/generation-cache-stats')
+    async def get(req):
+        """Return hit/miss counters and size of the generation cache"""
+        return JSONResponse(get_generation_cache_stats())
+
     @rt('/api/html5/refine-code')
     async def post(req):
         """Refine existing HTML5 code based on reference images and refinement instructions"""
@@ -1647,6 +2152,7 @@ def routes(rt):
             # Get refinement instructions and model
             prompt = form.get('prompt', '')
             model = form.get('model', 'gpt-4o')
+            force_regenerate = form.get('force-regenerate') == 'on'
             
             # Refinement history feature removed – do not store prompts
             
@@ -1669,7 +2175,7 @@ def routes(rt):
             
             # Generate refined code
             try:
-                html, css, js = await generate_html5_code(prompt, images, model, is_iterative, current_html, current_css, current_js, user_id=user_id, session_id=req.session.session_id if hasattr(req.session, 'session_id') else None)
+                html, css, js = await generate_html5_code_cached(prompt, images, model, is_iterative, current_html, current_css, current_js, user_id=user_id, session_id=req.session.session_id if hasattr(req.session, 'session_id') else None, force_regenerate=force_regenerate)
                 print(f"Successfully refined code - HTML: {len(html)} chars, CSS: {len(css)} chars, JS: {len(js)} chars")
                 
                 # If no content was returned, return an error
@@ -1694,104 +2200,14 @@ def routes(rt):
                 
                 print("Stored refined code in global storage and session")
                 
-                # Create preview content with the refined code
-                preview_content = f"""<!DOCTYPE html>
-                <html>
-                <head>
-                    <meta charset="UTF-8">
-                    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                    <style>
-                    /* Reset some basic elements */
-                    body {{
-                        margin: 0;
-                        padding: 0;
-                        font-family: Arial, sans-serif;
-                        min-height: 100vh;
-                    }}
-                    /* Default container for content */
-                    #content-container {{
-                        padding: 20px;
-                    }}
-                    /* User CSS */
-                    {css}
-                    </style>
-                </head>
-                <body>
-                    <div id="content-container">
-                        {html}
-                    </div>
-                    <script>
-                    // Initialize content and catch errors
-                    try {{
-                        {js}
-                    }} catch (error) {{
-                        console.error('Error in JavaScript execution:', error);
-                        const errorDiv = document.createElement('div');
-                        errorDiv.style.color = 'red';
-                        errorDiv.style.padding = '10px';
-                        errorDiv.innerHTML = '<strong>JavaScript Error:</strong><br>' + error.message;
-                        document.body.appendChild(errorDiv);
-                    }}
-                    </script>
-                </body>
-                </html>"""
-                
-                # Encode the content as base64
-                encoded_content = base64.b64encode(preview_content.encode('utf-8')).decode('utf-8')
-                
                 # Create code editors with the new code
-                return [
-                    Div(
+                return render_generated_code(
+                    html, css, js,
+                    banner=Div(
                         "Code Successfully Refined",
                         cls="bg-green-900 text-green-100 p-2 rounded mb-4"
-                    ),
-                    create_code_editors(html, css, js),
-                    NotStr(f"""
-                    <script>
-                        // Add a create ZIP button after refinement
-                        const dynamicButtonsContainer = document.getElementById('dynamic-buttons');
-                        if (dynamicButtonsContainer) {{
-                            // Create a ZIP button
-                            const zipButton = document.createElement('button');
-                            zipButton.id = 'create-zip-button';
-                            zipButton.innerHTML = `
-                                <div class="flex items-center justify-center w-full">
-                                    <svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" width="20" height="20" fill="currentColor">
-                                        <path d="M20 6h-3V4c0-1.1-.9-2-2-2H9c-1.1 0-2 .9-2 2v2H4c-1.1 0-2 .9-2 2v11c0 1.1.9 2 2 2h16c1.1 0 2-.9 2-2V8c0-1.1-.9-2-2-2zm-5-2v2H9V4h6zM4 8h16v3H4V8zm0 11v-6h16v6H4z"/>
-                                    </svg>
-                                    <span class="ml-2">Create ZIP</span>
-                                </div>`;
-                            zipButton.className = 'action-button bg-gradient-to-r from-indigo-600 to-indigo-500';
-                            // Add explicit onclick handler to call createZipPackage function directly
-                            zipButton.onclick = function(e) {{
-                                e.preventDefault();
-                                console.log("ZIP button clicked with direct onclick handler");
-                                createZipPackage();
-                                return false;
-                            }};
-                            dynamicButtonsContainer.appendChild(zipButton);
-                        }}
-                    </script>
-                    """),
-                    NotStr(f"""
-                    <script>
-                        // Add data URL to iframe src
-                        window.setTimeout(function() {{
-                            const iframe = document.createElement('iframe');
-                            iframe.src = "data:text/html;base64,{encoded_content}";
-                            iframe.style.width = '100%';
-                            iframe.style.height = '100%';
-                            iframe.style.border = 'none';
-                            
-                            const container = document.getElementById('preview-container');
-                            if (container) {{
-                                container.innerHTML = '';
-                                container.appendChild(iframe);
-                            }}
-                        }}, 300);
-                    </script>
-                    """)
-                ]
+                    )
+                )
             except Exception as e:
                 print(f"Error refining code: {str(e)}")
                 import traceback
@@ -2348,6 +2764,176 @@ def routes(rt):
             "message": "Draft deleted successfully"
         })
 
+async def prepare_reference_images(images):
+    """
+    Normalise base64 reference images for the Claude and OpenAI vision APIs
+    
+    Args:
+        images (list): Base64 image data (with or without data URL prefix)
+        
+    Returns:
+        tuple: (claude_image_data_list, openai_image_data_list)
+    """
+    # Process uploaded images
+    claude_image_data_list = []
+    openai_image_data_list = []
+    
+    for base64_data in images:
+        if base64_data and len(base64_data) > 100:  # Simple check to ensure it's likely valid base64 data
+            # Process for Claude (PIL work runs off the event loop)
+            claude_processed_data, claude_media_type = await asyncio.to_thread(process_image_for_claude, base64_data)
+            if claude_processed_data:
+                claude_image_data_list.append({
+                    'data': claude_processed_data,
+                    'media_type': claude_media_type
+                })
+            
+            # Process for OpenAI
+            openai_data_url = await asyncio.to_thread(process_image_for_openai, base64_data)
+            if openai_data_url:
+                openai_image_data_list.append(openai_data_url)
+    
+    return claude_image_data_list, openai_image_data_list
+
+
+def build_system_prompt(is_iterative, current_html, current_css, current_js):
+    """
+    Build the system prompt for HTML5 generation, including the existing code in iterative mode
+    
+    Returns:
+        str: The system prompt, ending with the lead-in for the user instructions
+    """
+    # System prompt design with reference to images
+    system_prompt = """
+    You are a web developer specialising in creating Educational HTML5 interactive content.
+
+    You have to complete one of the following tasks:"""
+    
+    # Add iterative mode instructions if needed
+    if is_iterative:
+        # Check if we have current code to include
+        has_current_code = bool(current_html.strip() or current_css.strip() or current_js.strip())
+        
+        if has_current_code:
+            system_prompt += f"""
+
+            ITERATIVE MODE INSTRUCTIONS:
+            - You are modifying existing HTML, CSS, and JavaScript code that the user has provided.
+            - Focus on addressing the specific requests while preserving the existing functionality and the overall structure of the code. 
+            - As far as possible only add, remove or modify code to align with the user's instructions and leave the rest of the code unchanged.
+            - Provide comments in the code to explain the changes you have made
+
+            Here is the existing HTML code:
+            ```html
+            {current_html}
+            ```
+
+            Here is the existing CSS code:
+            ```css
+            {current_css}
+            ```
+
+            Here is the existing JavaScript code:
+            ```javascript
+            {current_js}
+            ```
+
+            Please modify the code according to my instructions while maintaining the overall structure and functionality.
+            **IMPORTANT**: JavaScript is REQUIRED for all interactive content. You MUST include JavaScript code in your response, even for simple interactions. Without JavaScript, the HTML5 content will not be interactive.
+            **CRITICAL**: Use the extract_code_components tool to return your code in a structured format.
+            User request and instructions:
+            """         
+
+            print(f"Added current code to prompt in iterative mode - HTML: {len(current_html)} chars, CSS: {len(current_css)} chars, JS: {len(current_js)} chars")
+        else:
+            # When in iterative mode but no existing code, treat it as new content creation
+            print("Iterative mode enabled but no current code found - treating as new content creation")
+            system_prompt += """
+        
+        NEW CONTENT CREATION INSTRUCTIONS:
+        Important:
+        - Use the provided reference images as references on how to create the content.
+        - Provide comments in the code on what the code is doing and how it works.
+        **IMPORTANT**: JavaScript is REQUIRED for all interactive content. You MUST include JavaScript code in your response, even for simple interactions. Without JavaScript, the HTML5 content will not be interactive.
+        **CRITICAL**: Use the extract_code_components tool to generate three separate components (HTML, CSS, JavaScript) in a structured format.
+
+        User request and instructions:
+        """
+    else:
+            system_prompt += """
+        
+        NEW CONTENT CREATION INSTRUCTIONS:
+        Important:
+        - Use the provided reference images as references on how to create the content.
+        - Provide comments in the code on what the code is doing and how it works.
+        **IMPORTANT**: JavaScript is REQUIRED for all interactive content. You MUST include JavaScript code in your response, even for simple interactions. Without JavaScript, the HTML5 content will not be interactive.
+        **CRITICAL**: Use the extract_code_components tool to generate three separate components (HTML, CSS, JavaScript) in a structured format.
+
+        User request and instructions:
+        """
+    
+    return system_prompt
+
+
+def check_prompt_budget(prompt_text, image_count=0):
+    """
+    Pre-flight check of the prompt size using the local token estimator
+    
+    Args:
+        prompt_text (str): Full text sent to the model (system prompt and user prompt)
+        image_count (int): Number of reference images attached
+        
+    Raises:
+        ValueError: If the estimate exceeds the configured prompt budget
+    """
+    estimated_tokens = token_count.estimate_tokens(prompt_text) + image_count * token_count.IMAGE_TOKEN_ESTIMATE
+    print(f"Estimated prompt tokens: {estimated_tokens} (budget {MAX_PROMPT_TOKENS})")
+    if estimated_tokens > MAX_PROMPT_TOKENS:
+        raise ValueError(f"The prompt is too long (about {estimated_tokens} tokens). Please shorten it or remove some existing code.")
+
+
+def gemini_usage(response):
+    """
+    Read prompt and completion token counts from a Gemini response
+    
+    Returns:
+        tuple: (prompt_tokens, completion_tokens)
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    if not usage:
+        return 0, 0
+    return usage.prompt_token_count or 0, usage.candidates_token_count or 0
+
+
+async def generate_html5_code_cached(prompt, images, model, is_iterative, current_html, current_css, current_js, user_id="anonymous", session_id=None, force_regenerate=False):
+    """
+    Generate HTML5 code, serving identical requests from the generation cache
+    
+    Args:
+        force_regenerate (bool): Skip the cache lookup and always call the model
+        
+    Returns:
+        tuple: (html, css, js)
+    """
+    start_time = datetime.datetime.now()
+    cache_key = generation_cache_key(model, prompt, images, is_iterative, current_html, current_css, current_js)
+    
+    if not force_regenerate:
+        cached = get_cached_generation(cache_key)
+        if cached:
+            print(f"Generation cache hit {cache_key[:12]} for user {user_id}")
+            record_cache_hit(model, prompt, user_id, session_id, start_time)
+            return cached["html"], cached["css"], cached["js"]
+    
+    html, css, js = await generate_html5_code(prompt, images, model, is_iterative, current_html, current_css, current_js, user_id=user_id, session_id=session_id)
+    
+    # Don't cache empty results or the unchanged code returned when extraction fails
+    if (html or css or js) and (html, css, js) != (current_html, current_css, current_js):
+        cache_generation(cache_key, html, css, js)
+    
+    return html, css, js
+
+
 async def generate_html5_code(prompt, images, model, is_iterative, current_html, current_css, current_js, user_id="anonymous", session_id=None):
     """Generate HTML5 code using the specified model"""
     try:
@@ -2371,96 +2957,17 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
             raise ValueError("Please provide a prompt for code generation")
         
         # Process uploaded images
-        claude_image_data_list = []
-        openai_image_data_list = []
-        
-        for base64_data in images:
-            if base64_data and len(base64_data) > 100:  # Simple check to ensure it's likely valid base64 data
-                # Process for Claude
-                claude_processed_data, claude_media_type = process_image_for_claude(base64_data)
-                if claude_processed_data:
-                    claude_image_data_list.append({
-                        'data': claude_processed_data,
-                        'media_type': claude_media_type
-                    })
-                
-                # Process for OpenAI
-                openai_data_url = process_image_for_openai(base64_data)
-                if openai_data_url:
-                    openai_image_data_list.append(openai_data_url)
+        claude_image_data_list, openai_image_data_list = await prepare_reference_images(images)
         
         # System prompt design with reference to images
-        system_prompt = """
-        You are a web developer specialising in creating Educational HTML5 interactive content.
-
-        You have to complete one of the following tasks:"""
+        system_prompt = build_system_prompt(is_iterative, current_html, current_css, current_js)
         
         # Initialize user_prompt with the original prompt
         user_prompt = prompt
         
-        # Add iterative mode instructions if needed
-        if is_iterative:
-            # Check if we have current code to include
-            has_current_code = bool(current_html.strip() or current_css.strip() or current_js.strip())
-            
-            if has_current_code:
-                system_prompt += f"""
-
-                ITERATIVE MODE INSTRUCTIONS:
-                - You are modifying existing HTML, CSS, and JavaScript code that the user has provided.
-                - Focus on addressing the specific requests while preserving the existing functionality and the overall structure of the code. 
-                - As far as possible only add, remove or modify code to align with the user's instructions and leave the rest of the code unchanged.
-                - Provide comments in the code to explain the changes you have made
-
-                Here is the existing HTML code:
-                ```html
-                {current_html}
-                ```
-
-                Here is the existing CSS code:
-                ```css
-                {current_css}
-                ```
-
-                Here is the existing JavaScript code:
-                ```javascript
-                {current_js}
-                ```
-
-                Please modify the code according to my instructions while maintaining the overall structure and functionality.
-                **IMPORTANT**: JavaScript is REQUIRED for all interactive content. You MUST include JavaScript code in your response, even for simple interactions. Without JavaScript, the HTML5 content will not be interactive.
-                **CRITICAL**: Use the extract_code_components tool to return your code in a structured format.
-                User request and instructions:
-                """         
-
-                print(f"Added current code to prompt in iterative mode - HTML: {len(current_html)} chars, CSS: {len(current_css)} chars, JS: {len(current_js)} chars")
-            else:
-                # When in iterative mode but no existing code, treat it as new content creation
-                print("Iterative mode enabled but no current code found - treating as new content creation")
-                system_prompt += """
-            
-            NEW CONTENT CREATION INSTRUCTIONS:
-            Important:
-            - Use the provided reference images as references on how to create the content.
-            - Provide comments in the code on what the code is doing and how it works.
-            **IMPORTANT**: JavaScript is REQUIRED for all interactive content. You MUST include JavaScript code in your response, even for simple interactions. Without JavaScript, the HTML5 content will not be interactive.
-            **CRITICAL**: Use the extract_code_components tool to generate three separate components (HTML, CSS, JavaScript) in a structured format.
-
-            User request and instructions:
-            """
-        else:
-                system_prompt += """
-            
-            NEW CONTENT CREATION INSTRUCTIONS:
-            Important:
-            - Use the provided reference images as references on how to create the content.
-            - Provide comments in the code on what the code is doing and how it works.
-            **IMPORTANT**: JavaScript is REQUIRED for all interactive content. You MUST include JavaScript code in your response, even for simple interactions. Without JavaScript, the HTML5 content will not be interactive.
-            **CRITICAL**: Use the extract_code_components tool to generate three separate components (HTML, CSS, JavaScript) in a structured format.
-
-            User request and instructions:
-            """
-            
+        # Reject prompts that cannot fit the context window before calling the API
+        check_prompt_budget(system_prompt + user_prompt, len(claude_image_data_list))
+        
         # print(f"System prompt: {system_prompt}")
         
         # User ID and session ID are now passed as parameters
@@ -2469,11 +2976,11 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
         # Determine which AI service to use based on the model
         if model.startswith("claude"):
             # Use Anthropic/Claude
-            import anthropic
             from anthropic._exceptions import OverloadedError, APIStatusError
             
             try:
-                client = anthropic.Anthropic(api_key=anthropic_key, timeout=360.0)
+                # Use the async client so a long generation doesn't block the event loop
+                client = llm_clients.get_async_anthropic(anthropic_key, timeout=360.0)
                 
                 # Build message content with images if available
                 message_content = [
@@ -2494,18 +3001,10 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                         }
                     })
                 
-                # Get token count for prompt
-                token_count_response = client.messages.count_tokens(
-                    model=model,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": message_content
-                        }
-                    ]
-                )
-                prompt_tokens = token_count_response.input_tokens
-                print("Message content: ", message_content)                # Create API call parameters
+                # Prompt tokens are taken from response.usage, so no separate count_tokens call
+                print(f"Message content: {len(message_content[0]['text'])} chars of text, {len(claude_image_data_list)} images")
+                
+                # Create API call parameters
                 api_params = {
                     "model": model,
                     "max_tokens": 16000,  # Default token limit
@@ -2513,25 +3012,8 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                     "tools": [
                         {
                             "name": "extract_code_components",
-                            "description": "Extract HTML, CSS, and JavaScript components from the generated code. All three components MUST be included for a complete interactive HTML5 experience.",
-                            "input_schema": {
-                                "type": "object",
-                                "properties": {
-                                    "html": {
-                                        "type": "string",
-                                        "description": "HTML content without the body tags"
-                                    },
-                                    "css": {
-                                        "type": "string",
-                                        "description": "CSS content without the style tags"
-                                    },
-                                    "javascript": {
-                                        "type": "string",
-                                        "description": "JavaScript content without the script tags. This is REQUIRED for interactive content."
-                                    }
-                                },
-                                "required": ["html", "css", "javascript"]
-                            }
+                            "description": CODE_COMPONENTS_DESCRIPTION,
+                            "input_schema": CODE_COMPONENTS_SCHEMA
                         }
                     ],
                     "messages": [
@@ -2561,7 +3043,7 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                         # Let the model decide whether to use the tool
                         
                         # STEP 1: Make the initial API call with thinking mode
-                        initial_response = client.messages.create(**thinking_params)
+                        initial_response = await client.messages.create(**thinking_params)
                         
                         # Extract thinking and tool_use blocks from the response
                         thinking_block = None
@@ -2602,6 +3084,7 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                             # If we already have complete code components, we can return them
                             if html and (css or True) and js:  # CSS is optional
                                 # Record token usage
+                                prompt_tokens = initial_response.usage.input_tokens
                                 completion_tokens = initial_response.usage.output_tokens
                                 total_tokens = prompt_tokens + completion_tokens
                                 
@@ -2648,7 +3131,7 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                             ]
                             
                             print("Sending continuation request with tool result")
-                            final_response = client.messages.create(**continuation_params)
+                            final_response = await client.messages.create(**continuation_params)
                             
                             # Handle the final response - should contain complete code
                             if final_response and hasattr(final_response, 'content') and len(final_response.content) > 0:
@@ -2669,7 +3152,8 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                                     print("Extracting components from final text content")
                                     html, css, js = extract_components(final_text_content)
                                 
-                                # Record token usage for both requests combined
+                                # Record token usage for both requests combined (the prompt is sent twice)
+                                prompt_tokens = initial_response.usage.input_tokens + final_response.usage.input_tokens
                                 initial_tokens = initial_response.usage.output_tokens
                                 final_tokens = final_response.usage.output_tokens
                                 completion_tokens = initial_tokens + final_tokens
@@ -2700,6 +3184,7 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                             
                             if html and (css or True) and js:  # CSS is optional
                                 # Record token usage
+                                prompt_tokens = initial_response.usage.input_tokens
                                 completion_tokens = initial_response.usage.output_tokens
                                 total_tokens = prompt_tokens + completion_tokens
                                 
@@ -2725,7 +3210,7 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                 print("Using standard approach with forced tool_choice")
                 
                 # Make the actual API call with the parameters
-                response = client.messages.create(**api_params)
+                response = await client.messages.create(**api_params)
                 
                 if response:
                     print(f"Received response from Claude. Type: {type(response)}")
@@ -2793,6 +3278,7 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                         # If we have valid HTML, CSS and JS from tool use, return the components
                         if tool_use_found and html and (css or True) and js:  # CSS is optional
                             # Record token usage
+                            prompt_tokens = response.usage.input_tokens
                             completion_tokens = response.usage.output_tokens
                             total_tokens = prompt_tokens + completion_tokens
                             
@@ -2831,6 +3317,7 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                     html, css, js = extract_components(code)
                     
                     # Record token usage
+                    prompt_tokens = response.usage.input_tokens
                     completion_tokens = response.usage.output_tokens
                     total_tokens = prompt_tokens + completion_tokens
                     
@@ -2872,35 +3359,17 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                 raise ValueError(f"Claude API error: {str(e)}")
         elif model.startswith("gemini"):
             # Use Google Gemini
-            from google import genai
             from google.genai import types
             
             try:
                 # Configure the client
-                client = genai.Client(api_key=gemini_key)
+                client = llm_clients.get_gemini(gemini_key)
                 
                 # Define the function declaration for extract_code_components
                 extract_code_components_declaration = {
                     "name": "extract_code_components",
-                    "description": "Extract HTML, CSS, and JavaScript components from the generated code. All three components MUST be included for a complete interactive HTML5 experience.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "html": {
-                                "type": "string",
-                                "description": "HTML content without the body tags"
-                            },
-                            "css": {
-                                "type": "string",
-                                "description": "CSS content without the style tags"
-                            },
-                            "javascript": {
-                                "type": "string",
-                                "description": "JavaScript content without the script tags. This is REQUIRED for interactive content."
-                            }
-                        },
-                        "required": ["html", "css", "javascript"]
-                    }
+                    "description": CODE_COMPONENTS_DESCRIPTION,
+                    "parameters": CODE_COMPONENTS_SCHEMA
                 }
                 
                 # Configure tools and generation config
@@ -2926,7 +3395,7 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                 # We should add image support when available
                 
                 # Make the API call
-                response = client.models.generate_content(
+                response = await client.aio.models.generate_content(
                     model=model,
                     contents=contents,
                     config=config
@@ -2950,10 +3419,8 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                                     
                                     print(f"Successfully extracted components using function call - HTML: {len(html)} chars, CSS: {len(css)} chars, JS: {len(js)} chars")
                                     
-                                    # Record token usage (if available from Gemini API)
-                                    # Note: Gemini may structure this differently, adapt as needed
-                                    prompt_tokens = getattr(response, 'usage', {}).get('prompt_tokens', 0)
-                                    completion_tokens = getattr(response, 'usage', {}).get('completion_tokens', 0) 
+                                    # Record token usage from Gemini's usage metadata
+                                    prompt_tokens, completion_tokens = gemini_usage(response)
                                     total_tokens = prompt_tokens + completion_tokens
                                     
                                     # Calculate generation time
@@ -3004,9 +3471,8 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                         if is_iterative and current_html and current_css and current_js:
                             return current_html, current_css, current_js
                     
-                    # Record token usage (if available)
-                    prompt_tokens = getattr(response, 'usage', {}).get('prompt_tokens', 0)
-                    completion_tokens = getattr(response, 'usage', {}).get('completion_tokens', 0)
+                    # Record token usage from Gemini's usage metadata
+                    prompt_tokens, completion_tokens = gemini_usage(response)
                     total_tokens = prompt_tokens + completion_tokens
                     
                     # Calculate generation time
@@ -3033,10 +3499,8 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                 raise ValueError(f"Gemini API error: {str(e)}")
         else:
             # Use OpenAI
-            from openai import OpenAI
-            
             try:
-                client = OpenAI(api_key=openai_key)
+                client = llm_clients.get_async_openai(openai_key)
                 
                 # Build messages with images if available
                 messages = [
@@ -3073,31 +3537,14 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
                         "type": "function",
                         "function": {
                             "name": "extract_code_components",
-                            "description": "Extract HTML, CSS, and JavaScript components from the generated code. All three components MUST be included for a complete interactive HTML5 experience.",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "html": {
-                                        "type": "string",
-                                        "description": "HTML content without the body tags"
-                                    },
-                                    "css": {
-                                        "type": "string",
-                                        "description": "CSS content without the style tags"
-                                    },
-                                    "javascript": {
-                                        "type": "string",
-                                        "description": "JavaScript content without the script tags. This is REQUIRED for interactive content."
-                                    }
-                                },
-                                "required": ["html", "css", "javascript"]
-                            }
+                            "description": CODE_COMPONENTS_DESCRIPTION,
+                            "parameters": CODE_COMPONENTS_SCHEMA
                         }
                     }
                 ]
                 
                 # Make the API call with function tools
-                response = client.chat.completions.create(
+                response = await client.chat.completions.create(
                     model=model,
                     max_tokens=16000,
                     messages=messages,
@@ -3209,4 +3656,222 @@ async def generate_html5_code(prompt, images, model, is_iterative, current_html,
             except Exception as e:
                 raise ValueError(f"OpenAI API error: {str(e)}")
     except Exception as e:
-        raise ValueError(f"Error generating code: {str(e)}")
\ No newline at end of file
+        raise ValueError(f"Error generating code: {str(e)}")
+
+def sse_event(event, data):
+    """Format a Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_html5_code(prompt, images, model, is_iterative, current_html, current_css, current_js, user_id="anonymous", session_id=None):
+    """
+    Generate HTML5 code using the specified model, streaming the result as it arrives
+    
+    Yields:
+        tuple: ("delta", {"html"|"css"|"js": new_text}) while the extract_code_components
+            arguments stream in, then ("done", (html, css, js)) once the response completes
+    """
+    try:
+        # Start timing the generation
+        start_time = datetime.datetime.now()
+        
+        # Get API keys
+        openai_key = os.environ["OPENAI_API_KEY"]
+        anthropic_key = os.environ["ANTHROPIC_API_KEY"]
+        gemini_key = os.environ.get("GEMINI_API_KEY")
+        
+        # Check for API keys
+        if not openai_key and model.startswith(("gpt", "o1", "o3")):
+            raise ValueError("Please configure your OpenAI API key first")
+        if not anthropic_key and model.startswith("claude"):
+            raise ValueError("Please configure your Anthropic API key first")
+        if not gemini_key and model.startswith("gemini"):
+            raise ValueError("Please configure your Gemini API key first")
+        
+        if not prompt:
+            raise ValueError("Please provide a prompt for code generation")
+        
+        claude_image_data_list, openai_image_data_list = await prepare_reference_images(images)
+        system_prompt = build_system_prompt(is_iterative, current_html, current_css, current_js)
+        check_prompt_budget(system_prompt + prompt, len(claude_image_data_list))
+        
+        parser = ComponentStreamParser()
+        tool_input = None
+        text_content = ""
+        prompt_tokens = 0
+        completion_tokens = 0
+        
+        if model.startswith("claude"):
+            client = llm_clients.get_async_anthropic(anthropic_key, timeout=360.0)
+            
+            # Build message content with images if available
+            message_content = [{"type": "text", "text": system_prompt + prompt}]
+            for img_data in claude_image_data_list:
+                message_content.append({
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": img_data['media_type'],
+                        "data": img_data['data']
+                    }
+                })
+            
+            # Streaming always uses the forced tool_choice path (no extended thinking)
+            async with client.messages.stream(
+                model=model,
+                max_tokens=16000,
+                temperature=0.4,
+                tools=[{
+                    "name": "extract_code_components",
+                    "description": CODE_COMPONENTS_DESCRIPTION,
+                    "input_schema": CODE_COMPONENTS_SCHEMA
+                }],
+                tool_choice={"type": "tool", "name": "extract_code_components"},
+                messages=[{"role": "user", "content": message_content}]
+            ) as stream:
+                async for event in stream:
+                    if event.type != 'content_block_delta':
+                        continue
+                    if event.delta.type == 'input_json_delta':
+                        deltas = parser.feed(event.delta.partial_json)
+                        if deltas:
+                            yield "delta", deltas
+                    elif event.delta.type == 'text_delta':
+                        text_content += event.delta.text
+                
+                final_message = await stream.get_final_message()
+            
+            for content in final_message.content:
+                if content.type == 'tool_use' and content.name == 'extract_code_components':
+                    tool_input = content.input
+            
+            prompt_tokens = final_message.usage.input_tokens
+            completion_tokens = final_message.usage.output_tokens
+        elif model.startswith("gemini"):
+            from google.genai import types
+            
+            client = llm_clients.get_gemini(gemini_key)
+            config = types.GenerateContentConfig(
+                tools=[types.Tool(function_declarations=[{
+                    "name": "extract_code_components",
+                    "description": CODE_COMPONENTS_DESCRIPTION,
+                    "parameters": CODE_COMPONENTS_SCHEMA
+                }])],
+                temperature=0.4,
+                max_output_tokens=8192
+            )
+            contents = [types.Content(role="user", parts=[types.Part(text=system_prompt + prompt)])]
+            
+            async for chunk in await client.aio.models.generate_content_stream(model=model, contents=contents, config=config):
+                if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
+                    for part in chunk.candidates[0].content.parts:
+                        if part.function_call and part.function_call.name == 'extract_code_components':
+                            # Gemini delivers function call arguments whole rather than as fragments
+                            tool_input = dict(part.function_call.args)
+                            deltas = parser.feed(json.dumps(tool_input))
+                            if deltas:
+                                yield "delta", deltas
+                        elif part.text:
+                            text_content += part.text
+                
+                if chunk.usage_metadata:
+                    prompt_tokens, completion_tokens = gemini_usage(chunk)
+        else:
+            client = llm_clients.get_async_openai(openai_key)
+            
+            # Build messages with images if available
+            user_message_content = [{"type": "text", "text": prompt}]
+            for data_url in openai_image_data_list:
+                user_message_content.append({"type": "image_url", "image_url": {"url": data_url}})
+            
+            stream = await client.chat.completions.create(
+                model=model,
+                max_tokens=16000,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_message_content}
+                ],
+                tools=[{
+                    "type": "function",
+                    "function": {
+                        "name": "extract_code_components",
+                        "description": CODE_COMPONENTS_DESCRIPTION,
+                        "parameters": CODE_COMPONENTS_SCHEMA
+                    }
+                }],
+                tool_choice={"type": "function", "function": {"name": "extract_code_components"}},
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            
+            arguments = []
+            async for chunk in stream:
+                # The final chunk carries usage and no choices
+                if chunk.usage:
+                    prompt_tokens = chunk.usage.prompt_tokens
+                    completion_tokens = chunk.usage.completion_tokens
+                if not chunk.choices:
+                    continue
+                
+                delta = chunk.choices[0].delta
+                for tool_call in delta.tool_calls or []:
+                    if tool_call.function and tool_call.function.arguments:
+                        arguments.append(tool_call.function.arguments)
+                        deltas = parser.feed(tool_call.function.arguments)
+                        if deltas:
+                            yield "delta", deltas
+                if delta.content:
+                    text_content += delta.content
+            
+            if arguments:
+                try:
+                    tool_input = json.loads("".join(arguments))
+                except ValueError as e:
+                    print(f"Streamed tool arguments were not valid JSON: {e}")
+        
+        # Prefer the complete tool input, then whatever was decoded from the stream
+        if tool_input:
+            html = tool_input.get('html', '')
+            css = tool_input.get('css', '')
+            js = tool_input.get('javascript', '')
+        else:
+            values = parser.values()
+            html, css, js = values['html'], values['css'], values['js']
+        
+        # Fall back to regex extraction from any text content
+        if not (html or css or js) and text_content:
+            print(f"No tool input streamed, extracting from text content: {len(text_content)} chars")
+            html, css, js = extract_components(text_content)
+        
+        if not js and text_content:
+            js_match = re.search(r'```(?:javascript|js)\s*(.*?)\s*```', text_content, re.DOTALL)
+            if js_match:
+                js = js_match.group(1).strip()
+                print(f"Extracted JavaScript from text content - {len(js)} chars")
+        
+        if not (html or css or js):
+            print("WARNING: No content extracted from streamed response. Using original content.")
+            if is_iterative and current_html and current_css and current_js:
+                html, css, js = current_html, current_css, current_js
+        
+        print(f"Streamed generation complete - HTML: {len(html)} chars, CSS: {len(css)} chars, JS: {len(js)} chars")
+        
+        # Calculate generation time
+        end_time = datetime.datetime.now()
+        generation_time_ms = (end_time - start_time).total_seconds() * 1000
+        
+        # Save token usage to database
+        token_count.record_token_usage(
+            model=model,
+            prompt=prompt if prompt else None,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+            user_id=user_id,
+            session_id=session_id,
+            generation_time_ms=generation_time_ms
+        )
+        
+        yield "done", (html, css, js)
+    except Exception as e:
+        raise ValueError(f"Error generating code: {str(e)}")
@@ -1,7 +1,7 @@
 from fasthtml.common import *
 from components.gallery_upload_form import create_gallery_upload_form
-from components.gallery_submissions_grid import create_gallery_submissions_grid
-from routes.api import get_submissions_by_gallery_type
+from components.gallery_submissions_grid import create_gallery_submissions_grid, create_gallery_pager
+from routes.api import get_submissions_page, parse_gallery_page, GALLERY_PAGE_SIZE
 
 def routes(router):
     @router.get("/jc_ci")
@@ -18,14 +18,11 @@ def routes(router):
         
     @router.get("/jc_ci/math")
     def jc_ci_math(req):
-        # Get submissions for JC/CI math
-        jc_ci_submissions = get_submissions_by_gallery_type("jc_ci")
-        # Filter further by subject (case-insensitive contains match)
+        # Get one page of submissions for JC/CI math, newest first
+        # Filtered by subject (case-insensitive contains match)
         math_keywords = ["math", "calculus", "statistics", "further mathematics"]
-        math_submissions = [
-            s for s in jc_ci_submissions 
-            if any(keyword in s.get("subject", "").lower() for keyword in math_keywords)
-        ]
+        page = parse_gallery_page(req)
+        math_submissions, total = get_submissions_page("jc_ci", keywords=math_keywords, offset=(page - 1) * GALLERY_PAGE_SIZE, limit=GALLERY_PAGE_SIZE)
         
         return Div(
             H3("JC & CI Math Interactives"),
@@ -33,20 +30,18 @@ def routes(router):
             # Gallery submissions section
             H3("Community Submissions", style="font-size: 1.25rem; font-weight: bold; color: #4ade80; margin-top: 2rem; margin-bottom: 1rem;"),
             create_gallery_submissions_grid(math_submissions),
+            create_gallery_pager("/jc_ci/math", page, total, GALLERY_PAGE_SIZE),
             
             cls="submenu-content-area"
         )
     
     @router.get("/jc_ci/science")
     def jc_ci_science(req):
-        # Get submissions for JC/CI science
-        jc_ci_submissions = get_submissions_by_gallery_type("jc_ci")
-        # Filter further by subject (case-insensitive contains match)
+        # Get one page of submissions for JC/CI science, newest first
+        # Filtered by subject (case-insensitive contains match)
         science_keywords = ["physics", "chemistry", "biology", "science"]
-        science_submissions = [
-            s for s in jc_ci_submissions 
-            if any(keyword in s.get("subject", "").lower() for keyword in science_keywords)
-        ]
+        page = parse_gallery_page(req)
+        science_submissions, total = get_submissions_page("jc_ci", keywords=science_keywords, offset=(page - 1) * GALLERY_PAGE_SIZE, limit=GALLERY_PAGE_SIZE)
         
         return Div(
             H3("JC & CI Science Interactives"),
@@ -54,20 +49,18 @@ def routes(router):
             # Gallery submissions section
             H3("Community Submissions", style="font-size: 1.25rem; font-weight: bold; color: #4ade80; margin-top: 2rem; margin-bottom: 1rem;"),
             create_gallery_submissions_grid(science_submissions),
+            create_gallery_pager("/jc_ci/science", page, total, GALLERY_PAGE_SIZE),
             
             cls="submenu-content-area"
         )
     
     @router.get("/jc_ci/humanities_arts")
     def jc_ci_humanities_arts(req):
-        # Get submissions for JC/CI humanities & arts
-        jc_ci_submissions = get_submissions_by_gallery_type("jc_ci")
-        # Filter further by subject (case-insensitive contains match)
+        # Get one page of submissions for JC/CI humanities & arts, newest first
+        # Filtered by subject (case-insensitive contains match)
         humanities_keywords = ["economics", "history", "geography", "arts", "humanities"]
-        humanities_submissions = [
-            s for s in jc_ci_submissions 
-            if any(keyword in s.get("subject", "").lower() for keyword in humanities_keywords)
-        ]
+        page = parse_gallery_page(req)
+        humanities_submissions, total = get_submissions_page("jc_ci", keywords=humanities_keywords, offset=(page - 1) * GALLERY_PAGE_SIZE, limit=GALLERY_PAGE_SIZE)
         
         return Div(
             H3("JC & CI Humanities & Arts Interactives"),
@@ -75,20 +68,18 @@ def routes(router):
             # Gallery submissions section
             H3("Community Submissions", style="font-size: 1.25rem; font-weight: bold; color: #4ade80; margin-top: 2rem; margin-bottom: 1rem;"),
             create_gallery_submissions_grid(humanities_submissions),
+            create_gallery_pager("/jc_ci/humanities_arts", page, total, GALLERY_PAGE_SIZE),
             
             cls="submenu-content-area"
         )
     
     @router.get("/jc_ci/languages")
     def jc_ci_languages(req):
-        # Get submissions for JC/CI languages
-        jc_ci_submissions = get_submissions_by_gallery_type("jc_ci")
-        # Filter further by subject (case-insensitive contains match)
+        # Get one page of submissions for JC/CI languages, newest first
+        # Filtered by subject (case-insensitive contains match)
         language_keywords = ["general paper", "english", "chinese", "malay", "tamil", "literature", "language"]
-        language_submissions = [
-            s for s in jc_ci_submissions 
-            if any(keyword in s.get("subject", "").lower() for keyword in language_keywords)
-        ]
+        page = parse_gallery_page(req)
+        language_submissions, total = get_submissions_page("jc_ci", keywords=language_keywords, offset=(page - 1) * GALLERY_PAGE_SIZE, limit=GALLERY_PAGE_SIZE)
         
         return Div(
             H3("JC & CI Languages Interactives"),
@@ -96,6 +87,7 @@ def routes(router):
             # Gallery submissions section
             H3("Community Submissions", style="font-size: 1.25rem; font-weight: bold; color: #4ade80; margin-top: 2rem; margin-bottom: 1rem;"),
             create_gallery_submissions_grid(language_submissions),
+            create_gallery_pager("/jc_ci/languages", page, total, GALLERY_PAGE_SIZE),
             
             cls="submenu-content-area"
         ) 
\ No newline at end of file
@@ -4,9 +4,15 @@ import json
 import datetime
 import base64
 from pathlib import Path
-import tempfile
 import yaml
+import asyncio
+import time
+from starlette.responses import Response, StreamingResponse
 from components.lea_form import create_lea_chatbot, ChatMessage, create_recipe_carousel
+import chat_store
+import chat_context
+import llm_clients
+import chat_images
 
 # Load environment variables
 from dotenv import load_dotenv
@@ -44,22 +50,127 @@ else:
     
     
 
-# Session keys
-CHAT_HISTORY_KEY = "lea_chat_history"
+# Conversation settings in chat_store (the session only holds the conversation id)
 SYSTEM_PROMPT_KEY = "system_prompt"
 RECIPE_TEMPLATE_KEY = "selected_recipe"
 
+# Session key the chat history was kept under before it moved to chat_store
+CHAT_HISTORY_KEY = "lea_chat_history"
+
 # Default system prompt (will be replaced by base_template)
 
+def get_conversation(session):
+    """
+    The session's conversation id. Settings left in the session cookie by
+    older versions are moved to the conversation store, and the old history
+    is dropped from the cookie.
+    """
+    conversation_id = chat_store.get_conversation_id(session)
+    session.pop(CHAT_HISTORY_KEY, None)
+    legacy = {key: session.pop(key) for key in (SYSTEM_PROMPT_KEY, RECIPE_TEMPLATE_KEY) if key in session}
+    legacy = {key: value for key, value in legacy.items() if isinstance(value, str)}
+    if legacy:
+        chat_store.set_settings(conversation_id, **legacy)
+    return conversation_id
+
+def chat_messages(stored):
+    """The stored messages that are part of the conversation (image previews are display-only)"""
+    return [msg for msg in stored if msg["role"] in ["user", "assistant"] and not msg.get("image")]
+
+def start_turn(session, user_message, model):
+    """
+    Records a user message and builds the API messages for the reply.
+
+    Returns:
+        dict: conversation_id, messages, user_msg, api_messages, window_start, summary,
+            truncated (older messages exist than were loaded)
+    """
+    # Get the recent chat history
+    conversation_id = get_conversation(session)
+    stored = chat_store.load_messages(conversation_id, limit=chat_context.CONTEXT_MAX_MESSAGES)
+    messages = chat_messages(stored)
+    
+    # Add user message, storing its token count with it
+    user_msg = {
+        "role": "user",
+        "content": user_message,
+        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "show_avatar": True
+    }
+    chat_context.message_tokens(user_msg, model)
+    messages.append(user_msg)
+    chat_store.append_messages(conversation_id, user_msg)
+    
+    # Prepare API request format: system prompt, summary of older turns and
+    # the most recent turns within the token budget
+    system_prompt = chat_store.get_setting(conversation_id, SYSTEM_PROMPT_KEY, "")
+    summary = chat_store.get_setting(conversation_id, "summary") if chat_context.CONTEXT_SUMMARY else None
+    api_messages, window_start = chat_context.build_context(system_prompt, messages, model, summary=summary)
+    
+    return {
+        "conversation_id": conversation_id,
+        "messages": messages,
+        "user_msg": user_msg,
+        "api_messages": api_messages,
+        "window_start": window_start,
+        "summary": summary,
+        "truncated": len(stored) >= chat_context.CONTEXT_MAX_MESSAGES
+    }
+
+def finish_turn(turn, assistant_response, model, client, **fields):
+    """
+    Stores the assistant's reply and folds turns that have left the context
+    window into the cached summary, a batch at a time (skipped without a client).
+
+    Returns:
+        dict: The stored assistant message
+    """
+    conversation_id = turn["conversation_id"]
+    assistant_msg = {
+        "role": "assistant",
+        "content": assistant_response,
+        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "show_avatar": True,
+        **fields
+    }
+    chat_context.message_tokens(assistant_msg, model)
+    chat_store.append_messages(conversation_id, assistant_msg)
+    
+    if client is not None and chat_context.CONTEXT_SUMMARY and (turn["window_start"] > 0 or turn["truncated"]):
+        messages, window_start = turn["messages"], turn["window_start"]
+        if turn["truncated"]:
+            # Turns older than the loaded history have left the window too:
+            # find them in the full history (less this reply, just appended)
+            messages = chat_messages(chat_store.load_messages(conversation_id))[:-1]
+            window_start = max(0, len(messages) - (len(turn["messages"]) - turn["window_start"]))
+        pending = chat_context.pending_summary(
+            messages, window_start, chat_store.get_setting(conversation_id, "summary_through")
+        )
+        if len(pending) >= chat_context.CONTEXT_SUMMARY_BATCH:
+            try:
+                chat_store.set_settings(
+                    conversation_id,
+                    summary=chat_context.summarize(client, turn["summary"], pending),
+                    summary_through=chat_context.message_key(pending[-1])
+                )
+            except Exception as e:
+                print(f"Error summarizing chat history: {str(e)}")
+    return assistant_msg
+
+def sse_event(event, data):
+    """One server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 def routes(rt):
     @rt('/menuE')
     def get(req, session):
         """Render the main chatbot interface with recipe templates"""
         api_key = os.environ.get("OPENAI_API_KEY", "")
         
-        # Store system prompt in session if not already set
-        if SYSTEM_PROMPT_KEY not in session:
-           session[SYSTEM_PROMPT_KEY] = base_template
+        # Store system prompt for the conversation if not already set
+        conversation_id = get_conversation(session)
+        if chat_store.get_setting(conversation_id, SYSTEM_PROMPT_KEY) is None:
+           chat_store.set_settings(conversation_id, **{SYSTEM_PROMPT_KEY: base_template})
         
         # Create recipe templates dictionary
         recipe_templates = {
@@ -73,9 +184,6 @@ def routes(rt):
             "recipe_8": recipe_template_8
         }
         
-        # Store recipe templates in session for later use
-        session[RECIPE_TEMPLATE_KEY] = recipe_templates
-        
 # Import the carousel component
         from components.lea_form import create_recipe_carousel
         
@@ -179,8 +287,9 @@ def routes(rt):
     
     @rt('/api/lea/get-messages')
     def get(session):
-        """Get existing chat messages from session"""
-        messages = session.get(CHAT_HISTORY_KEY, [])
+        """Get existing chat messages from the conversation store"""
+        conversation_id = get_conversation(session)
+        messages = chat_store.load_messages(conversation_id)
         
         # If no messages exist, add a welcome message
         if not messages:
@@ -191,7 +300,7 @@ def routes(rt):
                 "show_avatar": True
             }
             messages = [welcome_message]
-            session[CHAT_HISTORY_KEY] = messages
+            chat_store.append_messages(conversation_id, welcome_message)
         
         # Return rendered message components
         return Div(*[ChatMessage(msg) for msg in messages])
@@ -199,8 +308,8 @@ def routes(rt):
     @rt('/api/lea/clear-chat')
     def post(session):
         """Clear chat history"""
-        if CHAT_HISTORY_KEY in session:
-            del session[CHAT_HISTORY_KEY]
+        conversation_id = get_conversation(session)
+        chat_store.clear_messages(conversation_id)
         
         # Return welcome message
         welcome_message = {
@@ -209,7 +318,7 @@ def routes(rt):
             "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "show_avatar": True
         }
-        session[CHAT_HISTORY_KEY] = [welcome_message]
+        chat_store.append_messages(conversation_id, welcome_message)
         
         return ChatMessage(welcome_message)
     
@@ -231,50 +340,27 @@ def routes(rt):
                 cls="error-message"
             )
         
-        # Get chat history or initialize if empty
-        messages = session.get(CHAT_HISTORY_KEY, [])
-        
-        # Add user message
-        user_msg = {
-            "role": "user",
-            "content": user_message,
-            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "show_avatar": True
-        }
-        messages.append(user_msg)
-        session[CHAT_HISTORY_KEY] = messages
-        
-        # Prepare API request format
-        api_messages = [{"role": "system", "content": session[SYSTEM_PROMPT_KEY]}]
+        turn = start_turn(session, user_message, model)
+        user_msg = turn["user_msg"]
         #assistant_messages = [{"role": "assistant", "content": session["recipe_template"]}]
-        for msg in messages:
-            if msg["role"] in ["user", "assistant"]:
-                api_messages.append({"role": msg["role"], "content": msg["content"]})
         
         try:
             # Call OpenAI API using the specified model
-            from openai import OpenAI
-            client = OpenAI(api_key=api_key)
+            client = llm_clients.get_async_openai(api_key)
             
-            response = client.chat.completions.create(
+            response = await client.chat.completions.create(
                 model=model,
-                messages=api_messages,
+                messages=turn["api_messages"],
                 temperature=0.7,
                 max_tokens=1000,
             )
             
-            # Extract response content
-            assistant_response = response.choices[0].message.content.strip()
-            
-            # Add assistant message to history
-            assistant_msg = {
-                "role": "assistant",
-                "content": assistant_response,
-                "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "show_avatar": True
-            }
-            messages.append(assistant_msg)
-            session[CHAT_HISTORY_KEY] = messages
+            # Extract response content and add it to history
+            # Off the event loop: the summary update is a blocking API call
+            summary_client = llm_clients.get_openai(api_key) if chat_context.CONTEXT_SUMMARY else None
+            assistant_msg = await asyncio.to_thread(
+                finish_turn, turn, response.choices[0].message.content.strip(), model, summary_client
+            )
             
             # Return just the latest message pair to append to the chat
             return Div(
@@ -297,8 +383,7 @@ def routes(rt):
                 "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "show_avatar": True
             }
-            messages.append(error_msg)
-            session[CHAT_HISTORY_KEY] = messages
+            chat_store.append_messages(turn["conversation_id"], error_msg)
             
             return Div(
                 ChatMessage(user_msg),
@@ -310,6 +395,101 @@ def routes(rt):
                 """)
             )
     
+    @rt('/api/lea/stream-message')
+    async def post(req, session):
+        """
+        Process user message and stream the AI response as server-sent events:
+        start (the user message and an empty reply bubble), delta (reply text)
+        and done (the final reply). The upstream request is closed if the
+        client goes away, and the reply is stored when the stream ends.
+        """
+        form = await req.form()
+        user_message = form.get("message", "").strip()
+        model = form.get("model", "gpt-4o")
+        api_key = form.get("api_key") or os.environ.get("OPENAI_API_KEY", "")
+        
+        # Validate inputs
+        if not user_message:
+            return Div("Please enter a message", cls="error-message")
+        
+        if not api_key:
+            return Div(
+                "OpenAI API key is required. Please set it in the environment variables or provide it in the form.",
+                cls="error-message"
+            )
+        
+        turn = start_turn(session, user_message, model)
+        stream_id = os.urandom(6).hex()
+        placeholder = {
+            "role": "assistant",
+            "content": "",
+            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "show_avatar": True
+        }
+        
+        async def events():
+            yield sse_event("start", {
+                "id": stream_id,
+                "html": to_xml(Div(ChatMessage(turn["user_msg"]), Div(ChatMessage(placeholder), id=f"lea-stream-{stream_id}")))
+            })
+            
+            parts = []
+            stream = None
+            completed = False
+            try:
+                client = llm_clients.get_async_openai(api_key)
+                stream = await client.chat.completions.create(
+                    model=model,
+                    messages=turn["api_messages"],
+                    temperature=0.7,
+                    max_tokens=1000,
+                    stream=True,
+                )
+                last_check = time.monotonic()
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield sse_event("delta", delta)
+                    # Stop generating (and paying for) tokens nobody will read
+                    if time.monotonic() - last_check > 0.25:
+                        last_check = time.monotonic()
+                        if await req.is_disconnected():
+                            print(f"LEA stream {stream_id} cancelled by the client")
+                            return
+                completed = True
+            except Exception as e:
+                error_msg = {
+                    "role": "assistant",
+                    "content": f"Error: {str(e)}. Please try again or check your API key.",
+                    "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "show_avatar": True
+                }
+                chat_store.append_messages(turn["conversation_id"], error_msg)
+                parts = []
+                yield sse_event("done", {"html": to_xml(ChatMessage(error_msg))})
+                return
+            finally:
+                if not completed and parts:
+                    # Keep what the user already saw of an interrupted reply
+                    finish_turn(turn, "".join(parts).strip(), model, None, interrupted=True)
+                if stream is not None:
+                    # Closing the response stops the generation upstream
+                    try:
+                        await stream.close()
+                    except Exception as e:
+                        print(f"Error closing LEA stream {stream_id}: {str(e)}")
+            
+            summary_client = llm_clients.get_openai(api_key) if chat_context.CONTEXT_SUMMARY else None
+            assistant_msg = await asyncio.to_thread(finish_turn, turn, "".join(parts).strip(), model, summary_client)
+            yield sse_event("done", {"html": to_xml(ChatMessage(assistant_msg))})
+        
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
     @rt('/api/lea/upload-form')
     def get():
         """Show the image upload form"""
@@ -368,17 +548,13 @@ def routes(rt):
             return Div("No image uploaded", cls="error-message")
         
         try:
-            # Read image content
+            # Read the upload and prepare it for the vision model in memory:
+            # decoded once, downsized and encoded once for both the preview and the API
             content = await uploaded_file.read()
             filename = uploaded_file.filename
+            image_data, content_type = await asyncio.to_thread(chat_images.prepare_image, content, filename)
             
-            # Create a temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.' + filename.split('.')[-1]) as temp_file:
-                temp_path = temp_file.name
-                temp_file.write(content)
-            
-            # Get chat history
-            messages = session.get(CHAT_HISTORY_KEY, [])
+            conversation_id = get_conversation(session)
             
             # Add user message about the image
             user_msg = {
@@ -387,34 +563,29 @@ def routes(rt):
                 "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "show_avatar": True
             }
-            messages.append(user_msg)
             
-            # Add image preview to chat
+            # Add image preview to chat: the image is stored once by content hash and shown by URL
             img_preview_msg = {
                 "role": "user",
-                "content": f'<img src="data:image/{filename.split(".")[-1]};base64,{base64.b64encode(content).decode()}" alt="Uploaded image" style="max-width: 100%; max-height: 300px;">',
+                "content": "",
+                "image": chat_store.put_image(image_data, content_type),
                 "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "show_avatar": False
             }
-            messages.append(img_preview_msg)
-            session[CHAT_HISTORY_KEY] = messages
+            chat_store.append_messages(conversation_id, user_msg, img_preview_msg)
             
             # Call OpenAI API with vision capabilities
-            from openai import OpenAI
-            client = OpenAI(api_key=api_key)
-            
-            # Prepare base64 encoded image
-            with open(temp_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+            client = llm_clients.get_async_openai(api_key)
+            base64_image = base64.b64encode(image_data).decode('ascii')
             
             # Use vision model
-            response = client.chat.completions.create(
+            response = await client.chat.completions.create(
                 model="gpt-4o",  # Using GPT-4o which has vision capabilities
                 messages=[
                     {"role": "system", "content": "You are an AI assistant that can analyze images. Provide insights about the uploaded image."},
                     {"role": "user", "content": [
                         {"type": "text", "text": "Please analyze this image and describe what you see."},
-                        {"type": "image_url", "image_url": {"url": f"data:image/{filename.split('.')[-1]};base64,{base64_image}"}}
+                        {"type": "image_url", "image_url": {"url": f"data:{content_type};base64,{base64_image}"}}
                     ]}
                 ],
                 max_tokens=1000
@@ -430,11 +601,7 @@ def routes(rt):
                 "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "show_avatar": True
             }
-            messages.append(assistant_msg)
-            session[CHAT_HISTORY_KEY] = messages
-            
-            # Clean up the temporary file
-            os.unlink(temp_path)
+            chat_store.append_messages(conversation_id, assistant_msg)
             
             # Return the latest message sequence to append to the chat
             return Div(
@@ -462,10 +629,7 @@ def routes(rt):
                 "show_avatar": True
             }
             
-            if CHAT_HISTORY_KEY in session:
-                messages = session[CHAT_HISTORY_KEY]
-                messages.append(error_msg)
-                session[CHAT_HISTORY_KEY] = messages
+            chat_store.append_messages(get_conversation(session), error_msg)
             
             return Div(
                 ChatMessage(error_msg),
@@ -495,9 +659,11 @@ def routes(rt):
         # Always start with the base template
         new_system_prompt = f"{base_template}\n\n{selected_recipe}"
         
-        # Store in session
-        session[SYSTEM_PROMPT_KEY] = new_system_prompt
-        session[RECIPE_TEMPLATE_KEY] = selected_recipe
+        # Store with the conversation
+        chat_store.set_settings(get_conversation(session), **{
+            SYSTEM_PROMPT_KEY: new_system_prompt,
+            RECIPE_TEMPLATE_KEY: selected_recipe
+        })
         
         # Return confirmation
         return Div(
@@ -509,7 +675,7 @@ def routes(rt):
     @rt('/api/lea/reset-prompt')
     def post(session):
         """Reset the system prompt to just the base template"""
-        session[SYSTEM_PROMPT_KEY] = base_template
+        chat_store.set_settings(get_conversation(session), **{SYSTEM_PROMPT_KEY: base_template})
         
         return Div(
             P("System prompt reset to base template only", cls="text-green-500"),
@@ -520,7 +686,7 @@ def routes(rt):
     @rt('/api/lea/get-current-prompt')
     def get(session):
         """Get the current system prompt"""
-        current_prompt = session.get(SYSTEM_PROMPT_KEY, base_template)
+        current_prompt = chat_store.get_setting(get_conversation(session), SYSTEM_PROMPT_KEY) or base_template
         
         return Div(
             Pre(current_prompt, cls="p-2 bg-gray-800 rounded text-sm max-h-40 overflow-y-auto"),
@@ -532,6 +698,24 @@ def routes(rt):
             hx_swap_oob="true",
             id="current-prompt-display"
         )
+    
+    @rt('/api/lea/image/{digest}')
+    def get(digest: str):
+        """Serve an uploaded chat image by its content hash"""
+        image = chat_store.get_image(digest)
+        if image is None:
+            return Response("Image not found", status_code=404)
+        data, content_type = image
+        headers = {
+            "Cache-Control": "private, max-age=31536000, immutable",
+            "X-Content-Type-Options": "nosniff",
+            "Content-Security-Policy": "sandbox"
+        }
+        if content_type not in chat_images.VISION_CONTENT_TYPES:
+            # Stored before uploads were limited to raster images: download only
+            content_type = "application/octet-stream"
+            headers["Content-Disposition"] = "attachment"
+        return Response(data, media_type=content_type, headers=headers)
 # def routes(rt):
 #     @rt('/menuE')
 #     def get(req):
@@ -1,7 +1,7 @@
 from fasthtml.common import *
 from components.gallery_upload_form import create_gallery_upload_form
-from components.gallery_submissions_grid import create_gallery_submissions_grid
-from routes.api import get_submissions_by_gallery_type
+from components.gallery_submissions_grid import create_gallery_submissions_grid, create_gallery_pager
+from routes.api import get_submissions_page, parse_gallery_page, GALLERY_PAGE_SIZE
 
 def routes(router):
     @router.get("/primary")
@@ -18,10 +18,10 @@ def routes(router):
         
     @router.get("/primary/math")
     def primary_math(req):
-        # Get submissions for primary school math
-        primary_submissions = get_submissions_by_gallery_type("primary")
-        # Filter further by subject (case-insensitive contains match)
-        math_submissions = [s for s in primary_submissions if "math" in s.get("subject", "").lower()]
+        # Get one page of submissions for primary school math, newest first
+        # Filtered by subject (case-insensitive contains match)
+        page = parse_gallery_page(req)
+        math_submissions, total = get_submissions_page("primary", keywords=["math"], offset=(page - 1) * GALLERY_PAGE_SIZE, limit=GALLERY_PAGE_SIZE)
         
         return Div(
             H3("Primary School Math Interactives"),
@@ -29,16 +29,17 @@ def routes(router):
             # Gallery submissions section
             H3("Community Submissions", style="font-size: 1.25rem; font-weight: bold; color: #4ade80; margin-top: 2rem; margin-bottom: 1rem;"),
             create_gallery_submissions_grid(math_submissions),
+            create_gallery_pager("/primary/math", page, total, GALLERY_PAGE_SIZE),
             
             cls="submenu-content-area"
         )
     
     @router.get("/primary/science")
     def primary_science(req):
-        # Get submissions for primary school science
-        primary_submissions = get_submissions_by_gallery_type("primary")
-        # Filter further by subject (case-insensitive contains match)
-        science_submissions = [s for s in primary_submissions if "science" in s.get("subject", "").lower()]
+        # Get one page of submissions for primary school science, newest first
+        # Filtered by subject (case-insensitive contains match)
+        page = parse_gallery_page(req)
+        science_submissions, total = get_submissions_page("primary", keywords=["science"], offset=(page - 1) * GALLERY_PAGE_SIZE, limit=GALLERY_PAGE_SIZE)
         
         return Div(
             H3("Primary School Science Interactives"),
@@ -46,20 +47,18 @@ def routes(router):
             # Gallery submissions section
             H3("Community Submissions", style="font-size: 1.25rem; font-weight: bold; color: #4ade80; margin-top: 2rem; margin-bottom: 1rem;"),
             create_gallery_submissions_grid(science_submissions),
+            create_gallery_pager("/primary/science", page, total, GALLERY_PAGE_SIZE),
             
             cls="submenu-content-area"
         )
     
     @router.get("/primary/languages")
     def primary_languages(req):
-        # Get submissions for primary school languages
-        primary_submissions = get_submissions_by_gallery_type("primary")
-        # Filter further by subject (case-insensitive contains match for language-related subjects)
+        # Get one page of submissions for primary school languages, newest first
+        # Filtered by subject (case-insensitive contains match for language-related subjects)
         language_keywords = ["english", "chinese", "malay", "tamil", "language"]
-        language_submissions = [
-            s for s in primary_submissions 
-            if any(keyword in s.get("subject", "").lower() for keyword in language_keywords)
-        ]
+        page = parse_gallery_page(req)
+        language_submissions, total = get_submissions_page("primary", keywords=language_keywords, offset=(page - 1) * GALLERY_PAGE_SIZE, limit=GALLERY_PAGE_SIZE)
         
         return Div(
             H3("Primary School Languages Interactives"),
@@ -67,6 +66,7 @@ def routes(router):
             # Gallery submissions section
             H3("Community Submissions", style="font-size: 1.25rem; font-weight: bold; color: #4ade80; margin-top: 2rem; margin-bottom: 1rem;"),
             create_gallery_submissions_grid(language_submissions),
+            create_gallery_pager("/primary/languages", page, total, GALLERY_PAGE_SIZE),
             
             cls="submenu-content-area"
         ) 
\ No newline at end of file
@@ -1,7 +1,7 @@
 from fasthtml.common import *
 from components.gallery_upload_form import create_gallery_upload_form
-from components.gallery_submissions_grid import create_gallery_submissions_grid
-from routes.api import get_submissions_by_gallery_type
+from components.gallery_submissions_grid import create_gallery_submissions_grid, create_gallery_pager
+from routes.api import get_submissions_page, parse_gallery_page, GALLERY_PAGE_SIZE
 
 def routes(router):
     @router.get("/secondary")
@@ -18,14 +18,11 @@ def routes(router):
         
     @router.get("/secondary/math")
     def secondary_math(req):
-        # Get submissions for secondary school math
-        secondary_submissions = get_submissions_by_gallery_type("secondary")
-        # Filter further by subject (case-insensitive contains match)
+        # Get one page of submissions for secondary school math, newest first
+        # Filtered by subject (case-insensitive contains match)
         math_keywords = ["math", "algebra", "geometry", "trigonometry", "statistics"]
-        math_submissions = [
-            s for s in secondary_submissions 
-            if any(keyword in s.get("subject", "").lower() for keyword in math_keywords)
-        ]
+        page = parse_gallery_page(req)
+        math_submissions, total = get_submissions_page("secondary", keywords=math_keywords, offset=(page - 1) * GALLERY_PAGE_SIZE, limit=GALLERY_PAGE_SIZE)
         
         return Div(
             H3("Secondary School Math Interactives"),
@@ -33,20 +30,18 @@ def routes(router):
             # Gallery submissions section
             H3("Community Submissions", style="font-size: 1.25rem; font-weight: bold; color: #4ade80; margin-top: 2rem; margin-bottom: 1rem;"),
             create_gallery_submissions_grid(math_submissions),
+            create_gallery_pager("/secondary/math", page, total, GALLERY_PAGE_SIZE),
             
             cls="submenu-content-area"
         )
     
     @router.get("/secondary/science")
     def secondary_science(req):
-        # Get submissions for secondary school science
-        secondary_submissions = get_submissions_by_gallery_type("secondary")
-        # Filter further by subject (case-insensitive contains match)
+        # Get one page of submissions for secondary school science, newest first
+        # Filtered by subject (case-insensitive contains match)
         science_keywords = ["science", "physics", "chemistry", "biology"]
-        science_submissions = [
-            s for s in secondary_submissions 
-            if any(keyword in s.get("subject", "").lower() for keyword in science_keywords)
-        ]
+        page = parse_gallery_page(req)
+        science_submissions, total = get_submissions_page("secondary", keywords=science_keywords, offset=(page - 1) * GALLERY_PAGE_SIZE, limit=GALLERY_PAGE_SIZE)
         
         return Div(
             H3("Secondary School Science Interactives"),
@@ -54,20 +49,18 @@ def routes(router):
             # Gallery submissions section
             H3("Community Submissions", style="font-size: 1.25rem; font-weight: bold; color: #4ade80; margin-top: 2rem; margin-bottom: 1rem;"),
             create_gallery_submissions_grid(science_submissions),
+            create_gallery_pager("/secondary/science", page, total, GALLERY_PAGE_SIZE),
             
             cls="submenu-content-area"
         )
     
     @router.get("/secondary/humanities")
     def secondary_humanities(req):
-        # Get submissions for secondary school humanities
-        secondary_submissions = get_submissions_by_gallery_type("secondary")
-        # Filter further by subject (case-insensitive contains match)
+        # Get one page of submissions for secondary school humanities, newest first
+        # Filtered by subject (case-insensitive contains match)
         humanities_keywords = ["history", "geography", "social studies", "humanities"]
-        humanities_submissions = [
-            s for s in secondary_submissions 
-            if any(keyword in s.get("subject", "").lower() for keyword in humanities_keywords)
-        ]
+        page = parse_gallery_page(req)
+        humanities_submissions, total = get_submissions_page("secondary", keywords=humanities_keywords, offset=(page - 1) * GALLERY_PAGE_SIZE, limit=GALLERY_PAGE_SIZE)
         
         return Div(
             H3("Secondary School Humanities Interactives"),
@@ -75,20 +68,18 @@ def routes(router):
             # Gallery submissions section
             H3("Community Submissions", style="font-size: 1.25rem; font-weight: bold; color: #4ade80; margin-top: 2rem; margin-bottom: 1rem;"),
             create_gallery_submissions_grid(humanities_submissions),
+            create_gallery_pager("/secondary/humanities", page, total, GALLERY_PAGE_SIZE),
             
             cls="submenu-content-area"
         )
         
     @router.get("/secondary/craft_tech")
     def secondary_craft_tech(req):
-        # Get submissions for secondary school craft & tech
-        secondary_submissions = get_submissions_by_gallery_type("secondary")
-        # Filter further by subject (case-insensitive contains match)
+        # Get one page of submissions for secondary school craft & tech, newest first
+        # Filtered by subject (case-insensitive contains match)
         tech_keywords = ["design", "technology", "computing", "food", "consumer"]
-        tech_submissions = [
-            s for s in secondary_submissions 
-            if any(keyword in s.get("subject", "").lower() for keyword in tech_keywords)
-        ]
+        page = parse_gallery_page(req)
+        tech_submissions, total = get_submissions_page("secondary", keywords=tech_keywords, offset=(page - 1) * GALLERY_PAGE_SIZE, limit=GALLERY_PAGE_SIZE)
         
         return Div(
             H3("Secondary School Craft & Technology Interactives"),
@@ -96,20 +87,18 @@ def routes(router):
             # Gallery submissions section
             H3("Community Submissions", style="font-size: 1.25rem; font-weight: bold; color: #4ade80; margin-top: 2rem; margin-bottom: 1rem;"),
             create_gallery_submissions_grid(tech_submissions),
+            create_gallery_pager("/secondary/craft_tech", page, total, GALLERY_PAGE_SIZE),
             
             cls="submenu-content-area"
         )
     
     @router.get("/secondary/languages")
     def secondary_languages(req):
-        # Get submissions for secondary school languages
-        secondary_submissions = get_submissions_by_gallery_type("secondary")
-        # Filter further by subject (case-insensitive contains match)
+        # Get one page of submissions for secondary school languages, newest first
+        # Filtered by subject (case-insensitive contains match)
         language_keywords = ["english", "chinese", "malay", "tamil", "language", "literature"]
-        language_submissions = [
-            s for s in secondary_submissions 
-            if any(keyword in s.get("subject", "").lower() for keyword in language_keywords)
-        ]
+        page = parse_gallery_page(req)
+        language_submissions, total = get_submissions_page("secondary", keywords=language_keywords, offset=(page - 1) * GALLERY_PAGE_SIZE, limit=GALLERY_PAGE_SIZE)
         
         return Div(
             H3("Secondary School Languages Interactives"),
@@ -117,6 +106,7 @@ def routes(router):
             # Gallery submissions section
             H3("Community Submissions", style="font-size: 1.25rem; font-weight: bold; color: #4ade80; margin-top: 2rem; margin-bottom: 1rem;"),
             create_gallery_submissions_grid(language_submissions),
+            create_gallery_pager("/secondary/languages", page, total, GALLERY_PAGE_SIZE),
             
             cls="submenu-content-area"
         ) 
\ No newline at end of file
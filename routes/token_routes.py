@@ -7,7 +7,136 @@ from components.token_form import (
     create_token_history_table,
     create_user_token_stats
 )
-from starlette.responses import RedirectResponse
+from starlette.responses import RedirectResponse, StreamingResponse
+import csv
+import io
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Export format -> (media type, file extension)
+EXPORT_FORMATS = {
+    'csv': ("text/csv", "csv"),
+    'csv.gz': ("application/gzip", "csv.gz"),
+    'parquet': ("application/vnd.apache.parquet", "parquet"),
+}
+
+# Formats offered in the download form: Parquet only when pyarrow is installed
+AVAILABLE_EXPORT_FORMATS = tuple(
+    export_format for export_format in EXPORT_FORMATS if export_format != 'parquet' or pq is not None
+)
+
+# Rows per chunk sent to the client (and per Parquet row group)
+EXPORT_CHUNK_ROWS = 5000
+
+EXPORT_HEADER = [
+    'Timestamp', 'Username', 'Model', 
+    'Prompt Tokens', 'Completion Tokens', 'Total Tokens',
+    'Generation Time (ms)', 'Prompt'
+]
+
+def parse_export_date(value):
+    """Parse an optional YYYY-MM-DD query parameter"""
+    if not value:
+        return None
+    return datetime.date.fromisoformat(value)
+
+def export_row(item):
+    """Flatten a token usage record into export column order"""
+    # Format timestamp if it's a datetime object
+    timestamp = item.get('timestamp', '')
+    if hasattr(timestamp, 'isoformat'):
+        timestamp = timestamp.isoformat()
+    
+    return [
+        timestamp,
+        item.get('user_id', 'Anonymous'),
+        item.get('model', 'Unknown'),
+        item.get('prompt_tokens', 0),
+        item.get('completion_tokens', 0),
+        item.get('total_tokens', 0),
+        item.get('generation_time_ms', 0),
+        item.get('prompt', '')  # Include full prompt text
+    ]
+
+def stream_csv(rows):
+    """Yield CSV text in chunks of EXPORT_CHUNK_ROWS rows"""
+    output = io.StringIO()
+    csv_writer = csv.writer(output)
+    csv_writer.writerow(EXPORT_HEADER)
+    
+    for count, item in enumerate(rows, 1):
+        csv_writer.writerow(export_row(item))
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    
+    yield output.getvalue()
+
+def stream_gzip(chunks):
+    """Gzip a stream of text chunks"""
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+class ExportSink(io.RawIOBase):
+    """Write-only file that hands back what was written since the last drain, tracking the absolute offset Parquet needs"""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self.position
+    
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_parquet(rows):
+    """Yield a Parquet file, one row group per EXPORT_CHUNK_ROWS rows"""
+    schema = pa.schema([
+        ('timestamp', pa.string()),
+        ('user_id', pa.string()),
+        ('model', pa.string()),
+        ('prompt_tokens', pa.int64()),
+        ('completion_tokens', pa.int64()),
+        ('total_tokens', pa.int64()),
+        ('generation_time_ms', pa.float64()),
+        ('prompt', pa.string()),
+    ])
+    sink = ExportSink()
+    writer = pq.ParquetWriter(sink, schema)
+    
+    batch = []
+    for item in rows:
+        batch.append(export_row(item))
+        if len(batch) >= EXPORT_CHUNK_ROWS:
+            writer.write_table(pa.Table.from_pylist([dict(zip(schema.names, row)) for row in batch], schema=schema))
+            batch = []
+            yield sink.drain()
+    
+    if batch:
+        writer.write_table(pa.Table.from_pylist([dict(zip(schema.names, row)) for row in batch], schema=schema))
+    writer.close()
+    yield sink.drain()
 
 def routes(rt):
     @rt('/tokens')
@@ -27,7 +156,7 @@ def routes(rt):
         
         return Titled("Token Usage Statistics",
             Link(rel="stylesheet", href="/static/css/styles.css"),
-            create_token_usage_display()
+            create_token_usage_display(AVAILABLE_EXPORT_FORMATS)
         )
     
     @rt('/api/tokens/summary')
@@ -77,7 +206,7 @@ def routes(rt):
         if auth not in ['super_admin', 'joe']:
             return Div("Access denied", cls="error")
         
-        return create_token_usage_display()
+        return create_token_usage_display(AVAILABLE_EXPORT_FORMATS)
     
     @rt('/api/tokens/db-check')
     def get(req):
@@ -266,71 +395,43 @@ def routes(rt):
     
     @rt('/api/tokens/download-csv')
     def get(req):
-        """Download token usage data as CSV"""
+        """Download token usage data as CSV, gzipped CSV or Parquet"""
         # Check if user is authorized (must be super_admin or joe)
         auth = req.session.get('auth', None)
         if auth not in ['super_admin', 'joe']:
             return Div("Access denied", cls="error")
         
+        if token_count.connection_pool is None:
+            return Div("No data to export", cls="bg-yellow-100 p-4 rounded text-yellow-800")
+        
+        # Optional filters: ?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD&user_id=...&format=csv|csv.gz|parquet
         try:
-            # Get all token usage data
-            history = token_count.get_token_usage(limit=1000)  # Increased limit for CSV export
-            
-            if not history:
-                return Div("No data to export", cls="bg-yellow-100 p-4 rounded text-yellow-800")
-            
-            # Create CSV content
-            import csv
-            import io
-            
-            # Create a string IO buffer for CSV data
-            output = io.StringIO()
-            csv_writer = csv.writer(output)
-            
-            # Write header row
-            csv_writer.writerow([
-                'Timestamp', 'Username', 'Model', 
-                'Prompt Tokens', 'Completion Tokens', 'Total Tokens',
-                'Generation Time (ms)', 'Prompt'
-            ])
-            
-            # Write data rows
-            for item in history:
-                # Format timestamp if it's a datetime object
-                timestamp = item.get('timestamp', '')
-                if hasattr(timestamp, 'isoformat'):
-                    timestamp = timestamp.isoformat()
-                
-                csv_writer.writerow([
-                    timestamp,
-                    item.get('user_id', 'Anonymous'),
-                    item.get('model', 'Unknown'),
-                    item.get('prompt_tokens', 0),
-                    item.get('completion_tokens', 0),
-                    item.get('total_tokens', 0),
-                    item.get('generation_time_ms', 0),
-                    item.get('prompt', '')  # Include full prompt text
-                ])
-            
-            # Get CSV content as string
-            csv_content = output.getvalue()
-            
-            # Create a response with CSV content
-            from starlette.responses import Response
-            filename = f"token_usage_export_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            return Response(
-                content=csv_content,
-                media_type="text/csv",
-                headers={
-                    "Content-Disposition": f"attachment; filename={filename}"
-                }
-            )
-        except Exception as e:
-            import traceback
-            error_trace = traceback.format_exc()
-            return Div(
-                H3("CSV Export Failed", cls="text-red-600"),
-                P(f"Error: {str(e)}"),
-                Pre(error_trace, cls="bg-gray-100 p-2 text-xs overflow-auto"),
-                cls="bg-red-100 p-4 rounded"
-            ) 
\ No newline at end of file
+            start_date = parse_export_date(req.query_params.get('start_date'))
+            end_date = parse_export_date(req.query_params.get('end_date'))
+        except ValueError:
+            return Div("Invalid date, expected YYYY-MM-DD", cls="bg-red-100 p-4 rounded text-red-800")
+        user_id = req.query_params.get('user_id') or None
+        export_format = req.query_params.get('format', 'csv')
+        
+        if export_format not in EXPORT_FORMATS:
+            return Div(f"Unsupported export format: {export_format}", cls="bg-red-100 p-4 rounded text-red-800")
+        if export_format == 'parquet' and pq is None:
+            return Div("Parquet export requires pyarrow to be installed", cls="bg-red-100 p-4 rounded text-red-800")
+        
+        rows = token_count.iter_token_usage(start_date=start_date, end_date=end_date, user_id=user_id)
+        if export_format == 'parquet':
+            content = stream_parquet(rows)
+        elif export_format == 'csv.gz':
+            content = stream_gzip(stream_csv(rows))
+        else:
+            content = stream_csv(rows)
+        
+        media_type, extension = EXPORT_FORMATS[export_format]
+        filename = f"token_usage_export_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+        return StreamingResponse(
+            content,
+            media_type=media_type,
+            headers={
+                "Content-Disposition": f"attachment; filename={filename}"
+            }
+        )
@@ -0,0 +1,162 @@
+"""
+Local stand-in for the Vercel Blob API, for testing uploads without a Blob store.
+
+Implements the multipart endpoints blob_upload.py and static/js/blob_upload.js
+use (POST /mpu?pathname=... with x-mpu-action create/upload/complete), checks
+read-write and client tokens the same way, and serves stored blobs with GET so
+previews can download them.
+
+    BLOB_READ_WRITE_TOKEN=vercel_blob_rw_local_secret python scripts/blob_standin_server.py --port 3100
+
+Then run the app with the same BLOB_READ_WRITE_TOKEN and
+BLOB_API_URL=http://localhost:3100.
+"""
+import argparse
+import json
+import mimetypes
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import blob_upload
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, HEAD, POST, PUT, OPTIONS",
+    "Access-Control-Allow-Headers": "authorization, content-type, x-api-version, x-mpu-action, x-mpu-key, "
+                                    "x-mpu-upload-id, x-mpu-part-number, x-content-type, x-add-random-suffix",
+}
+
+
+class BlobStandIn(BaseHTTPRequestHandler):
+    token = None
+    root = None
+    uploads = {}
+    lock = threading.Lock()
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for name, value in CORS_HEADERS.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorize(self, pathname):
+        """Returns the token's claims ({} for the read-write token) or None"""
+        auth = self.headers.get("authorization", "")
+        if not auth.startswith("Bearer "):
+            return None
+        bearer = auth[len("Bearer "):]
+        if bearer == self.token:
+            return {}
+        claims = blob_upload.read_client_token(bearer, self.token)
+        if claims is None or claims.get("pathname") != pathname:
+            return None
+        return claims
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        for name, value in CORS_HEADERS.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_GET(self):
+        path = os.path.normpath(urlparse(self.path).path.lstrip('/'))
+        file_path = os.path.join(self.root, path)
+        if path.startswith('..') or not os.path.isfile(file_path):
+            return self._send_json(404, {"error": "not found"})
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", f'"{os.path.getmtime(file_path)}"')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        self.do_POST()
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        pathname = parse_qs(url.query).get("pathname", [""])[0]
+        if url.path != "/mpu" or not pathname:
+            return self._send_json(404, {"error": "unknown endpoint"})
+        claims = self._authorize(pathname)
+        if claims is None:
+            return self._send_json(403, {"error": "invalid token"})
+
+        body = self.rfile.read(int(self.headers.get("content-length") or 0))
+        action = self.headers.get("x-mpu-action")
+
+        if action == "create":
+            content_type = self.headers.get("x-content-type", "application/octet-stream")
+            allowed = claims.get("allowedContentTypes")
+            if allowed and not any(content_type == t or (t.endswith('/*') and content_type.startswith(t[:-1])) for t in allowed):
+                return self._send_json(400, {"error": f"content type {content_type} not allowed"})
+            upload_id = os.urandom(8).hex()
+            with self.lock:
+                self.uploads[upload_id] = {"pathname": pathname, "contentType": content_type, "parts": {}}
+            return self._send_json(200, {"key": pathname, "uploadId": upload_id})
+
+        upload = self.uploads.get(self.headers.get("x-mpu-upload-id", ""))
+        if upload is None or upload["pathname"] != pathname:
+            return self._send_json(404, {"error": "unknown upload"})
+
+        if action == "upload":
+            part_number = int(self.headers.get("x-mpu-part-number", "0"))
+            etag = os.urandom(6).hex()
+            with self.lock:
+                upload["parts"][part_number] = (etag, body)
+            return self._send_json(200, {"etag": etag})
+
+        if action == "complete":
+            parts = sorted(json.loads(body or b"[]"), key=lambda part: part["partNumber"])
+            if any(upload["parts"].get(part["partNumber"], (None,))[0] != part["etag"] for part in parts):
+                return self._send_json(400, {"error": "unknown part"})
+            data = b"".join(upload["parts"][part["partNumber"]][1] for part in parts)
+            maximum = claims.get("maximumSizeInBytes")
+            if maximum and len(data) > maximum:
+                return self._send_json(400, {"error": "file too large"})
+            file_path = os.path.join(self.root, pathname)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as f:
+                f.write(data)
+            with self.lock:
+                self.uploads.pop(self.headers.get("x-mpu-upload-id"), None)
+            host = self.headers.get("host", f"localhost:{self.server.server_port}")
+            return self._send_json(200, {
+                "url": f"http://{host}/{pathname}",
+                "downloadUrl": f"http://{host}/{pathname}?download=1",
+                "pathname": pathname,
+                "contentType": upload["contentType"],
+                "contentDisposition": f'inline; filename="{os.path.basename(pathname)}"',
+            })
+
+        return self._send_json(400, {"error": f"unknown action {action}"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=3100)
+    parser.add_argument("--root", default=os.path.join(tempfile.gettempdir(), "blob_standin"))
+    args = parser.parse_args()
+
+    BlobStandIn.token = os.environ.get("BLOB_READ_WRITE_TOKEN") or "vercel_blob_rw_local_secret"
+    BlobStandIn.root = args.root
+    os.makedirs(args.root, exist_ok=True)
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), BlobStandIn)
+    print(f"Blob stand-in serving {args.root} on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
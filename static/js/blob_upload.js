@@ -0,0 +1,74 @@
+// Uploads a File straight to blob storage in multipart chunks, using a
+// client token scoped to one pathname from /api/blob/upload-token.
+// Falls back to streaming through /api/blob/upload when direct uploads
+// are not configured. Resolves to the blob result ({url, pathname, ...}).
+async function uploadToBlob(file) {
+    const contentType = file.type || 'application/octet-stream';
+
+    let tokenResponse = null;
+    try {
+        tokenResponse = await fetch('/api/blob/upload-token', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size, contentType: contentType })
+        });
+    } catch (error) {
+        console.warn('Could not get an upload token, uploading through the server:', error);
+    }
+    if (tokenResponse && (tokenResponse.status === 413 || tokenResponse.status === 415)) {
+        const error = await tokenResponse.json();
+        throw new Error(error.error || 'File rejected');
+    }
+    const grant = tokenResponse && tokenResponse.ok ? await tokenResponse.json() : null;
+
+    if (!grant || !grant.clientToken) {
+        const response = await fetch('/api/blob/upload?filename=' + encodeURIComponent(file.name), {
+            method: 'POST',
+            headers: { 'Content-Type': contentType },
+            body: file
+        });
+        if (!response.ok) {
+            throw new Error('Failed to upload file');
+        }
+        return await response.json();
+    }
+
+    const url = grant.uploadUrl + '/mpu?pathname=' + encodeURIComponent(grant.pathname);
+    const headers = {
+        'authorization': 'Bearer ' + grant.clientToken,
+        'x-api-version': grant.apiVersion
+    };
+
+    async function blobApi(action, extraHeaders, body) {
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: Object.assign({ 'x-mpu-action': action }, headers, extraHeaders),
+            body: body
+        });
+        if (!response.ok) {
+            throw new Error('Blob upload ' + action + ' failed (' + response.status + ')');
+        }
+        return await response.json();
+    }
+
+    const created = await blobApi('create', {
+        'x-content-type': contentType,
+        'x-add-random-suffix': '0'
+    });
+    const uploadHeaders = {
+        'x-mpu-key': created.key,
+        'x-mpu-upload-id': created.uploadId
+    };
+
+    const parts = [];
+    const partCount = Math.max(1, Math.ceil(file.size / grant.chunkSize));
+    for (let i = 0; i < partCount; i++) {
+        const chunk = file.slice(i * grant.chunkSize, (i + 1) * grant.chunkSize);
+        const part = await blobApi('upload', Object.assign({ 'x-mpu-part-number': String(i + 1) }, uploadHeaders), chunk);
+        parts.push({ etag: part.etag, partNumber: i + 1 });
+    }
+
+    const result = await blobApi('complete', Object.assign({ 'content-type': 'application/json' }, uploadHeaders), JSON.stringify(parts));
+    result.size = file.size;
+    return result;
+}
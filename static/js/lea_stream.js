@@ -0,0 +1,94 @@
+// Sends a LEA chat message and shows the reply as it is generated.
+// /api/lea/stream-message answers with server-sent events: "start" (the
+// user message and an empty reply bubble), "delta" (reply text) and "done"
+// (the final reply). The request is aborted when the page is left, which
+// also stops the generation on the server.
+let leaStreamController = null;
+
+function leaParseEvent(raw) {
+    let event = 'message';
+    let data = '';
+    for (const line of raw.split('\n')) {
+        if (line.startsWith('event: ')) {
+            event = line.slice(7);
+        } else if (line.startsWith('data: ')) {
+            data += line.slice(6);
+        }
+    }
+    return { event: event, data: data ? JSON.parse(data) : null };
+}
+
+async function leaSendMessage(form) {
+    const input = form.querySelector('#user-message');
+    const chatlist = document.getElementById('chatlist');
+    const indicator = document.getElementById('typing-indicator');
+    if (!input.value.trim()) {
+        return;
+    }
+
+    if (leaStreamController) {
+        leaStreamController.abort();
+    }
+    const controller = new AbortController();
+    leaStreamController = controller;
+
+    const body = new FormData(form);
+    input.value = '';
+    indicator.classList.add('htmx-request');
+
+    let reply = null;
+    let bubble = null;
+    try {
+        const response = await fetch('/api/lea/stream-message', {
+            method: 'POST',
+            body: body,
+            signal: controller.signal
+        });
+        // Validation errors come back as plain HTML
+        if (!(response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+            chatlist.insertAdjacentHTML('beforeend', await response.text());
+            return;
+        }
+
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += value;
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const message = leaParseEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+                if (message.event === 'start') {
+                    chatlist.insertAdjacentHTML('beforeend', message.data.html);
+                    reply = document.getElementById('lea-stream-' + message.data.id);
+                    bubble = reply.querySelector('.chat-bubble');
+                    indicator.classList.remove('htmx-request');
+                } else if (message.event === 'delta' && bubble) {
+                    bubble.textContent += message.data;
+                } else if (message.event === 'done' && reply) {
+                    reply.outerHTML = message.data.html;
+                }
+                chatlist.scrollTop = chatlist.scrollHeight;
+            }
+        }
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('LEA stream failed:', error);
+        }
+    } finally {
+        indicator.classList.remove('htmx-request');
+        if (leaStreamController === controller) {
+            leaStreamController = null;
+        }
+    }
+}
+
+window.addEventListener('pagehide', function () {
+    if (leaStreamController) {
+        leaStreamController.abort();
+    }
+});
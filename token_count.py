@@ -1,8 +1,13 @@
 import os
 import datetime
 import json
+import queue
+import threading
+import time
+import uuid
+import psycopg2
 from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from dotenv import load_dotenv
 import atexit
 
@@ -12,22 +17,112 @@ load_dotenv()
 # Get the database connection string
 DB_URL = os.environ.get('DATABASE_URL')
 
-# Create a connection pool if DB_URL is available
+# Seconds between attempts to create the pool while the database is down
+DB_POOL_RETRY_INTERVAL = 30
+
+# Connection pool, created at import if the database is up and otherwise by
+# the writer thread once it is reachable
 connection_pool = None
-if DB_URL:
-    try:
-        connection_pool = pool.SimpleConnectionPool(
-            1,  # Minimum number of connections
-            10, # Maximum number of connections
-            DB_URL
-        )
-        print("PostgreSQL connection pool created successfully")
-    except Exception as e:
-        print(f"Warning: Unable to create database connection pool: {e}")
+_pool_lock = threading.Lock()
+_pool_last_attempt = None
+
+def _create_pool():
+    """
+    Create the connection pool if DB_URL is set and it doesn't exist yet,
+    at most once every DB_POOL_RETRY_INTERVAL seconds
+
+    Returns:
+        The pool, or None if the database is unavailable
+    """
+    global connection_pool, _pool_last_attempt
+    if connection_pool is not None or not DB_URL:
+        return connection_pool
+    
+    with _pool_lock:
+        if connection_pool is None and (_pool_last_attempt is None
+                                        or time.monotonic() - _pool_last_attempt >= DB_POOL_RETRY_INTERVAL):
+            _pool_last_attempt = time.monotonic()
+            try:
+                # Shared by the writer thread, the event loop and threadpool exports
+                connection_pool = pool.ThreadedConnectionPool(
+                    1,  # Minimum number of connections
+                    10, # Maximum number of connections
+                    DB_URL
+                )
+                print("PostgreSQL connection pool created successfully")
+            except Exception as e:
+                print(f"Warning: Unable to create database connection pool: {e}")
+    return connection_pool
+
+_create_pool()
+
+# Token usage rows are buffered and written in batches by a background thread,
+# flushed every TOKEN_USAGE_FLUSH_ROWS rows or TOKEN_USAGE_FLUSH_MS milliseconds
+TOKEN_USAGE_FLUSH_ROWS = int(os.environ.get('TOKEN_USAGE_FLUSH_ROWS', 500))
+TOKEN_USAGE_FLUSH_MS = int(os.environ.get('TOKEN_USAGE_FLUSH_MS', 1000))
+
+# Rows that couldn't be written while the database was down are spilled here
+# as JSON lines and replayed on the next successful flush
+TOKEN_USAGE_SPILL_FILE = os.environ.get('TOKEN_USAGE_SPILL_FILE', 'token_usage_spill.jsonl')
+
+# Rows the database rejects (bad data, not an outage) are set aside here
+# instead of being retried, so one bad row can't block every later batch
+TOKEN_USAGE_QUARANTINE_FILE = os.environ.get('TOKEN_USAGE_QUARANTINE_FILE', 'token_usage_quarantine.jsonl')
+
+# Errors that mean the database is unreachable rather than that a row is bad
+DATABASE_UNAVAILABLE_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError)
+
+TOKEN_USAGE_COLUMNS = ("timestamp", "model", "prompt", "prompt_tokens", "completion_tokens", "total_tokens", "user_id", "session_id", "generation_time_ms")
+
+# Daily aggregates maintained alongside token_usage so the dashboard never
+# has to scan the raw table: (table, key column, index into a usage row)
+TOKEN_USAGE_ROLLUPS = (
+    ("token_usage_daily_user", "user_id", 6),
+    ("token_usage_daily_model", "model", 1),
+)
+
+_db_initialized = False
+
+_usage_queue = queue.SimpleQueue()
+_writer_thread = None
+_writer_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_writer_stop = threading.Event()
+
+# Rough per-image prompt cost used for pre-flight estimates (vision models cap
+# a large image at roughly this many tokens)
+IMAGE_TOKEN_ESTIMATE = 1600
+
+# Lazily loaded tiktoken encoding for local token estimates (False once
+# loading it has failed, so the import isn't retried on every call)
+_encoding = None
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens in text locally, without an API round-trip.
+    Uses tiktoken's cl100k_base encoding; other providers' tokenizers differ
+    slightly, so treat the result as an estimate for budget checks only.
+    """
+    global _encoding
+    if not text:
+        return 0
+    
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"Warning: tiktoken unavailable, approximating token estimates: {e}")
+            _encoding = False
+    if _encoding is False:
+        # Fall back to the usual ~4 characters per token approximation
+        return len(text) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
 
 def init_db():
     """Initialize the token usage database in PostgreSQL"""
-    if connection_pool is None:
+    global _db_initialized
+    if connection_pool is None or _db_initialized:
         return
     
     try:
@@ -51,66 +146,302 @@ def init_db():
         )
         ''')
         
+        # Indexes for per-user and per-model lookups and the recent history list
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_token_usage_user_timestamp ON token_usage (user_id, timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_token_usage_model_timestamp ON token_usage (model, timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_token_usage_timestamp ON token_usage (timestamp)")
+        
+        # Daily rollup tables
+        for table, column, _ in TOKEN_USAGE_ROLLUPS:
+            cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                day DATE NOT NULL,
+                {column} TEXT NOT NULL,
+                requests BIGINT NOT NULL DEFAULT 0,
+                prompt_tokens BIGINT NOT NULL DEFAULT 0,
+                completion_tokens BIGINT NOT NULL DEFAULT 0,
+                total_tokens BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, {column})
+            )
+            ''')
+        
         conn.commit()
         
+        # Backfill the rollups the first time they're created over existing data
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM token_usage), EXISTS (SELECT 1 FROM token_usage_daily_user)")
+        has_usage, has_rollups = cursor.fetchone()
+        
         # Return the connection to the pool
         cursor.close()
         connection_pool.putconn(conn)
         
+        if has_usage and not has_rollups:
+            rebuild_token_rollups()
+        
+        _db_initialized = True
         print("Token usage table initialized in PostgreSQL")
     except Exception as e:
         print(f"Warning: Unable to initialize database: {e}")
 
 def record_token_usage(model, prompt, prompt_tokens, completion_tokens, total_tokens, user_id="anonymous", session_id=None, generation_time_ms=0):
-    """Record token usage to the PostgreSQL database or log it"""
-    # Create the record for logging or database storage
+    """
+    Queue token usage for the background writer (non-blocking).
+    Rows are inserted into PostgreSQL in batches (spilled to a file while it
+    is down), or logged when no database is configured.
+    """
     timestamp = datetime.datetime.now()
-    record = {
-        "timestamp": timestamp.isoformat(),
-        "model": model,
-        "prompt": prompt[:100] if prompt else None,  # Use shorter version for logging
-        "prompt_tokens": prompt_tokens,
-        "completion_tokens": completion_tokens,
-        "total_tokens": total_tokens,
-        "user_id": user_id,
-        "session_id": session_id,
-        "generation_time_ms": generation_time_ms
-    }
+    print(f"Token usage - User: {user_id}, Model: {model}, Prompt: {prompt_tokens}, Completion: {completion_tokens}, Total: {total_tokens}, Time: {generation_time_ms:.2f} ms")
+    
+    # If no database is configured, just log
+    if not DB_URL:
+        record = {
+            "timestamp": timestamp.isoformat(),
+            "model": model,
+            "prompt": prompt[:100] if prompt else None,  # Use shorter version for logging
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": total_tokens,
+            "user_id": user_id,
+            "session_id": session_id,
+            "generation_time_ms": generation_time_ms
+        }
+        print(f"Token usage: {json.dumps(record)}")
+        return
+    
+    _usage_queue.put((timestamp, model, prompt, prompt_tokens, completion_tokens, total_tokens, user_id, session_id, generation_time_ms))
+    _ensure_writer()
+
+def _ensure_writer():
+    """Start the background writer thread on first use"""
+    global _writer_thread
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return
+    
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_stop.clear()
+            _writer_thread = threading.Thread(target=_writer_loop, name="token-usage-writer", daemon=True)
+            _writer_thread.start()
+
+def _writer_loop():
+    """Collect queued rows and flush them every TOKEN_USAGE_FLUSH_ROWS rows or TOKEN_USAGE_FLUSH_MS milliseconds"""
+    while not _writer_stop.is_set():
+        try:
+            first = _usage_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        
+        batch = [first]
+        deadline = time.monotonic() + TOKEN_USAGE_FLUSH_MS / 1000
+        while len(batch) < TOKEN_USAGE_FLUSH_ROWS:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_usage_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        _write_batch(batch)
+
+def _drain_queue():
+    """Take every row currently queued"""
+    rows = []
+    while True:
+        try:
+            rows.append(_usage_queue.get_nowait())
+        except queue.Empty:
+            return rows
+
+def _write_batch(rows):
+    """Insert a batch of rows after replaying any spilled rows; spill the batch if the database is unavailable"""
+    with _flush_lock:
+        spilled = _read_spill_file()
+        if spilled:
+            unwritten = _insert_or_quarantine(spilled)
+            if unwritten:
+                # Still down: keep the rows in order behind the ones not yet replayed
+                print(f"Warning: Failed to record {len(unwritten) + len(rows)} token usage rows, spilling to {TOKEN_USAGE_SPILL_FILE}")
+                _write_rows_file(TOKEN_USAGE_SPILL_FILE, unwritten + rows, mode='w')
+                return
+            # Replayed, so the spill file can go
+            try:
+                os.remove(TOKEN_USAGE_SPILL_FILE)
+            except OSError:
+                pass
+            print(f"Replayed {len(spilled)} spilled token usage rows")
+        
+        unwritten = _insert_or_quarantine(rows)
+        if unwritten:
+            print(f"Warning: Failed to record {len(unwritten)} token usage rows, spilling to {TOKEN_USAGE_SPILL_FILE}")
+            _write_rows_file(TOKEN_USAGE_SPILL_FILE, unwritten)
+
+def _insert_or_quarantine(rows):
+    """
+    Insert rows, moving any the database rejects to the quarantine file
     
-    # Debug output
-    print(f"\n-----TOKEN USAGE RECORD-----")
-    print(f"User: {user_id}, Model: {model}")
-    print(f"Tokens - Prompt: {prompt_tokens}, Completion: {completion_tokens}, Total: {total_tokens}")
-    print(f"Generation Time: {generation_time_ms:.2f} ms ({generation_time_ms/1000:.2f} seconds)")
+    Returns:
+        list: Rows not written because the database is unavailable
+    """
+    try:
+        _insert_rows(rows)
+        return []
+    except DATABASE_UNAVAILABLE_ERRORS as e:
+        print(f"Warning: Token usage database unavailable: {e}")
+        return rows
+    except Exception as e:
+        if len(rows) == 1:
+            print(f"Warning: Quarantining a token usage row to {TOKEN_USAGE_QUARANTINE_FILE}: {e}")
+            _write_rows_file(TOKEN_USAGE_QUARANTINE_FILE, rows)
+            return []
     
-    # If no connection pool is available, just log
+    # Some row was rejected: write them one at a time to find it
+    for i, row in enumerate(rows):
+        if _insert_or_quarantine([row]):
+            return rows[i:]
+    return []
+
+def _insert_rows(rows):
+    """Insert rows into token_usage with a single multi-row INSERT"""
+    if not rows:
+        return
+    # Down at startup: retry, creating the table once it is reachable
+    if _create_pool() is None:
+        raise psycopg2.InterfaceError("Database connection unavailable")
+    init_db()
+    
+    conn = connection_pool.getconn()
+    try:
+        cursor = conn.cursor()
+        execute_values(
+            cursor,
+            f"INSERT INTO token_usage ({', '.join(TOKEN_USAGE_COLUMNS)}) VALUES %s",
+            rows,
+            page_size=TOKEN_USAGE_FLUSH_ROWS
+        )
+        _upsert_rollups(cursor, rows)
+        conn.commit()
+        cursor.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        connection_pool.putconn(conn)
+
+def _rollup_rows(rows):
+    """
+    Aggregate usage rows into daily rollup rows
+    
+    Returns:
+        dict: rollup table name -> list of (day, key, requests, prompt_tokens, completion_tokens, total_tokens)
+    """
+    rollups = {}
+    for table, _, key_index in TOKEN_USAGE_ROLLUPS:
+        totals = {}
+        for row in rows:
+            key = (row[0].date(), row[key_index] or "")
+            entry = totals.setdefault(key, [0, 0, 0, 0])
+            entry[0] += 1
+            entry[1] += row[3] or 0
+            entry[2] += row[4] or 0
+            entry[3] += row[5] or 0
+        rollups[table] = [(day, key, *entry) for (day, key), entry in totals.items()]
+    return rollups
+
+def _upsert_rollups(cursor, rows):
+    """Add a batch of usage rows to the daily rollup tables (same transaction as the insert)"""
+    rollups = _rollup_rows(rows)
+    for table, column, _ in TOKEN_USAGE_ROLLUPS:
+        execute_values(
+            cursor,
+            f'''
+            INSERT INTO {table} (day, {column}, requests, prompt_tokens, completion_tokens, total_tokens)
+            VALUES %s
+            ON CONFLICT (day, {column}) DO UPDATE SET
+                requests = {table}.requests + EXCLUDED.requests,
+                prompt_tokens = {table}.prompt_tokens + EXCLUDED.prompt_tokens,
+                completion_tokens = {table}.completion_tokens + EXCLUDED.completion_tokens,
+                total_tokens = {table}.total_tokens + EXCLUDED.total_tokens
+            ''',
+            rollups[table],
+            page_size=TOKEN_USAGE_FLUSH_ROWS
+        )
+
+def rebuild_token_rollups():
+    """Recompute the daily rollup tables from token_usage"""
     if connection_pool is None:
-        print(f"Token usage: {json.dumps(record)}")
         return
     
+    conn = connection_pool.getconn()
     try:
-        # Get a connection from the pool
-        conn = connection_pool.getconn()
         cursor = conn.cursor()
-        
-        # Insert token usage data
-        cursor.execute('''
-        INSERT INTO token_usage (timestamp, model, prompt, prompt_tokens, completion_tokens, total_tokens, user_id, session_id, generation_time_ms)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ''', (timestamp, model, prompt, prompt_tokens, completion_tokens, total_tokens, user_id, session_id, generation_time_ms))
-        
+        for table, column, _ in TOKEN_USAGE_ROLLUPS:
+            cursor.execute(f"TRUNCATE TABLE {table}")
+            cursor.execute(f'''
+            INSERT INTO {table} (day, {column}, requests, prompt_tokens, completion_tokens, total_tokens)
+            SELECT
+                timestamp::date,
+                COALESCE({column}, ''),
+                COUNT(*),
+                COALESCE(SUM(prompt_tokens), 0),
+                COALESCE(SUM(completion_tokens), 0),
+                COALESCE(SUM(total_tokens), 0)
+            FROM token_usage
+            WHERE timestamp IS NOT NULL
+            GROUP BY 1, 2
+            ''')
         conn.commit()
-        print(f"Successfully recorded token usage for user {user_id} with model {model}")
-        
-        # Return the connection to the pool
         cursor.close()
+        print("Rebuilt token usage rollup tables")
+    except Exception as e:
+        conn.rollback()
+        print(f"Warning: Failed to rebuild token usage rollups: {e}")
+    finally:
         connection_pool.putconn(conn)
+
+def _read_spill_file():
+    """Load rows previously spilled while the database was down"""
+    if not os.path.exists(TOKEN_USAGE_SPILL_FILE):
+        return []
+    
+    rows = []
+    try:
+        with open(TOKEN_USAGE_SPILL_FILE, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                row[0] = datetime.datetime.fromisoformat(row[0])
+                rows.append(tuple(row))
     except Exception as e:
-        print(f"Warning: Failed to record token usage: {e}")
-        import traceback
-        traceback.print_exc()
-        # Still log it to console as fallback
-        print(f"Token usage: {json.dumps(record)}")
+        print(f"Warning: Failed to read token usage spill file: {e}")
+    return rows
+
+def _write_rows_file(path, rows, mode='a'):
+    """Write rows to a spill or quarantine file as JSON lines (mode 'w' replaces it)"""
+    try:
+        tmp_path = f"{path}.tmp" if mode == 'w' else path
+        with open(tmp_path, mode) as f:
+            for row in rows:
+                f.write(json.dumps([row[0].isoformat(), *row[1:]]) + "\n")
+        if tmp_path != path:
+            os.replace(tmp_path, path)
+    except Exception as e:
+        # Last resort: keep the data in the logs
+        print(f"Warning: Failed to write token usage rows to {path}: {e}")
+        for row in rows:
+            print(f"Token usage: {json.dumps([row[0].isoformat(), *row[1:]])}")
+
+def flush_token_usage():
+    """Stop the background writer and write every pending row (called on shutdown)"""
+    _writer_stop.set()
+    if _writer_thread is not None and _writer_thread.is_alive():
+        _writer_thread.join(timeout=TOKEN_USAGE_FLUSH_MS / 1000 + 5)
+    
+    rows = _drain_queue()
+    if rows or os.path.exists(TOKEN_USAGE_SPILL_FILE):
+        print(f"Flushing {len(rows)} pending token usage rows")
+        _write_batch(rows)
 
 def get_token_usage(limit=100, user_id=None):
     """Get recent token usage data from PostgreSQL"""
@@ -146,6 +477,49 @@ def get_token_usage(limit=100, user_id=None):
         print(f"Warning: Failed to get token usage: {e}")
         return []
 
+def iter_token_usage(start_date=None, end_date=None, user_id=None, batch_size=10000):
+    """
+    Stream token usage records, oldest first, through a server-side cursor
+    
+    Args:
+        start_date (datetime.date): First day to include
+        end_date (datetime.date): Last day to include
+        user_id (str): Only include this user's records
+        batch_size (int): Rows fetched from the server per round-trip
+        
+    Yields:
+        dict: One token usage record at a time
+    """
+    if connection_pool is None:
+        return
+    
+    conditions = []
+    params = []
+    if start_date:
+        conditions.append("timestamp >= %s")
+        params.append(start_date)
+    if end_date:
+        conditions.append("timestamp < %s")
+        params.append(end_date + datetime.timedelta(days=1))
+    if user_id:
+        conditions.append("user_id = %s")
+        params.append(user_id)
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    conn = connection_pool.getconn()
+    try:
+        # A named cursor keeps the result set on the server and fetches itersize rows at a time
+        cursor = conn.cursor(name=f"token_usage_export_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+        cursor.itersize = batch_size
+        cursor.execute(f"SELECT * FROM token_usage {where_clause} ORDER BY timestamp", params)
+        for row in cursor:
+            yield row
+        cursor.close()
+    finally:
+        # Also reached when the client disconnects mid-export
+        conn.rollback()
+        connection_pool.putconn(conn)
+
 def get_token_usage_summary(user_id=None):
     """Get summary statistics of token usage from PostgreSQL"""
     empty_summary = {
@@ -179,11 +553,11 @@ def get_token_usage_summary(user_id=None):
         
         cursor.execute(f'''
         SELECT 
-            COUNT(*) as total_requests,
-            COALESCE(SUM(prompt_tokens), 0) as total_prompt_tokens,
-            COALESCE(SUM(completion_tokens), 0) as total_completion_tokens,
-            COALESCE(SUM(total_tokens), 0) as total_tokens
-        FROM token_usage
+            COALESCE(SUM(requests), 0)::BIGINT as total_requests,
+            COALESCE(SUM(prompt_tokens), 0)::BIGINT as total_prompt_tokens,
+            COALESCE(SUM(completion_tokens), 0)::BIGINT as total_completion_tokens,
+            COALESCE(SUM(total_tokens), 0)::BIGINT as total_tokens
+        FROM token_usage_daily_user
         {where_clause}
         ''', params)
         
@@ -195,14 +569,23 @@ def get_token_usage_summary(user_id=None):
             if summary[key] is None:
                 summary[key] = 0
         
-        # Get models used
-        cursor.execute(f'''
-        SELECT DISTINCT model, COUNT(*) as count
-        FROM token_usage
-        {where_clause}
-        GROUP BY model
-        ORDER BY count DESC
-        ''', params)
+        # Get models used (the model rollup has no user dimension, so a single
+        # user's breakdown comes from token_usage via the (user_id, timestamp) index)
+        if user_id:
+            cursor.execute('''
+            SELECT model, COUNT(*) as count
+            FROM token_usage
+            WHERE user_id = %s
+            GROUP BY model
+            ORDER BY count DESC
+            ''', params)
+        else:
+            cursor.execute('''
+            SELECT NULLIF(model, '') as model, SUM(requests)::BIGINT as count
+            FROM token_usage_daily_model
+            GROUP BY model
+            ORDER BY count DESC
+            ''')
         
         models = [{"model": row["model"], "count": row["count"]} for row in cursor.fetchall()]
         summary["models_used"] = models
@@ -233,12 +616,12 @@ def get_token_usage_by_user():
         
         cursor.execute('''
         SELECT 
-            user_id,
-            COUNT(*) as total_requests,
-            COALESCE(SUM(prompt_tokens), 0) as total_prompt_tokens,
-            COALESCE(SUM(completion_tokens), 0) as total_completion_tokens,
-            COALESCE(SUM(total_tokens), 0) as total_tokens
-        FROM token_usage
+            NULLIF(user_id, '') as user_id,
+            SUM(requests)::BIGINT as total_requests,
+            SUM(prompt_tokens)::BIGINT as total_prompt_tokens,
+            SUM(completion_tokens)::BIGINT as total_completion_tokens,
+            SUM(total_tokens)::BIGINT as total_tokens
+        FROM token_usage_daily_user
         GROUP BY user_id
         ORDER BY total_tokens DESC
         ''')
@@ -288,8 +671,8 @@ def reset_token_database():
         conn = connection_pool.getconn()
         cursor = conn.cursor()
         
-        # Truncate the token_usage table
-        cursor.execute("TRUNCATE TABLE token_usage")
+        # Truncate the token_usage table and its rollups
+        cursor.execute(f"TRUNCATE TABLE token_usage, {', '.join(table for table, _, _ in TOKEN_USAGE_ROLLUPS)}")
         conn.commit()
         
         # Return the connection to the pool
@@ -311,7 +694,10 @@ def reset_token_database():
 
 # Register a function to close all connections when the application shuts down
 def close_all_connections():
-    if connection_pool:
+    if DB_URL:
+        # Rows queued while the database was down still go to the spill file
+        flush_token_usage()
+    if connection_pool and not connection_pool.closed:
         print("Closing all database connections")
         connection_pool.closeall()
 
@@ -0,0 +1,453 @@
+import functools
+import hashlib
+import io
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+
+# On-disk store of extracted gallery ZIPs shared by every worker on the host.
+# Each archive is extracted once into a directory named after the SHA-256 of
+# its bytes:
+#   {ZIP_STORE_DIR}/{sha256}/manifest.json   relative paths and sizes
+#   {ZIP_STORE_DIR}/{sha256}/files/...       extracted content ("extract" mode)
+#   {ZIP_STORE_DIR}/{sha256}/archive.zip     the ZIP itself ("archive" mode)
+#   {ZIP_STORE_DIR}/refs/{key}               submission id -> sha256
+# In archive mode nothing is extracted: the manifest records where each
+# member's data starts in archive.zip, and members are streamed straight out
+# of a memory map of the archive (stored members as slices of the map,
+# deflated members through a streaming inflater).
+# Archives are extracted into a private staging directory and published with a
+# single rename, so readers never see a half-extracted tree. The manifest's
+# mtime is bumped on every access and the least recently used archives are
+# evicted once the store grows past ZIP_STORE_MAX_BYTES.
+ZIP_STORE_DIR = os.environ.get('ZIP_STORE_DIR', os.path.join(tempfile.gettempdir(), "gallery_zip_store"))
+ZIP_STORE_MAX_BYTES = int(os.environ.get('ZIP_STORE_MAX_BYTES', 1024 * 1024 * 1024))  # 1 GB
+ZIP_STORE_MODE = os.environ.get('ZIP_STORE_MODE', 'extract')  # "extract" or "archive"
+
+MANIFEST_NAME = "manifest.json"
+FILES_DIR = "files"
+ARCHIVE_NAME = "archive.zip"
+REFS_DIR = "refs"
+STAGING_PREFIX = ".staging-"
+TRASH_PREFIX = ".trash-"
+
+# Only touch the manifest if the last access is older than this, so busy
+# archives don't turn every asset request into a metadata write
+TOUCH_INTERVAL = 60  # seconds
+
+# Size of the slices streamed out of an archive
+MEMBER_CHUNK_SIZE = 64 * 1024
+
+# Size of a ZIP local file header before the file name and extra field
+LOCAL_HEADER = struct.Struct('<4s22xHH')
+
+
+def _ensure_root():
+    os.makedirs(os.path.join(ZIP_STORE_DIR, REFS_DIR), exist_ok=True)
+
+
+def _entry_dir(digest):
+    return os.path.join(ZIP_STORE_DIR, digest)
+
+
+def _ref_path(submission_id):
+    # Submission ids are user-controlled strings; hash them into a safe file name
+    key = hashlib.sha256(str(submission_id).encode('utf-8')).hexdigest()
+    return os.path.join(ZIP_STORE_DIR, REFS_DIR, key)
+
+
+@functools.lru_cache(maxsize=256)
+def _load_manifest(digest):
+    # Manifests never change once published, so each is parsed once per process
+    with open(os.path.join(_entry_dir(digest), MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if "index" not in manifest:
+        # Published before resolution indexes were added
+        manifest["index"] = build_index(manifest["files"])
+    return manifest
+
+
+def _read_manifest(digest):
+    if not os.path.exists(os.path.join(_entry_dir(digest), MANIFEST_NAME)):
+        return None
+    try:
+        return _load_manifest(digest)
+    except (OSError, ValueError):
+        return None
+
+
+def _touch(digest):
+    manifest_path = os.path.join(_entry_dir(digest), MANIFEST_NAME)
+    try:
+        if time.time() - os.path.getmtime(manifest_path) > TOUCH_INTERVAL:
+            os.utime(manifest_path)
+    except OSError:
+        pass
+
+
+def _remove_dir(path):
+    """Rename a directory out of the way, then delete it"""
+    trash = os.path.join(ZIP_STORE_DIR, f"{TRASH_PREFIX}{os.path.basename(path)}-{os.urandom(4).hex()}")
+    try:
+        os.rename(path, trash)
+    except OSError:
+        return False
+    shutil.rmtree(trash, ignore_errors=True)
+    return True
+
+
+def _members(zip_ref):
+    """Yields (relative_path, ZipInfo) for the files in an archive"""
+    for info in zip_ref.infolist():
+        if info.is_dir():
+            continue
+        # Normalise the member name and refuse anything that escapes the tree
+        rel_path = os.path.normpath(info.filename.replace('\\', '/')).replace(os.path.sep, '/')
+        if rel_path.startswith(('../', '/')) or rel_path in ('..', '.'):
+            continue
+        yield rel_path, info
+
+
+def _open_source(zip_source):
+    """Opens ZIP bytes or a path to a ZIP file as a binary file object"""
+    if isinstance(zip_source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(zip_source)
+    return open(zip_source, 'rb')
+
+
+def _digest(zip_source):
+    if isinstance(zip_source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(zip_source).hexdigest()
+    sha256 = hashlib.sha256()
+    with open(zip_source, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _extract(zip_source, staging_dir):
+    """Extracts zip_source into staging_dir/files and returns the manifest"""
+    files_root = os.path.join(staging_dir, FILES_DIR)
+    os.makedirs(files_root)
+    files = {}
+    total_size = 0
+    with _open_source(zip_source) as f, zipfile.ZipFile(f, 'r') as zip_ref:
+        for rel_path, info in _members(zip_ref):
+            target = os.path.join(files_root, *rel_path.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zip_ref.open(info) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            files[rel_path] = info.file_size
+            total_size += info.file_size
+    return {"mode": "extract", "size": total_size, "files": files}
+
+
+def _store_archive(zip_source, staging_dir):
+    """Writes zip_source to staging_dir/archive.zip and returns the manifest"""
+    files = {}
+    members = {}
+    with _open_source(zip_source) as f, zipfile.ZipFile(f, 'r') as zip_ref:
+        for rel_path, info in _members(zip_ref):
+            f.seek(info.header_offset)
+            signature, name_length, extra_length = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+            if signature != b'PK\x03\x04':
+                raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+            files[rel_path] = info.file_size
+            members[rel_path] = {
+                "name": info.filename,
+                "offset": info.header_offset + LOCAL_HEADER.size + name_length + extra_length,
+                "compress_size": info.compress_size,
+                "compress_type": info.compress_type,
+                "encrypted": bool(info.flag_bits & 0x1),
+                "crc": info.CRC,
+            }
+    archive_path = os.path.join(staging_dir, ARCHIVE_NAME)
+    if isinstance(zip_source, (bytes, bytearray, memoryview)):
+        with open(archive_path, 'wb') as f:
+            f.write(zip_source)
+    else:
+        try:
+            # Share the downloaded file's blocks when it is on the same filesystem
+            os.link(zip_source, archive_path)
+        except OSError:
+            shutil.copyfile(zip_source, archive_path)
+    return {"mode": "archive", "size": os.path.getsize(archive_path), "files": files, "members": members}
+
+
+def _normalize_path(path):
+    """Separator-normalised form of a relative path: forward slashes, no "." or "" segments"""
+    parts = [part for part in path.replace('\\', '/').split('/') if part not in ('', '.')]
+    return '/'.join(parts)
+
+
+def _preferred(paths):
+    # Ambiguity policy: the shallowest path wins, then the first in sorted order
+    return min(paths, key=lambda path: (path.count('/'), path))
+
+
+def build_index(files):
+    """
+    Builds the asset resolution index for a manifest's files.
+
+    Returns:
+        dict: Maps from a lookup key to the relative path it resolves to
+            - casefold: case-folded full path
+            - basename: file name
+            - basename_casefold: case-folded file name
+        When several files share a key the shallowest path wins, ties broken
+        by sorted order; exact paths always take precedence over these maps.
+    """
+    groups = {"casefold": {}, "basename": {}, "basename_casefold": {}}
+    for rel_path in files:
+        basename = rel_path.rsplit('/', 1)[-1]
+        groups["casefold"].setdefault(rel_path.casefold(), []).append(rel_path)
+        groups["basename"].setdefault(basename, []).append(rel_path)
+        groups["basename_casefold"].setdefault(basename.casefold(), []).append(rel_path)
+    return {
+        name: {key: _preferred(paths) for key, paths in group.items()}
+        for name, group in groups.items()
+    }
+
+
+def resolve(manifest, asset_path):
+    """
+    Resolves a requested asset path to a file in the manifest, or None.
+
+    Lookups go exact path, case-folded path, file name, case-folded file
+    name, each a single dict hit against the index built at publish time.
+    """
+    path = _normalize_path(asset_path)
+    if path in manifest["files"]:
+        return path
+    index = manifest["index"]
+    basename = path.rsplit('/', 1)[-1]
+    return (
+        index["casefold"].get(path.casefold())
+        or index["basename"].get(basename)
+        or index["basename_casefold"].get(basename.casefold())
+    )
+
+
+def publish(zip_source, mode=None):
+    """
+    Adds a ZIP to the store unless an identical archive is already there.
+
+    Args:
+        zip_source (bytes or str): The ZIP file content as bytes, or a path to the ZIP file
+        mode (str, optional): "extract" or "archive"; defaults to ZIP_STORE_MODE
+
+    Returns:
+        tuple: (digest, files_dir, manifest)
+            - digest: SHA-256 of the ZIP bytes
+            - files_dir: Directory holding the extracted files (extract mode only)
+            - manifest: {"mode": mode, "size": bytes_on_disk, "files": {relative_path: size},
+              "index": resolution maps from build_index, ...}
+    """
+    digest = _digest(zip_source)
+    manifest = _read_manifest(digest)
+    if manifest is not None:
+        _touch(digest)
+        return digest, os.path.join(_entry_dir(digest), FILES_DIR), manifest
+
+    _ensure_root()
+    staging_dir = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=ZIP_STORE_DIR)
+    try:
+        if (mode or ZIP_STORE_MODE) == "archive":
+            manifest = _store_archive(zip_source, staging_dir)
+        else:
+            manifest = _extract(zip_source, staging_dir)
+        manifest["sha256"] = digest
+        manifest["index"] = build_index(manifest["files"])
+        with open(os.path.join(staging_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        try:
+            os.rename(staging_dir, _entry_dir(digest))
+        except OSError:
+            # Another worker published the same archive first; use theirs
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            manifest = _read_manifest(digest)
+            if manifest is None:
+                raise
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    evict(keep=digest)
+    return digest, os.path.join(_entry_dir(digest), FILES_DIR), manifest
+
+
+def lookup(digest):
+    """Returns (files_dir, manifest) for a published archive, or None"""
+    manifest = _read_manifest(digest)
+    if manifest is None:
+        return None
+    _touch(digest)
+    return os.path.join(_entry_dir(digest), FILES_DIR), manifest
+
+
+@functools.lru_cache(maxsize=64)
+def _archive_map(digest):
+    # Archives are content-addressed, so a map stays valid even if the entry
+    # is published again; evict() clears the cache so removed files are freed
+    with open(os.path.join(_entry_dir(digest), ARCHIVE_NAME), 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_file(digest, manifest, rel_path):
+    """Returns the full content of one file from a published archive"""
+    if manifest.get("mode") != "archive":
+        with open(os.path.join(_entry_dir(digest), FILES_DIR, *rel_path.split('/')), 'rb') as f:
+            return f.read()
+    return b''.join(iter_file(digest, manifest, rel_path))
+
+
+def iter_file(digest, manifest, rel_path, start=0, end=None):
+    """
+    Streams bytes start..end (inclusive) of one file in an archive-mode entry.
+
+    Stored members are yielded as memoryview slices of the archive's memory
+    map, so a range request only touches the pages it returns. Deflated
+    members are inflated incrementally and stop as soon as end is reached.
+    """
+    member = manifest["members"][rel_path]
+    size = manifest["files"][rel_path]
+    if end is None or end >= size:
+        end = size - 1
+    if start > end:
+        return
+
+    data = memoryview(_archive_map(digest))
+    offset = member["offset"]
+
+    if member["compress_type"] == zipfile.ZIP_STORED and not member["encrypted"]:
+        for chunk_start in range(offset + start, offset + end + 1, MEMBER_CHUNK_SIZE):
+            yield data[chunk_start:min(chunk_start + MEMBER_CHUNK_SIZE, offset + end + 1)]
+        return
+
+    # Compressed members are decoded from the beginning; skip up to start and
+    # stop decoding once end has been produced
+    position = 0
+    for chunk in _decompressed_chunks(data, member):
+        chunk_from = max(start - position, 0)
+        chunk_to = min(end - position + 1, len(chunk))
+        if chunk_from < chunk_to:
+            yield chunk[chunk_from:chunk_to]
+        position += len(chunk)
+        if position > end:
+            return
+
+
+def _decompressed_chunks(data, member):
+    if member["compress_type"] == zipfile.ZIP_DEFLATED and not member["encrypted"]:
+        inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        offset = member["offset"]
+        compressed_end = offset + member["compress_size"]
+        for chunk_start in range(offset, compressed_end, MEMBER_CHUNK_SIZE):
+            chunk = inflater.decompress(data[chunk_start:min(chunk_start + MEMBER_CHUNK_SIZE, compressed_end)])
+            if chunk:
+                yield chunk
+        chunk = inflater.flush()
+        if chunk:
+            yield chunk
+        return
+
+    # Other compression methods are rare in practice; let zipfile decode them
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_ref, zip_ref.open(member["name"]) as src:
+        while True:
+            chunk = src.read(MEMBER_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def file_etag(digest, rel_path):
+    """Strong ETag for one file of a published archive"""
+    return f'"{digest[:32]}-{hashlib.sha256(rel_path.encode("utf-8")).hexdigest()[:16]}"'
+
+
+def set_ref(submission_id, digest):
+    """Points a submission at a published archive"""
+    _ensure_root()
+    ref_path = _ref_path(submission_id)
+    tmp_path = f"{ref_path}.{os.urandom(4).hex()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(digest)
+    os.replace(tmp_path, ref_path)
+
+
+def get_ref(submission_id):
+    """Returns the archive digest recorded for a submission, or None"""
+    try:
+        with open(_ref_path(submission_id), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def clear_ref(submission_id):
+    try:
+        os.remove(_ref_path(submission_id))
+    except OSError:
+        pass
+
+
+def evict(max_bytes=None, keep=None):
+    """
+    Removes least recently used archives until the store fits in max_bytes,
+    along with staging and trash directories left behind by crashed workers.
+    The archive named by keep (usually the one just published) is never removed.
+
+    Returns:
+        int: Number of directories removed
+    """
+    if max_bytes is None:
+        max_bytes = ZIP_STORE_MAX_BYTES
+    if not os.path.isdir(ZIP_STORE_DIR):
+        return 0
+
+    removed = 0
+    entries = []
+    total_size = 0
+    now = time.time()
+    for name in os.listdir(ZIP_STORE_DIR):
+        path = os.path.join(ZIP_STORE_DIR, name)
+        if name == REFS_DIR or not os.path.isdir(path):
+            continue
+        if name.startswith((STAGING_PREFIX, TRASH_PREFIX)):
+            # Leftovers from an interrupted publish or removal
+            try:
+                if now - os.path.getmtime(path) > 3600:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                pass
+            continue
+        manifest_path = os.path.join(path, MANIFEST_NAME)
+        try:
+            last_used = os.path.getmtime(manifest_path)
+            size = _load_manifest(name).get("size", 0)
+        except (OSError, ValueError):
+            continue
+        total_size += size
+        if name != keep:
+            entries.append((last_used, size, path))
+
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= max_bytes:
+            break
+        if _remove_dir(path):
+            print(f"Evicted extracted ZIP {os.path.basename(path)} ({size} bytes)")
+            total_size -= size
+            removed += 1
+    if removed:
+        # Cached maps keep deleted archive files allocated on disk; drop them so
+        # the space is freed (maps still being streamed close when the reader finishes)
+        _archive_map.cache_clear()
+    return removed